@@ -0,0 +1,138 @@
+import asyncio
+import os
+import time
+
+from metrics import METRICAS
+
+
+class ControladorConcurrencia:
+    """
+    Límite adaptativo de peticiones en vuelo (AIMD, como el control de congestión de TCP).
+
+    Cada respuesta sana suma 1/limite al límite (+1 por cada ronda completa de peticiones)
+    y un 429, un 5xx o un error de red lo multiplican por 'factor_recorte'. Si la latencia
+    media de una fase se aleja de la de referencia más de 'tolerancia_latencia' veces,
+    el servidor se está saturando: se recorta con suavidad antes de que lleguen los 429.
+    La referencia es la mejor media vista, salvo que tras 'recortes_sin_mejora' recortes
+    seguidos (o ya en el mínimo) la latencia no haya bajado: entonces no la causa la
+    concurrencia sino la red o AEMET, la media actual pasa a ser la referencia y se vuelve
+    a crecer.
+    Con X-RateLimit-Remaining a 0 se deja de crecer. Los recortes se espacian al menos
+    'enfriamiento' segundos para que una ráfaga de errores de la misma ronda cuente una vez.
+    """
+    def __init__(self, inicial=None, minimo=None, maximo=None, factor_recorte=0.5,
+                 tolerancia_latencia=2.0, enfriamiento=1.0, recortes_sin_mejora=3, adaptativo=None):
+        inicial = inicial or int(os.getenv("AEMET_CONCURRENCIA", "8"))
+        self.adaptativo = adaptativo if adaptativo is not None else os.getenv("AEMET_CONCURRENCIA_ADAPTATIVA", "1") == "1"
+        if self.adaptativo:
+            self.minimo = minimo or int(os.getenv("AEMET_CONCURRENCIA_MIN", "1"))
+            self.maximo = maximo or int(os.getenv("AEMET_CONCURRENCIA_MAX", "64"))
+        else:
+            # Sin adaptación el límite es fijo: el comportamiento de siempre
+            self.minimo = self.maximo = inicial
+        self.limite = float(min(self.maximo, max(self.minimo, inicial)))
+        self.factor_recorte = factor_recorte
+        self.tolerancia_latencia = tolerancia_latencia
+        self.enfriamiento = enfriamiento
+        self.recortes_sin_mejora = recortes_sin_mejora
+        self.en_vuelo = 0
+        self.latencia_media = {}
+        self.latencia_base = {}
+        # Por fase, mientras la latencia está alta: (media al empezar a recortar, recortes hechos)
+        self.episodio_latencia = {}
+        self.ultimo_recorte = 0.0
+        self.limite_maximo_alcanzado = self.limite
+        self._condicion = None
+        self._anotar_limite()
+
+    @property
+    def limite_actual(self):
+        return max(self.minimo, int(self.limite))
+
+    def _condicion_bucle(self):
+        # La condición se crea dentro del bucle de eventos que la va a usar
+        if self._condicion is None:
+            self._condicion = asyncio.Condition()
+        return self._condicion
+
+    async def adquirir(self):
+        condicion = self._condicion_bucle()
+        async with condicion:
+            await condicion.wait_for(lambda: self.en_vuelo < self.limite_actual)
+            self.en_vuelo += 1
+
+    async def liberar(self):
+        condicion = self._condicion_bucle()
+        async with condicion:
+            self.en_vuelo -= 1
+            condicion.notify(max(1, self.limite_actual - self.en_vuelo))
+
+    def _anotar_limite(self):
+        self.limite_maximo_alcanzado = max(self.limite_maximo_alcanzado, self.limite)
+        METRICAS.observar("concurrencia_limite", self.limite_actual)
+
+    def _recortar(self, motivo, factor):
+        # Devuelve si se ha recortado (no se hace durante el enfriamiento ni en el mínimo)
+        ahora = time.monotonic()
+        if ahora - self.ultimo_recorte < self.enfriamiento or self.limite <= self.minimo:
+            return False
+        self.ultimo_recorte = ahora
+        self.limite = max(float(self.minimo), self.limite * factor)
+        METRICAS.incrementar("concurrencia_recortes_total", motivo=motivo)
+        self._anotar_limite()
+        return True
+
+    def _aumentar(self):
+        if self.limite >= self.maximo:
+            return
+        anterior = self.limite_actual
+        self.limite = min(float(self.maximo), self.limite + 1.0 / self.limite)
+        if self.limite_actual != anterior:
+            self._anotar_limite()
+
+    def registrar(self, fase, estado, latencia, restantes=None):
+        """
+        Ajusta el límite con el resultado de una petición (estado None = error de red o timeout).
+        """
+        if not self.adaptativo:
+            return
+        if estado is None:
+            self._recortar("error_red", self.factor_recorte)
+            return
+        if estado == 429 or estado >= 500:
+            self._recortar(f"http_{estado}", self.factor_recorte)
+            return
+
+        # Media móvil exponencial de la latencia y la mejor media vista en esta fase
+        media = self.latencia_media.get(fase)
+        media = latencia if media is None else 0.8 * media + 0.2 * latencia
+        self.latencia_media[fase] = media
+        base = self.latencia_base[fase] = min(self.latencia_base.get(fase, media), media)
+        if media <= base * self.tolerancia_latencia:
+            self.episodio_latencia.pop(fase, None)
+            if restantes is None or restantes.strip() != "0":
+                self._aumentar()
+            return
+
+        inicio, recortes = self.episodio_latencia.get(fase, (media, 0))
+        if recortes >= self.recortes_sin_mejora and media < inicio * 0.9:
+            # Los recortes están bajando la latencia: es saturación, se sigue recortando
+            inicio, recortes = media, 0
+        if recortes >= self.recortes_sin_mejora or self.limite <= self.minimo:
+            # Recortar no la baja: la latencia alta es la nueva normal y se vuelve a crecer
+            self.latencia_base[fase] = media
+            self.episodio_latencia.pop(fase, None)
+            METRICAS.incrementar("concurrencia_referencia_renovada_total", fase=fase)
+            return
+        if self._recortar("latencia", 0.9):
+            recortes += 1
+        self.episodio_latencia[fase] = (inicio, recortes)
+
+    def resumen(self):
+        return {
+            "adaptativo": self.adaptativo,
+            "limite_final": self.limite_actual,
+            "limite_maximo_alcanzado": int(self.limite_maximo_alcanzado),
+            "minimo": self.minimo,
+            "maximo": self.maximo,
+        }
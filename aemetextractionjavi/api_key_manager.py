@@ -1,46 +1,95 @@
+import asyncio
+import logging
+import os
 import threading
 import time
+from collections import deque
+
+from metrics import METRICAS
+
 
 class APIKeyManager:
-    def __init__(self, api_keys):
-        self.api_keys = api_keys
+    """
+    Planificador de peticiones sobre el conjunto de API keys de AEMET.
+
+    Cada clave tiene un cubo de tokens con ventana deslizante: como mucho
+    'limite_por_minuto' peticiones en cualquier intervalo de 'ventana' segundos.
+    Las peticiones reservan el primer hueco libre de la clave que antes lo tenga
+    y esperan fuera del lock, así que el lock solo se mantiene para la reserva.
+    """
+    def __init__(self, api_keys, limite_por_minuto=None, ventana=60.0):
+        self.api_keys = list(api_keys)
+        if not self.api_keys:
+            # Sin claves cada petición fallaría por separado y la ejecución acabaría sin filas
+            raise ValueError("No hay API keys de AEMET configuradas: define AEMET_API_KEY, AEMET_API_KEY_2... "
+                             "en el entorno o en el fichero de AEMET_FICHERO_ENTORNO.")
         self.lock = threading.Lock()
-        self.limite_por_minuto = 20
+        self.limite_por_minuto = limite_por_minuto or int(os.getenv("AEMET_LIMITE_POR_MINUTO", "20"))
+        self.ventana = ventana
         self.uso_keys = {key: {
-            "ocupada": False,
-            "peticiones": 0,
-            "minuto": self._minuto_actual()
-        } for key in api_keys}
+            "reservas": deque(),
+            "bloqueada_hasta": 0.0,
+        } for key in self.api_keys}
+        self.segundos_esperados = 0.0
 
-    def _minuto_actual(self):
-        return int(time.time() // 60)
+    def _purgar(self, key, ahora):
+        reservas = self.uso_keys[key]["reservas"]
+        while reservas and reservas[0] <= ahora - self.ventana:
+            reservas.popleft()
 
-    def _reset_si_cambio_de_minuto(self, key):
-        minuto_actual = self._minuto_actual()
-        if self.uso_keys[key]["minuto"] != minuto_actual:
-            self.uso_keys[key]["peticiones"] = 0
-            self.uso_keys[key]["minuto"] = minuto_actual
+    def _siguiente_hueco(self, key, ahora):
+        reservas = self.uso_keys[key]["reservas"]
+        hueco = max(ahora, self.uso_keys[key]["bloqueada_hasta"])
+        if len(reservas) >= self.limite_por_minuto:
+            hueco = max(hueco, reservas[-self.limite_por_minuto] + self.ventana)
+        if reservas:
+            # Las reservas de una clave se mantienen ordenadas
+            hueco = max(hueco, reservas[-1])
+        return hueco
 
-    def obtener_api_key(self):
-        with self.lock:
-            while True:
-                for key in self.api_keys:
-                    self._reset_si_cambio_de_minuto(key)
-                    estado = self.uso_keys[key]
-                    if not estado["ocupada"] and estado["peticiones"] < self.limite_por_minuto:
-                        estado["ocupada"] = True
-                        estado["peticiones"] += 1
-                        return key
-
-                print("⏳ Todas las claves están ocupadas o en su límite. Esperando 5s...")
-                time.sleep(5)
-
-    def liberar_api_key(self, key):
+    def reservar_api_key(self):
+        """
+        Reserva el próximo hueco libre entre todas las claves sin bloquear.
+        Devuelve la clave y los segundos que hay que esperar antes de usarla.
+        """
         with self.lock:
-            if key in self.uso_keys:
-                self.uso_keys[key]["ocupada"] = False
+            ahora = time.monotonic()
+            mejor_key, mejor_hueco = None, None
+            for key in self.api_keys:
+                self._purgar(key, ahora)
+                hueco = self._siguiente_hueco(key, ahora)
+                if mejor_hueco is None or hueco < mejor_hueco:
+                    mejor_key, mejor_hueco = key, hueco
+            estado = self.uso_keys[mejor_key]
+            estado["reservas"].append(mejor_hueco)
+            espera = max(0.0, mejor_hueco - ahora)
+            self.segundos_esperados += espera
+        METRICAS.incrementar("peticiones_por_clave_total", clave=self.indice(mejor_key))
+        METRICAS.observar("espera_clave_s", espera)
+        return mejor_key, espera
 
-    def anotar_peticion(self, key):
+    def obtener_api_key(self):
+        key, espera = self.reservar_api_key()
+        if espera > 0:
+            logging.debug(f"⏳ Todas las claves en su límite. Esperando {espera:.1f}s por la clave {self.indice(key)}...")
+            time.sleep(espera)
+        return key
+
+    async def obtener_api_key_async(self):
+        key, espera = self.reservar_api_key()
+        if espera > 0:
+            logging.debug(f"⏳ Todas las claves en su límite. Esperando {espera:.1f}s por la clave {self.indice(key)}...")
+            await asyncio.sleep(espera)
+        return key
+
+    def penalizar_api_key(self, key, segundos):
+        # Deja fuera solo esta clave hasta que el servidor vuelva a aceptarla
         with self.lock:
-            self._reset_si_cambio_de_minuto(key)
-            self.uso_keys[key]["peticiones"] += 1
+            hasta = time.monotonic() + segundos
+            estado = self.uso_keys[key]
+            estado["bloqueada_hasta"] = max(estado["bloqueada_hasta"], hasta)
+        METRICAS.incrementar("claves_penalizadas_total", clave=self.indice(key))
+
+    def indice(self, key):
+        # Numeración humana de la clave para los mensajes
+        return self.api_keys.index(key) + 1
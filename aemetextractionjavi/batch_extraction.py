@@ -0,0 +1,120 @@
+import concurrent.futures
+import csv
+import datetime
+import itertools
+import logging
+import os
+import threading
+
+from connection import AemetAPIClient
+from endpoints import ENDPOINTS
+from flattener import NULO_CSV
+from metrics import METRICAS
+from structured_logging import ProgresoMuestreado
+
+# Salida de cada endpoint en una ejecución por lotes
+PATRON_SALIDA = "{endpoint}_{fecha}.csv"
+
+
+class EscritorFilas:
+    """
+    CSV de un endpoint en el que varios hilos escriben filas según llegan sus respuestas.
+    """
+    def __init__(self, ruta, cabecera):
+        self.ruta = ruta
+        self.lock = threading.Lock()
+        self.filas = 0
+        self._csv = open(ruta, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._csv)
+        self._writer.writerow(cabecera)
+
+    def escribir(self, filas):
+        with self.lock:
+            self._writer.writerows([NULO_CSV if valor is None else valor for valor in fila] for fila in filas)
+            self.filas += len(filas)
+
+    def cerrar(self):
+        with self.lock:
+            self._csv.close()
+
+
+def _claves(endpoint, fuentes):
+    # Pares (clave, registro de la fuente) que hay que pedir para un endpoint
+    if endpoint.fuente is None:
+        return [(None, None)]
+    if endpoint.fuente == "municipios":
+        return [(m["codigo_municipio"], m) for m in fuentes["municipios"]]
+    if endpoint.fuente == "estaciones":
+        return [(e["indicativo"], e) for e in fuentes["estaciones"]]
+    raise ValueError(f"Fuente de claves desconocida para {endpoint}: {endpoint.fuente}")
+
+
+def intercalar(listas):
+    """
+    Reparte las peticiones de varios endpoints por turnos (a1, b1, c1, a2, b2...) para que
+    todos avancen a la vez y compartan la cuota de las claves durante toda la ejecución.
+    """
+    vacio = object()
+    return [tarea for grupo in itertools.zip_longest(*listas, fillvalue=vacio) for tarea in grupo if tarea is not vacio]
+
+
+def _extraer_tarea(cliente, endpoint, clave, registro, escritor):
+    datos = cliente.obtener(endpoint, clave)
+    if datos is None:
+        METRICAS.incrementar("endpoint_peticiones_total", endpoint=endpoint.nombre, resultado="fallida")
+        return {"endpoint": endpoint.nombre, "clave": clave, "motivo": cliente.motivo_fallo(clave or endpoint.nombre)}
+    escritor.escribir(endpoint.aplanar(registro, datos) if datos else [])
+    METRICAS.incrementar("endpoint_peticiones_total", endpoint=endpoint.nombre, resultado="ok")
+    return None
+
+
+def extraer_endpoints(nombres, municipios=None, estaciones=None, api_keys=None, hilos=None, directorio=".", fecha=None):
+    """
+    Extrae varios endpoints en una sola ejecución con un único cliente (mismo pool HTTP,
+    planificador de claves, política de reintentos y caché). Las peticiones de todos los
+    endpoints se intercalan, así que ninguno espera a que termine otro. Devuelve, por
+    endpoint, la ruta del CSV, las filas escritas y las peticiones fallidas.
+    """
+    endpoints = [ENDPOINTS[nombre] for nombre in nombres]
+    fuentes = {"municipios": municipios or [], "estaciones": estaciones or []}
+    fecha = fecha or datetime.datetime.now().strftime("%Y-%m-%d")
+    cliente = AemetAPIClient(api_keys)
+    hilos = hilos or int(os.getenv("AEMET_HILOS_ENDPOINTS", str(min(16, 2 * max(1, len(cliente.api_keys))))))
+
+    escritores = {
+        endpoint.nombre: EscritorFilas(os.path.join(directorio, PATRON_SALIDA.format(endpoint=endpoint.nombre, fecha=fecha)),
+                                       endpoint.cabecera())
+        for endpoint in endpoints
+    }
+    tareas = intercalar([[(endpoint, clave, registro) for clave, registro in _claves(endpoint, fuentes)]
+                         for endpoint in endpoints])
+    print(f"🧭 Extracción por lotes de {', '.join(nombres)}: {len(tareas)} peticiones con {hilos} hilos.")
+
+    fallidas = []
+    progreso = ProgresoMuestreado(len(tareas), "Extracción por lotes")
+    try:
+        with METRICAS.tramo("extraccion_endpoints", endpoints=",".join(nombres), peticiones=len(tareas)), \
+                concurrent.futures.ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="endpoints_hilo") as pool:
+            futuros = [pool.submit(_extraer_tarea, cliente, endpoint, clave, registro, escritores[endpoint.nombre])
+                       for endpoint, clave, registro in tareas]
+            for futuro in concurrent.futures.as_completed(futuros):
+                try:
+                    fallida = futuro.result()
+                except Exception as e:
+                    logging.error(f"❌ Error procesando una petición por lotes: {e}")
+                    fallida = {"endpoint": None, "clave": None, "motivo": type(e).__name__}
+                if fallida:
+                    fallidas.append(fallida)
+                progreso.avanzar()
+    finally:
+        for escritor in escritores.values():
+            escritor.cerrar()
+
+    logging.info(f"📶 Estadísticas HTTP: {cliente.estadisticas_conexion()}")
+    resultado = {}
+    for endpoint in endpoints:
+        escritor = escritores[endpoint.nombre]
+        fallidas_endpoint = [f for f in fallidas if f["endpoint"] == endpoint.nombre]
+        resultado[endpoint.nombre] = {"ruta": escritor.ruta, "filas": escritor.filas, "fallidas": fallidas_endpoint}
+        print(f"✅ {endpoint.nombre}: {escritor.filas} filas en '{escritor.ruta}', {len(fallidas_endpoint)} peticiones fallidas")
+    return resultado
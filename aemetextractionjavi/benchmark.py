@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from fake_aemet import ConfiguracionFake, arrancar_servidor
+
+# Número de municipios del catálogo completo del INE
+TODOS_LOS_MUNICIPIOS = 8132
+
+
+def _municipios(tamano, ruta="municipios.json"):
+    # Si hay municipios.json se usan sus códigos (repetidos en ciclo si hacen falta más)
+    if os.path.exists(ruta):
+        with open(ruta, "r", encoding="utf-8") as f:
+            base = json.load(f)
+    else:
+        base = [{"codigo_municipio": f"{i:05d}", "NOMBRE": f"Municipio {i}"} for i in range(1, TODOS_LOS_MUNICIPIOS + 1)]
+    return [base[i % len(base)] for i in range(tamano)]
+
+
+def ejecutar_escenario(motor, tamano, concurrencia=None):
+    """
+    Ejecuta una extracción contra AEMET_BASE_URL y devuelve sus métricas. Se llama en un
+    proceso nuevo por escenario para que el pico de memoria sea el de esa ejecución.
+    """
+    from connection import procesar_municipios_async, procesar_municipios_sin_hilos
+    from utils import api_keys_entorno
+
+    municipios = _municipios(tamano)
+    api_keys = api_keys_entorno()
+    estadisticas = {}
+    descartar = lambda resultado: None
+
+    inicio = time.perf_counter()
+    if motor == "async":
+        predicciones, fallidos = procesar_municipios_async(
+            municipios, api_keys, concurrencia, destino=descartar, acumular=False, estadisticas=estadisticas)
+    else:
+        predicciones, fallidos = procesar_municipios_sin_hilos(
+            municipios, api_keys, destino=descartar, acumular=False, estadisticas=estadisticas)
+    duracion = time.perf_counter() - inicio
+
+    peticiones = sum(v["peticiones"] for v in estadisticas.values() if isinstance(v, dict) and "peticiones" in v)
+    return {
+        "motor": motor,
+        "municipios": tamano,
+        "fallidos": len(fallidos),
+        "duracion_s": round(duracion, 3),
+        "peticiones": peticiones,
+        "peticiones_por_s": round(peticiones / duracion, 1) if duracion else None,
+        "municipios_por_s": round(tamano / duracion, 1) if duracion else None,
+        "primer_get": estadisticas.get("primer_get"),
+        "segundo_get": estadisticas.get("segundo_get"),
+        "segundos_espera_reintentos": estadisticas.get("segundos_espera_reintentos"),
+        "segundos_espera_claves": estadisticas.get("segundos_espera_claves"),
+        "concurrencia": estadisticas.get("concurrencia"),
+        # En Linux ru_maxrss viene en KiB
+        "pico_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def _lanzar_escenario(motor, tamano, entorno, concurrencia=None):
+    comando = [sys.executable, os.path.abspath(__file__), "--escenario", motor, "--tamanos", str(tamano)]
+    if concurrencia:
+        comando += ["--concurrencia", str(concurrencia)]
+    salida = subprocess.run(comando, env=entorno, capture_output=True, text=True, check=True)
+    # El resultado es la última línea; el resto es el log de la extracción
+    return json.loads(salida.stdout.strip().splitlines()[-1])
+
+
+def _imprimir_tabla(resultados):
+    columnas = ["motor", "municipios", "fallidos", "duracion_s", "peticiones_por_s", "p50_s", "p99_s",
+                "espera_s", "limite_final", "pico_rss_mb"]
+    print(" | ".join(f"{c:>16}" for c in columnas))
+    for r in resultados:
+        primer = r.get("primer_get") or {}
+        fila = [r["motor"], r["municipios"], r["fallidos"], r["duracion_s"], r["peticiones_por_s"],
+                primer.get("p50_s"), primer.get("p99_s"),
+                round((r["segundos_espera_reintentos"] or 0) + (r["segundos_espera_claves"] or 0), 3),
+                (r.get("concurrencia") or {}).get("limite_final"), r["pico_rss_mb"]]
+        print(" | ".join(f"{str(v):>16}" for v in fila))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de extracción contra el servidor falso de AEMET")
+    parser.add_argument("--tamanos", default=f"10,1000,{TODOS_LOS_MUNICIPIOS}",
+                        help="Número de municipios de cada escenario, separados por comas")
+    parser.add_argument("--motores", default="secuencial,async")
+    parser.add_argument("--concurrencia", type=int, default=None,
+                        help="Tope de peticiones en vuelo del motor async (sin indicar: límite adaptativo)")
+    parser.add_argument("--claves", type=int, default=4, help="Número de API keys falsas")
+    parser.add_argument("--limite-cliente", type=int, default=100000,
+                        help="AEMET_LIMITE_POR_MINUTO que usa el planificador de claves")
+    parser.add_argument("--latencia", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--cuota", type=int, default=0, help="Cuota por clave y minuto del servidor (0 = sin límite)")
+    parser.add_argument("--prob-500", type=float, default=0.0)
+    parser.add_argument("--prob-timeout", type=float, default=0.0)
+    parser.add_argument("--capacidad", type=int, default=0, help="Peticiones que el servidor atiende a la vez (0 = sin límite)")
+    parser.add_argument("--salida", default=None, help="Fichero JSON donde guardar los resultados")
+    parser.add_argument("--escenario", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.escenario:
+        print(json.dumps(ejecutar_escenario(args.escenario, int(args.tamanos), args.concurrencia)))
+        return
+
+    configuracion = ConfiguracionFake(args.latencia, args.jitter, args.cuota, args.prob_500, args.prob_timeout,
+                                      duracion_timeout=10.0, capacidad=args.capacidad)
+    servidor = arrancar_servidor(configuracion)
+    print(f"🧪 AEMET falso en {servidor.base_url}")
+
+    entorno = {k: v for k, v in os.environ.items() if not k.startswith("AEMET_API_KEY")}
+    entorno.update({
+        "AEMET_BASE_URL": servidor.base_url,
+        # Solo las claves falsas: el .env con las claves reales no se carga en los escenarios
+        "AEMET_FICHERO_ENTORNO": os.devnull,
+        "AEMET_CACHE": "0",
+        "AEMET_LIMITE_POR_MINUTO": str(args.limite_cliente),
+        "AEMET_TIMEOUT_LECTURA": "5",
+    })
+    entorno.update({f"AEMET_API_KEY_{i}": f"clave-falsa-{i}" for i in range(1, args.claves + 1)})
+
+    resultados = []
+    for tamano in (int(t) for t in args.tamanos.split(",")):
+        for motor in args.motores.split(","):
+            print(f"⏱️ {motor} con {tamano} municipios...")
+            resultados.append(_lanzar_escenario(motor, tamano, entorno, args.concurrencia))
+
+    _imprimir_tabla(resultados)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultados, f, indent=2)
+        print(f"💾 Resultados guardados en '{args.salida}'")
+    servidor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import logging
+
+from google.cloud import bigquery
+
+from flattener import columnas_tipadas
+
+
+def esquema_bigquery():
+    # Mismo esquema que el Parquet generado por parquet_writer
+    return [bigquery.SchemaField(nombre, tipo, mode="NULLABLE") for nombre, tipo in columnas_tipadas()]
+
+
+def cargar_parquet_a_bigquery(client, origen, table_ref, write_disposition=bigquery.WriteDisposition.WRITE_APPEND):
+    """
+    Carga un fichero Parquet en BigQuery. 'origen' puede ser una URI gs:// (el mismo objeto
+    subido al bucket, sin volver a transferirlo) o una ruta local.
+    """
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        schema=esquema_bigquery(),
+        write_disposition=write_disposition,
+    )
+
+    job = _lanzar_carga(client, origen, table_ref, job_config)
+
+    logging.info(f"✅ Carga Parquet completada desde '{origen}' en '{table_ref}' ({job.output_rows} filas).")
+    return job
+
+
+def cargar_particion(client, origen, table_ref, fecha_carga):
+    """
+    Sustituye de forma atómica la partición del día de carga: un único job WRITE_TRUNCATE
+    sobre 'tabla$YYYYMMDD', particionada por 'fecha_carga'. Las demás particiones no se
+    tocan y los lectores nunca ven la tabla vacía.
+    """
+    particion = f"{table_ref}${fecha_carga.strftime('%Y%m%d')}"
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        schema=esquema_bigquery(),
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+        time_partitioning=bigquery.TimePartitioning(
+            type_=bigquery.TimePartitioningType.DAY,
+            field="fecha_carga",
+        ),
+    )
+    job = _lanzar_carga(client, origen, particion, job_config)
+    logging.info(f"✅ Partición '{particion}' reemplazada ({job.output_rows} filas).")
+    return job
+
+
+def cargar_staging_merge(client, origen, table_ref, fecha_carga=None):
+    """
+    Carga en una tabla de staging y la fusiona en la tabla final con un MERGE por
+    (codigo_municipio, fecha): las filas existentes se actualizan y las nuevas se insertan
+    en una sola sentencia atómica. La staging se borra aunque el MERGE falle.
+    """
+    staging_ref = f"{table_ref}_staging"
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.PARQUET,
+        schema=esquema_bigquery(),
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+    )
+    _lanzar_carga(client, origen, staging_ref, job_config)
+
+    columnas = [nombre for nombre, _ in columnas_tipadas()]
+    actualizaciones = ", ".join(f"`{c}` = S.`{c}`" for c in columnas)
+    lista_columnas = ", ".join(f"`{c}`" for c in columnas)
+    query = f"""
+        MERGE `{table_ref}` T
+        USING `{staging_ref}` S
+        ON T.codigo_municipio = S.codigo_municipio AND T.fecha = S.fecha
+        WHEN MATCHED THEN UPDATE SET {actualizaciones}
+        WHEN NOT MATCHED THEN INSERT ({lista_columnas}) VALUES ({lista_columnas})
+    """
+    try:
+        job = client.query(query)
+        job.result()
+    finally:
+        client.delete_table(staging_ref, not_found_ok=True)
+    logging.info(f"✅ MERGE completado en '{table_ref}' ({job.num_dml_affected_rows} filas afectadas).")
+    return job
+
+
+def _lanzar_carga(client, origen, destino, job_config):
+    if origen.startswith("gs://"):
+        job = client.load_table_from_uri(origen, destino, job_config=job_config)
+    else:
+        with open(origen, "rb") as source_file:
+            job = client.load_table_from_file(source_file, destino, job_config=job_config)
+    job.result()
+    return job
+
+
+# Estrategias de refresco atómico seleccionables con BQ_ESTRATEGIA_CARGA
+ESTRATEGIAS = {
+    "particion": cargar_particion,
+    "merge": cargar_staging_merge,
+}
+
+
+def cargar_con_estrategia(client, estrategia, origen, table_ref, fecha_carga):
+    if estrategia not in ESTRATEGIAS:
+        raise ValueError(f"Estrategia de carga desconocida '{estrategia}'. Opciones: {', '.join(ESTRATEGIAS)}")
+    return ESTRATEGIAS[estrategia](client, origen, table_ref, fecha_carga)
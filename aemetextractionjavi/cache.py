@@ -0,0 +1,125 @@
+import datetime
+import logging
+import os
+import threading
+import time
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from serialization import a_texto, desde_texto
+
+
+class CachePredicciones:
+    """
+    Caché local en disco de las predicciones por municipio.
+
+    Cada entrada guarda el payload de 'datos', su fecha 'elaborado' y los validadores
+    HTTP (ETag / Last-Modified) de la descarga. Una entrada se sirve sin tocar la API
+    mientras no supere el TTL y la predicción no tenga más de 'max_elaborado' segundos
+    desde que AEMET la elaboró; pasado ese tiempo se vuelve a pedir y, si AEMET no ha
+    publicado una versión nueva, solo se renueva la fecha de guardado.
+    """
+    def __init__(self, directorio=None, ttl=None, max_elaborado=None):
+        self.directorio = directorio or os.getenv("AEMET_CACHE_DIR", "cache_predicciones")
+        self.ttl = ttl if ttl is not None else int(os.getenv("AEMET_CACHE_TTL", str(3 * 3600)))
+        self.max_elaborado = max_elaborado if max_elaborado is not None else int(os.getenv("AEMET_CACHE_MAX_ELABORADO", str(24 * 3600)))
+        self.lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        os.makedirs(self.directorio, exist_ok=True)
+
+    def _ruta(self, codigo_municipio):
+        return os.path.join(self.directorio, f"{codigo_municipio}.json")
+
+    def entrada(self, codigo_municipio):
+        ruta = self._ruta(codigo_municipio)
+        if not os.path.exists(ruta):
+            return None
+        try:
+            with open(ruta, "rb") as f:
+                return desde_texto(f.read())
+        except (OSError, ValueError) as e:
+            logging.error(f"❌ Entrada de caché corrupta para {codigo_municipio}: {e}")
+            return None
+
+    def _escribir(self, codigo_municipio, entrada):
+        # Escritura atómica para no dejar entradas a medias si el proceso muere
+        ruta = self._ruta(codigo_municipio)
+        tmp = f"{ruta}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(a_texto(entrada))
+        os.replace(tmp, ruta)
+
+    def obtener(self, codigo_municipio, ttl=None):
+        """
+        Devuelve el payload guardado si sigue vigente o None si hay que pedirlo a la API.
+        'ttl' sustituye al TTL de la caché para endpoints que se renuevan con otra frecuencia.
+        """
+        entrada = self.entrada(codigo_municipio)
+        ttl = self.ttl if ttl is None else ttl
+        vigente = (entrada is not None and time.time() - entrada.get("guardado", 0) < ttl
+                   and not self._elaborado_caducado(entrada.get("elaborado")))
+        with self.lock:
+            if vigente:
+                self.aciertos += 1
+                return entrada["datos"]
+            self.fallos += 1
+        return None
+
+    def _elaborado_caducado(self, elaborado):
+        # 'elaborado' viene en hora peninsular sin zona; sin fecha legible manda solo el TTL
+        if not elaborado:
+            return False
+        try:
+            fecha = datetime.datetime.fromisoformat(elaborado)
+            if fecha.tzinfo is None:
+                fecha = fecha.replace(tzinfo=ZoneInfo("Europe/Madrid"))
+        except (TypeError, ValueError, ZoneInfoNotFoundError):
+            return False
+        return (datetime.datetime.now(datetime.timezone.utc) - fecha).total_seconds() >= self.max_elaborado
+
+    def validadores(self, codigo_municipio):
+        """
+        Cabeceras de petición condicional para la descarga de 'datos'.
+        """
+        entrada = self.entrada(codigo_municipio)
+        headers = {}
+        if entrada:
+            if entrada.get("etag"):
+                headers["If-None-Match"] = entrada["etag"]
+            if entrada.get("last_modified"):
+                headers["If-Modified-Since"] = entrada["last_modified"]
+        return headers
+
+    def guardar(self, codigo_municipio, datos, headers=None):
+        headers = headers or {}
+        elaborado = datos[0].get("elaborado") if isinstance(datos, list) and datos else None
+        self._escribir(codigo_municipio, {
+            "codigo_municipio": codigo_municipio,
+            "guardado": time.time(),
+            "elaborado": elaborado,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "datos": datos,
+        })
+
+    def refrescar(self, codigo_municipio):
+        """
+        Renueva una entrada cuyo contenido no ha cambiado (respuesta 304) y devuelve su payload.
+        """
+        entrada = self.entrada(codigo_municipio)
+        if not entrada:
+            return None
+        entrada["guardado"] = time.time()
+        self._escribir(codigo_municipio, entrada)
+        return entrada["datos"]
+
+    def resumen(self):
+        with self.lock:
+            return {"aciertos": self.aciertos, "fallos": self.fallos}
+
+
+def crear_cache_por_defecto():
+    # La caché se puede desactivar con AEMET_CACHE=0
+    if os.getenv("AEMET_CACHE", "1") == "0":
+        return None
+    return CachePredicciones()
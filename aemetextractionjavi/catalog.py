@@ -0,0 +1,162 @@
+import array
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import sys
+
+from utils import normalizar
+
+# Cabecera del fichero binario: firma, sha256 del Excel, número de municipios
+# y tamaños de los bloques de nombres y nombres normalizados
+MAGIA = b"AEMETCAT"
+FORMATO_CABECERA = "<8s32sIII"
+TAMANO_CABECERA = struct.calcsize(FORMATO_CABECERA)
+ANCHO_CODIGO = 5
+
+
+def _hash_fichero(ruta):
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(1 << 16), b""):
+            h.update(bloque)
+    return h.digest()
+
+
+def _leer_excel(ruta_excel):
+    # openpyxl en modo solo lectura: mucho más rápido que pasar por pandas para 8.000 filas
+    import openpyxl
+
+    libro = openpyxl.load_workbook(ruta_excel, read_only=True)
+    codigos, nombres = [], []
+    # La primera fila es un título y la segunda los encabezados (CODAUTO, CPRO, CMUN, DC, NOMBRE)
+    for fila in libro.active.iter_rows(min_row=3, values_only=True):
+        if not fila or fila[1] is None:
+            continue
+        _, cpro, cmun, _, nombre = fila[:5]
+        codigos.append(str(cpro).zfill(2) + str(cmun).zfill(3))
+        nombres.append(str(nombre))
+    libro.close()
+    return codigos, nombres
+
+
+def _bloque_textos(textos):
+    # Textos concatenados en UTF-8 con un array de desplazamientos (n + 1 posiciones)
+    codificados = [t.encode("utf-8") for t in textos]
+    desplazamientos = array.array("I", [0])
+    for c in codificados:
+        desplazamientos.append(desplazamientos[-1] + len(c))
+    return desplazamientos, b"".join(codificados)
+
+
+class CatalogoMunicipios:
+    """
+    Catálogo de municipios del INE con búsquedas por código, provincia y nombre normalizado.
+
+    Se construye a partir de diccionario24.xlsx solo cuando cambia el hash del Excel; el
+    resto de ejecuciones abre con mmap una versión binaria compacta (códigos de ancho fijo
+    y nombres en bloques UTF-8 con desplazamientos) sin volver a pasar por openpyxl.
+    """
+    def __init__(self, codigos, nombres, nombres_normalizados):
+        self.codigos = codigos
+        self.nombres = nombres
+        self.nombres_normalizados = nombres_normalizados
+        self._indice_codigo = None
+        self._indice_provincia = None
+        self._indice_nombre = None
+
+    def __len__(self):
+        return len(self.codigos)
+
+    @classmethod
+    def desde_excel(cls, ruta_excel):
+        codigos, nombres = _leer_excel(ruta_excel)
+        nombres = [sys.intern(n) for n in nombres]
+        return cls(codigos, nombres, [normalizar(n) for n in nombres])
+
+    def guardar(self, ruta, hash_excel):
+        desp_nombres, nombres = _bloque_textos(self.nombres)
+        desp_norm, normalizados = _bloque_textos(self.nombres_normalizados)
+        tmp = f"{ruta}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(struct.pack(FORMATO_CABECERA, MAGIA, hash_excel, len(self), len(nombres), len(normalizados)))
+            f.write("".join(self.codigos).encode("ascii"))
+            f.write(desp_nombres.tobytes())
+            f.write(nombres)
+            f.write(desp_norm.tobytes())
+            f.write(normalizados)
+        os.replace(tmp, ruta)
+
+    @staticmethod
+    def hash_guardado(ruta):
+        if not os.path.exists(ruta) or os.path.getsize(ruta) < TAMANO_CABECERA:
+            return None
+        with open(ruta, "rb") as f:
+            magia, hash_excel, *_ = struct.unpack(FORMATO_CABECERA, f.read(TAMANO_CABECERA))
+        return hash_excel if magia == MAGIA else None
+
+    @classmethod
+    def desde_binario(cls, ruta):
+        with open(ruta, "rb") as f:
+            datos = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _, _, n, tam_nombres, tam_norm = struct.unpack_from(FORMATO_CABECERA, datos, 0)
+        pos = TAMANO_CABECERA
+
+        bloque_codigos = datos[pos:pos + n * ANCHO_CODIGO].decode("ascii")
+        codigos = [bloque_codigos[i:i + ANCHO_CODIGO] for i in range(0, n * ANCHO_CODIGO, ANCHO_CODIGO)]
+        pos += n * ANCHO_CODIGO
+
+        def leer_textos(pos, tamano):
+            desplazamientos = array.array("I")
+            desplazamientos.frombytes(datos[pos:pos + (n + 1) * desplazamientos.itemsize])
+            pos += (n + 1) * desplazamientos.itemsize
+            bloque = datos[pos:pos + tamano]
+            textos = [sys.intern(bloque[desplazamientos[i]:desplazamientos[i + 1]].decode("utf-8")) for i in range(n)]
+            return textos, pos + tamano
+
+        nombres, pos = leer_textos(pos, tam_nombres)
+        normalizados, pos = leer_textos(pos, tam_norm)
+        datos.close()
+        return cls(codigos, nombres, normalizados)
+
+    def _municipio(self, i):
+        return {"codigo_municipio": self.codigos[i], "NOMBRE": self.nombres[i]}
+
+    def como_lista(self):
+        # Mismo formato que municipios.json
+        return [self._municipio(i) for i in range(len(self))]
+
+    def por_codigo(self, codigo_municipio):
+        if self._indice_codigo is None:
+            self._indice_codigo = {codigo: i for i, codigo in enumerate(self.codigos)}
+        i = self._indice_codigo.get(codigo_municipio)
+        return self._municipio(i) if i is not None else None
+
+    def por_provincia(self, cpro):
+        if self._indice_provincia is None:
+            self._indice_provincia = {}
+            for i, codigo in enumerate(self.codigos):
+                self._indice_provincia.setdefault(codigo[:2], []).append(i)
+        return [self._municipio(i) for i in self._indice_provincia.get(str(cpro).zfill(2), [])]
+
+    def por_nombre(self, nombre):
+        if self._indice_nombre is None:
+            self._indice_nombre = {}
+            for i, normalizado in enumerate(self.nombres_normalizados):
+                self._indice_nombre.setdefault(normalizado, []).append(i)
+        return [self._municipio(i) for i in self._indice_nombre.get(normalizar(nombre), [])]
+
+
+def cargar_catalogo(ruta_excel="diccionario24.xlsx", ruta_binario="catalogo_municipios.bin"):
+    """
+    Devuelve el catálogo de municipios, reconstruyendo el binario solo si el Excel ha cambiado.
+    """
+    hash_excel = _hash_fichero(ruta_excel)
+    if CatalogoMunicipios.hash_guardado(ruta_binario) == hash_excel:
+        return CatalogoMunicipios.desde_binario(ruta_binario)
+
+    logging.info(f"📚 '{ruta_excel}' ha cambiado, regenerando '{ruta_binario}'...")
+    catalogo = CatalogoMunicipios.desde_excel(ruta_excel)
+    catalogo.guardar(ruta_binario, hash_excel)
+    return catalogo
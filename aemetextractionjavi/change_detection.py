@@ -0,0 +1,56 @@
+import hashlib
+import logging
+import os
+
+from flattener import CABECERA
+from serialization import a_texto, desde_texto
+
+
+class DetectorCambios:
+    """
+    Detecta qué filas aplanadas (municipio + fecha) han cambiado desde la última carga.
+
+    Guarda en un fichero local una huella estable de cada fila y solo deja pasar las filas
+    nuevas o con contenido distinto. El estado se sustituye por el de la ejecución actual,
+    así que no crece con los días, y solo debe guardarse cuando la carga ha terminado bien.
+    """
+    def __init__(self, ruta=None):
+        self.ruta = ruta or os.getenv("AEMET_RUTA_HUELLAS", "huellas_predicciones.json")
+        self.anteriores = {}
+        self.actuales = {}
+        self.filas_nuevas = 0
+        self.filas_sin_cambios = 0
+        if os.path.exists(self.ruta):
+            try:
+                with open(self.ruta, "rb") as f:
+                    self.anteriores = desde_texto(f.read())
+            except (OSError, ValueError) as e:
+                logging.error(f"❌ No se pudo leer el estado de huellas '{self.ruta}', se recargará todo: {e}")
+
+    @staticmethod
+    def huella(fila):
+        contenido = "\x1f".join("" if valor is None else str(valor) for valor in fila)
+        return hashlib.blake2b(contenido.encode("utf-8"), digest_size=8).hexdigest()
+
+    def filtrar(self, columnas):
+        """
+        Devuelve solo las posiciones de 'columnas' cuya huella es nueva o ha cambiado.
+        """
+        posiciones = []
+        for i, fila in enumerate(zip(*(columnas[columna] for columna in CABECERA))):
+            clave = f"{columnas['codigo_municipio'][i]}|{columnas['fecha'][i]}"
+            huella = self.huella(fila)
+            self.actuales[clave] = huella
+            if self.anteriores.get(clave) == huella:
+                self.filas_sin_cambios += 1
+            else:
+                self.filas_nuevas += 1
+                posiciones.append(i)
+        return {columna: [valores[i] for i in posiciones] for columna, valores in columnas.items()}
+
+    def guardar(self):
+        tmp = f"{self.ruta}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(a_texto(self.actuales))
+        os.replace(tmp, self.ruta)
+        logging.info(f"🔏 Huellas actualizadas: {self.filas_nuevas} filas nuevas o cambiadas, {self.filas_sin_cambios} sin cambios.")
@@ -0,0 +1,116 @@
+import logging
+import os
+import threading
+
+from serialization import a_texto, desde_texto
+
+
+class DiarioEjecucion:
+    """
+    Diario append-only (NDJSON) de los municipios ya resueltos en una ejecución.
+
+    Cada línea registra un municipio completado (con su predicción) o fallido.
+    Las líneas se acumulan en memoria y se vuelcan a disco por lotes, de modo que
+    si el proceso muere solo se pierde el último lote y '--resume' puede continuar.
+    """
+    def __init__(self, ruta, tamano_lote=None):
+        self.ruta = ruta
+        self.tamano_lote = tamano_lote or int(os.getenv("AEMET_TAMANO_LOTE_DIARIO", "50"))
+        self.lock = threading.Lock()
+        self.pendientes = []
+
+    def reiniciar(self):
+        with self.lock:
+            self.pendientes = []
+            open(self.ruta, "w", encoding="utf-8").close()
+
+    def _registrar(self, registro):
+        with self.lock:
+            self.pendientes.append(a_texto(registro))
+            if len(self.pendientes) >= self.tamano_lote:
+                self._volcar()
+
+    def registrar_completado(self, prediccion_municipio):
+        # Acepta PrediccionCompacta (se guarda su forma JSON) o un diccionario
+        if hasattr(prediccion_municipio, "a_dict"):
+            prediccion_municipio = prediccion_municipio.a_dict()
+        self._registrar({"estado": "ok", **prediccion_municipio})
+
+    def registrar_fallido(self, municipio):
+        self._registrar({"estado": "fallido", **municipio})
+
+    def _volcar(self):
+        if not self.pendientes:
+            return
+        with open(self.ruta, "a", encoding="utf-8") as f:
+            f.write("\n".join(self.pendientes) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.pendientes = []
+
+    def volcar(self):
+        with self.lock:
+            self._volcar()
+
+    def cerrar(self):
+        self.volcar()
+
+    def _recortar_linea_cortada(self):
+        # Si el proceso murió a mitad de un volcado la última línea queda sin '\n'. Se quita para
+        # que los registros que se añadan al reanudar no se peguen a ella.
+        with open(self.ruta, "rb+") as f:
+            fin = f.seek(0, os.SEEK_END)
+            if fin == 0:
+                return
+            f.seek(fin - 1)
+            if f.read(1) == b"\n":
+                return
+            # Se busca el último '\n' leyendo hacia atrás por bloques, sin cargar todo el diario
+            cola, inicio = b"", fin
+            while inicio > 0 and b"\n" not in cola:
+                bloque = min(65536, inicio)
+                inicio -= bloque
+                f.seek(inicio)
+                cola = f.read(bloque) + cola
+            corte = inicio + cola.rfind(b"\n") + 1
+            try:
+                desde_texto(cola[corte - inicio:])
+                f.write(b"\n")
+                return
+            except ValueError:
+                pass
+            f.truncate(corte)
+        logging.warning(f"⚠️ Última línea del diario '{self.ruta}' incompleta ({fin - corte} bytes), se descarta.")
+
+    def cargar(self):
+        """
+        Lee el diario y devuelve dos diccionarios por código de municipio: completados y fallidos.
+        Si un municipio aparece varias veces manda su último registro.
+        """
+        completados, fallidos = {}, {}
+        if not os.path.exists(self.ruta):
+            return completados, fallidos
+
+        self._recortar_linea_cortada()
+        # En binario: una línea cortada a mitad de un carácter UTF-8 no rompe la lectura del resto
+        with open(self.ruta, "rb") as f:
+            for numero, linea in enumerate(f, start=1):
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    registro = desde_texto(linea)
+                    codigo = registro["codigo_municipio"]
+                except (ValueError, TypeError, KeyError):
+                    logging.error(f"❌ Línea {numero} del diario '{self.ruta}' ilegible, se ignora.")
+                    continue
+                estado = registro.pop("estado", "ok")
+                if estado == "ok":
+                    completados[codigo] = registro
+                    fallidos.pop(codigo, None)
+                else:
+                    fallidos[codigo] = registro
+                    completados.pop(codigo, None)
+
+        logging.info(f"📒 Diario '{self.ruta}': {len(completados)} completados, {len(fallidos)} fallidos.")
+        return completados, fallidos
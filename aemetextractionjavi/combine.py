@@ -1,12 +1,6 @@
-import json
-import unicodedata
-import pandas as pd
 import os
-
-
-def normalizar(nombre: str) -> str:
-    nfkd = unicodedata.normalize('NFKD', nombre)
-    return ''.join([c for c in nfkd if not unicodedata.combining(c)]).upper()
+from matcher import indice_desde_fichero
+from serialization import a_texto
 
 
 def combinar_jsons(
@@ -15,31 +9,30 @@ def combinar_jsons(
     output_json=None,
     output_csv=None
 ):
-    # Cargar los JSONs
-    with open(municipios_path, "r", encoding="utf-8") as f:
-        municipios = json.load(f)
-
-    # Crear mapa de nombre normalizado -> código
-    mapa_codigos = {
-        normalizar(m["nombre"]): m["codigo_municipio"]
-        for m in municipios
-    }
-
-    # Añadir código a cada entrada meteorológica
-    for entry in meteo_data:
-        nombre_norm = normalizar(entry["nombre"])
-        entry["codigo"] = mapa_codigos.get(nombre_norm, None)
-
-    if not os.path.exists(os.path.dirname(output_json)):
+    # Índice de nombres de municipio (se reutiliza entre llamadas mientras no cambie el fichero)
+    indice = indice_desde_fichero(municipios_path)
+
+    # Añadir código a cada entrada meteorológica, emparejando todo el lote de una vez
+    codigos = indice.emparejar_lote([entry.get("nombre") for entry in meteo_data])
+    for entry, codigo in zip(meteo_data, codigos):
+        entry["codigo"] = codigo
+
+    if output_json and os.path.dirname(output_json) and not os.path.exists(os.path.dirname(output_json)):
         os.makedirs(os.path.dirname(output_json))
 
-    # Guardar como JSON si se especifica
+    # Guardar como JSON compacto si se especifica (o NDJSON, una entrada por línea, si la ruta acaba en .ndjson)
     if output_json:
         with open(output_json, "w", encoding="utf-8") as f:
-            json.dump(meteo_data, f, ensure_ascii=False, indent=2)
+            if output_json.endswith(".ndjson"):
+                for entry in meteo_data:
+                    f.write(a_texto(entry) + "\n")
+            else:
+                f.write(a_texto(meteo_data))
 
     # Guardar como CSV si se especifica
     if output_csv:
+        import pandas as pd
+
         df = pd.DataFrame(meteo_data)
         df.to_csv(output_csv, index=False, encoding="utf-8")
 
@@ -2,140 +2,358 @@ import requests
 import os
 import time
 import logging
-from dotenv import load_dotenv
-from tqdm import tqdm
-import datetime
-import json
 import threading
-from utils import espera_con_barra
+from requests.adapters import HTTPAdapter
+from retry_policy import PoliticaReintentos
+from api_key_manager import APIKeyManager
+from cache import crear_cache_por_defecto
+from metrics import METRICAS
+from flattener import PrediccionCompacta
+from endpoints import DIARIA
+from utils import api_keys_entorno, cargar_entorno
+from serialization import decodificar_datos, decodificar_respuesta
+from structured_logging import ProgresoMuestreado
 
 
-class AemetAPIClient:
+# URL base de la API (se puede apuntar al servidor local de fake_aemet.py para pruebas y benchmarks)
+BASE_URL = os.getenv("AEMET_BASE_URL", "https://opendata.aemet.es/opendata/api")
+
+# Tiempos máximos de conexión y de lectura de cada GET, en segundos
+TIMEOUT_CONEXION = float(os.getenv("AEMET_TIMEOUT_CONEXION", "5"))
+TIMEOUT_LECTURA = float(os.getenv("AEMET_TIMEOUT_LECTURA", "30"))
+TAMANO_POOL = int(os.getenv("AEMET_TAMANO_POOL", "16"))
+
+_sesion_http = None
+_lock_sesion = threading.Lock()
+
+
+def obtener_sesion_http():
+    """
+    Devuelve la sesión HTTP compartida por todos los clientes y hilos del proceso,
+    con un pool de conexiones keep-alive dimensionado con AEMET_TAMANO_POOL.
+    """
+    global _sesion_http
+    with _lock_sesion:
+        if _sesion_http is None:
+            sesion = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=TAMANO_POOL, pool_block=True)
+            sesion.mount("https://", adaptador)
+            sesion.mount("http://", adaptador)
+            sesion.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
+            _sesion_http = sesion
+        return _sesion_http
+
+
+class EstadisticasConexion:
+    """
+    Acumula latencias por fase y aperturas/reutilizaciones de conexiones del pool.
+    """
     def __init__(self):
-        load_dotenv()
+        self.lock = threading.Lock()
+        self.latencias = {"primer_get": [], "segundo_get": []}
+        self.conexiones_nuevas = 0
+        self.conexiones_reutilizadas = 0
+
+    def registrar_latencia(self, fase, segundos):
+        with self.lock:
+            self.latencias[fase].append(segundos)
+        METRICAS.observar("http_latencia_s", segundos, fase=fase)
+
+    def registrar_respuesta(self, fase, estado, bytes_recibidos):
+        METRICAS.incrementar("http_respuestas_total", fase=fase, estado=estado)
+        if bytes_recibidos:
+            METRICAS.incrementar("http_bytes_total", bytes_recibidos, fase=fase)
+
+    def registrar_conexion(self, reutilizada):
+        with self.lock:
+            if reutilizada:
+                self.conexiones_reutilizadas += 1
+            else:
+                self.conexiones_nuevas += 1
+
+    def resumen(self):
+        with self.lock:
+            resumen = {
+                "conexiones_nuevas": self.conexiones_nuevas,
+                "conexiones_reutilizadas": self.conexiones_reutilizadas,
+            }
+            for fase, valores in self.latencias.items():
+                ordenados = sorted(valores)
+                resumen[fase] = {
+                    "peticiones": len(ordenados),
+                    "media_s": round(sum(ordenados) / len(ordenados), 4) if ordenados else None,
+                    "p50_s": round(ordenados[len(ordenados) // 2], 4) if ordenados else None,
+                    "p99_s": round(ordenados[min(len(ordenados) - 1, int(len(ordenados) * 0.99))], 4) if ordenados else None,
+                }
+            return resumen
+
+
+def _estadisticas_pool_requests(sesion):
+    # urllib3 lleva la cuenta de conexiones abiertas y peticiones servidas por cada pool
+    nuevas, peticiones = 0, 0
+    for adaptador in set(sesion.adapters.values()):
+        gestor = getattr(adaptador, "poolmanager", None)
+        if gestor is None:
+            continue
+        for clave in gestor.pools.keys():
+            pool = gestor.pools[clave]
+            nuevas += pool.num_connections
+            peticiones += pool.num_requests
+    return nuevas, max(0, peticiones - nuevas)
+
+
+def resolver_segundo_get(estado, cabeceras, contenido, etiqueta, campos, cache=None, clave_cache=None, decodificar=decodificar_datos):
+    """
+    Decide qué hacer con la respuesta del segundo GET (el fichero de 'datos'). Es común al
+    cliente síncrono y al asíncrono; cada uno solo hace la petición y la espera.
+
+    Devuelve (datos, reintentar): 'datos' con el payload si la descarga ha terminado bien
+    (200, o 304 servido desde la caché) y 'reintentar' True si hay que esperar lo que indiquen
+    las cabeceras y repetir (429 y 5xx). Con (None, False) no se vuelve a intentar.
+    Un contenido ilegible lanza ValueError, que los clientes tratan como un fallo más.
+    """
+    if estado == 304 and cache:
+        return cache.refrescar(clave_cache), False
+    if estado == 200:
+        datos = decodificar(contenido, cabeceras.get("Content-Type"))
+        if cache:
+            cache.guardar(clave_cache, datos, cabeceras)
+        return datos, False
+    if estado == 429 or estado >= 500:
+        logging.error(
+            f"⚠️ [{etiqueta}] Segundo GET → Error {estado}. "
+            f"Retry-After: {cabeceras.get('Retry-After')}, "
+            f"Remaining: {cabeceras.get('X-RateLimit-Remaining')}, "
+            f"Reset: {cabeceras.get('X-RateLimit-Reset')}",
+            extra={**campos, "estado": estado}
+        )
+        return None, True
+    logging.error(f"❌ [{etiqueta}] Segundo GET → Error inesperado ({estado}): {contenido[:500].decode('utf-8', 'replace')}",
+                  extra={**campos, "estado": estado})
+    return None, False
+
+
+class AemetAPIClient:
+    def __init__(self, api_keys=None, gestor_claves=None, politica=None, cache=None):
+        cargar_entorno()
         
 
-        self.api_keys = [value for key, value in os.environ.items() if key.startswith("AEMET_API_KEY")]
-        self.api_key_index = 0
-        self.api_key = self.api_keys[self.api_key_index]
-        self.base_url = "https://opendata.aemet.es/opendata/api"
+        self.api_keys = api_keys or api_keys_entorno()
+        self.base_url = BASE_URL
         self.headers = {'cache-control': "no-cache"}
-        self.request_count = 0
-
-    def _cambiar_api_key(self):
-        hilo = threading.current_thread().name
-        anterior = self.api_key_index + 1  # +1 para numeración humana
-        self.api_key_index = (self.api_key_index + 1) % len(self.api_keys)  # Vuelve al inicio al llegar al final
-        self.api_key = self.api_keys[self.api_key_index]
-        actual = self.api_key_index + 1
-        print(f"🔁 {hilo} - Cambiando de API key {anterior} ➡️ {actual}")
-
-    def obtener_prediccion_municipio(self, codigo_municipio, intentos=3, tiempo_espera=60):
-        url = f"{self.base_url}/prediccion/especifica/municipio/diaria/{codigo_municipio}"
+        # El planificador reparte las peticiones entre todas las claves respetando su límite
+        self.gestor_claves = gestor_claves or APIKeyManager(self.api_keys)
+        self.api_keys = self.gestor_claves.api_keys
+        self.politica = politica or PoliticaReintentos()
+        self.cache = cache if cache is not None else crear_cache_por_defecto()
+        self.session = obtener_sesion_http()
+        self.timeout = (TIMEOUT_CONEXION, TIMEOUT_LECTURA)
+        self.estadisticas = EstadisticasConexion()
+        # Motivo del último fallo de cada petición (por etiqueta) para la cola de fallidos
+        self.motivos_fallo = {}
+
+    def _get(self, fase, url, etiqueta=None, **kwargs):
+        inicio = time.perf_counter()
+        estado = None
+        try:
+            kwargs.setdefault("headers", self.headers)
+            response = self.session.get(url, timeout=self.timeout, **kwargs)
+            estado = response.status_code
+            self.estadisticas.registrar_respuesta(fase, estado, len(response.content))
+            return response
+        except requests.exceptions.RequestException as e:
+            METRICAS.incrementar("http_errores_total", fase=fase, tipo=type(e).__name__)
+            raise
+        finally:
+            latencia = time.perf_counter() - inicio
+            self.estadisticas.registrar_latencia(fase, latencia)
+            # Una línea por petición solo con AEMET_LOG_NIVEL=DEBUG; si no, ni se construye
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"[{etiqueta}] {fase} → {estado}",
+                              extra={"municipio": etiqueta, "fase": fase, "estado": estado, "latencia_s": round(latencia, 4)})
+
+    def estadisticas_conexion(self):
+        resumen = self.estadisticas.resumen()
+        resumen["segundos_espera_reintentos"] = round(self.politica.segundos_esperados, 3)
+        resumen["segundos_espera_claves"] = round(self.gestor_claves.segundos_esperados, 3)
+        if self.cache:
+            resumen["cache"] = self.cache.resumen()
+        resumen["conexiones_nuevas"], resumen["conexiones_reutilizadas"] = _estadisticas_pool_requests(self.session)
+        return resumen
+
+    def _anotar_fallo(self, etiqueta, motivo):
+        self.motivos_fallo[etiqueta] = motivo
+        METRICAS.incrementar("peticiones_fallidas_total", motivo=motivo)
+
+    def motivo_fallo(self, etiqueta):
+        # Devuelve (y olvida) por qué falló la última petición con esta etiqueta
+        return self.motivos_fallo.pop(etiqueta, "desconocido")
+
+    def obtener_prediccion_municipio(self, codigo_municipio, intentos=None):
+        return self.obtener(DIARIA, codigo_municipio, intentos)
+
+    def obtener(self, endpoint, clave=None, intentos=None):
+        """
+        Pide a AEMET el payload de un endpoint (ver endpoints.py) para una clave (código de
+        municipio, indicativo de estación...) pasando por la caché si el endpoint la usa.
+        """
+        clave_cache = endpoint.clave_cache(clave) if self.cache else None
+        if clave_cache:
+            datos = self.cache.obtener(clave_cache, endpoint.ttl_cache)
+            if datos is not None:
+                return datos
+        etiqueta = clave or endpoint.nombre
+        return self.obtener_datos(endpoint.url(self.base_url, clave), etiqueta, intentos,
+                                  clave_cache=clave_cache, decodificar=endpoint.decodificar)
+
+    def obtener_datos(self, url, etiqueta, intentos=None, clave_cache=None, decodificar=decodificar_datos):
+        """
+        Petición en dos pasos de AEMET OpenData para cualquier endpoint: el primer GET devuelve
+        la URL de 'datos' y el segundo el contenido. Devuelve [] si AEMET responde que no hay
+        datos para la consulta y None si no se han podido obtener.
+        """
+        intentos = intentos or self.politica.intentos
+        motivo = "desconocido"
         for intento in range(1, intentos + 1):
+            api_key = self.gestor_claves.obtener_api_key()
+            campos = {"municipio": etiqueta, "clave": self.gestor_claves.indice(api_key), "intento": intento, "fase": "primer_get"}
             try:
-                params = {"api_key": self.api_key}
-                response = requests.get(url, headers=self.headers, params=params)
-                self.request_count += 1
-                if self.request_count >= 19:
-                    self._cambiar_api_key()
-                    self.request_count = 0
+                params = {"api_key": api_key}
+                response = self._get("primer_get", url, etiqueta=etiqueta, params=params)
+                motivo = f"http_{response.status_code}"
                 if response.status_code == 200:
-                    json_url = response.json().get("datos", None)
+                    cuerpo = decodificar_respuesta(response.content, response.headers.get("Content-Type"))
+                    json_url = cuerpo.get("datos", None)
                     if json_url:
-                        return self._descargar_datos_json(json_url, tiempo_espera)
+                        return self._descargar_datos_json(json_url, clave_cache, etiqueta, decodificar)
+                    elif cuerpo.get("estado") == 404:
+                        logging.warning(f"[{etiqueta}] Sin datos: {cuerpo.get('descripcion')}")
+                        return []
                     else:
-                        logging.error(f"La API no devolvió la clave 'datos'. Respuesta: {response.json()}")
+                        motivo = "sin_url_datos"
+                        logging.error(f"La API no devolvió la clave 'datos'. Respuesta: {cuerpo}")
+                elif response.status_code == 404:
+                    # AEMET responde 404 cuando la consulta es válida pero no hay datos
+                    logging.warning(f"[{etiqueta}] Sin datos (404).")
+                    return []
                 elif response.status_code == 429:
-                    logging.error(f"Demasiadas solicitudes (429). Esperando {tiempo_espera} segundos...")
-                    espera_con_barra(tiempo_espera, mensaje="Esperando debido a un error 429")
+                    # Solo se aparta la clave afectada; el siguiente intento usa otra
+                    espera = self.politica.reservar_espera(intento, response.headers)
+                    if espera is None:
+                        break
+                    logging.error(f"[{etiqueta}] Demasiadas solicitudes (429) con la API key {campos['clave']}. Clave en pausa {espera:.1f}s...",
+                                  extra={**campos, "estado": 429})
+                    self.gestor_claves.penalizar_api_key(api_key, espera)
                 elif response.status_code == 500:
-                    logging.error(f"Error del servidor (500). Esperando {tiempo_espera} segundos...")
-                    espera_con_barra(tiempo_espera, mensaje="Esperando debido a un error 500")
+                    logging.error(f"[{etiqueta}] Error del servidor (500). Reintentando ({intento}/{intentos})...",
+                                  extra={**campos, "estado": 500})
+                    if not self.politica.esperar(intento, response.headers):
+                        break
                 else:
-                    logging.error(f"Error inesperado ({response.status_code}): {response.text}")
+                    logging.error(f"[{etiqueta}] Error inesperado ({response.status_code}): {response.text}",
+                                  extra={**campos, "estado": response.status_code})
             except requests.exceptions.ConnectionError:
-                logging.error(f"[{codigo_municipio}] Error de conexión. Reintentando ({intento}/{intentos})...")
-                espera_con_barra(tiempo_espera, mensaje="Esperando debido a un error de conexión")
+                motivo = "conexion"
+                logging.error(f"[{etiqueta}] Error de conexión. Reintentando ({intento}/{intentos})...", extra=campos)
+                if not self.politica.esperar(intento):
+                    break
             except requests.exceptions.Timeout:
-                logging.error(f"[{codigo_municipio}] La solicitud tardó demasiado. Reintentando ({intento}/{intentos})...")
-                espera_con_barra(tiempo_espera, mensaje="Esperando debido a un timeout")
-            except requests.exceptions.RequestException as e:
-                logging.error(f"[{codigo_municipio}] Error inesperado en el primer GET: {e}")
+                motivo = "timeout"
+                logging.error(f"[{etiqueta}] La solicitud tardó demasiado. Reintentando ({intento}/{intentos})...", extra=campos)
+                if not self.politica.esperar(intento):
+                    break
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logging.error(f"[{etiqueta}] Error inesperado en el primer GET: {e}", extra=campos)
+                self._anotar_fallo(etiqueta, type(e).__name__)
                 return None
-        logging.error(f"[{codigo_municipio}] No se pudo obtener predicción tras {intentos} intentos.")
+        logging.error(f"[{etiqueta}] No se pudieron obtener los datos tras {intentos} intentos.",
+                      extra={"municipio": etiqueta, "intento": intentos, "motivo": motivo})
+        self._anotar_fallo(etiqueta, motivo)
         return None
 
 
-    def _descargar_datos_json(self, json_url, tiempo_espera):
+    def _descargar_datos_json(self, json_url, clave_cache=None, etiqueta=None, decodificar=decodificar_datos):
         """
         Descarga y devuelve los datos JSON desde la URL proporcionada, manejando errores.
+        Los 429 y 5xx se reintentan esperando lo que indiquen las cabeceras de la respuesta.
+        Solo se usa la caché si se indica su clave ('clave_cache').
         """
-        try:
-            response_data = requests.get(json_url, headers=self.headers)
-            if response_data.status_code == 200:
-                return response_data.json()
-            elif response_data.status_code == 429:
-                error_message = f"⚠️ Segundo GET → Demasiadas solicitudes (429). Esperando {tiempo_espera} segundos..."
-                # Obtener el tiempo de reset y convertirlo
-                reset_timestamp = response_data.headers.get("X-RateLimit-Reset")
-                if reset_timestamp:
-                    reset_time = datetime.datetime.utcfromtimestamp(int(reset_timestamp))
-                    reset_time_local = reset_time.strftime('%Y-%m-%d %H:%M:%S')
-                    print(f"⏱️ Reset Time (UTC): {reset_time_local} local time")
-                
-                print("🔁 Retry-After:", response_data.headers.get("Retry-After"))
-                print("📊 Rate Limit:", response_data.headers.get("X-RateLimit-Limit"))
-                print("📉 Remaining:", response_data.headers.get("X-RateLimit-Remaining"))
-                print("⏱️ Reset Time:", response_data.headers.get("X-RateLimit-Reset"))
-                logging.error(error_message)
-                print(error_message)
-                espera_con_barra(tiempo_espera, mensaje="Esperando debido a un error 429 en el segundo GET")
-            else:
-                error_message = f"❌ Segundo GET → Error inesperado ({response_data.status_code}): {response_data.text}"
-                logging.error(error_message)
-                print(error_message)
-                #espera_con_barra(tiempo_espera)
-        except requests.exceptions.RequestException as e:
-            error_message = f"❌ Segundo GET → Excepción durante la solicitud: {e}"
-            logging.error(error_message)
-            print(error_message)
-            #espera_con_barra(tiempo_espera)
+        cache = self.cache if clave_cache else None
+        etiqueta = etiqueta or clave_cache
+        motivo = "desconocido"
+        for intento in range(1, self.politica.intentos + 1):
+            campos = {"municipio": etiqueta, "intento": intento, "fase": "segundo_get"}
+            try:
+                validadores = cache.validadores(clave_cache) if cache else {}
+                response_data = self._get("segundo_get", json_url, etiqueta=etiqueta, headers={**self.headers, **validadores})
+                motivo = f"datos_http_{response_data.status_code}"
+                datos, reintentar = resolver_segundo_get(response_data.status_code, response_data.headers, response_data.content,
+                                                         etiqueta, campos, cache, clave_cache, decodificar)
+                if datos is not None:
+                    return datos
+                if not reintentar or not self.politica.esperar(intento, response_data.headers):
+                    break
+            except (requests.exceptions.RequestException, ValueError) as e:
+                motivo = f"datos_{type(e).__name__}"
+                logging.error(f"❌ [{etiqueta}] Segundo GET → Excepción durante la solicitud: {e}", extra=campos)
+                if not self.politica.esperar(intento):
+                    break
 
+        self._anotar_fallo(etiqueta, motivo)
         return None
 
-def procesar_municipios_sin_hilos(fragmento_municipios, api_keys):
-    cliente = AemetAPIClient()
-    cliente.api_keys = api_keys
-    cliente.api_key = api_keys[0]
-    cliente.api_key_index = 0
-    cliente.request_count = 0
+def procesar_municipios_sin_hilos(fragmento_municipios, api_keys, diario=None, destino=None, acumular=True, estadisticas=None, politica=None, gestor_claves=None):
+    # 'destino' recibe cada predicción en cuanto llega; con acumular=False no se guardan en memoria.
+    # Cada municipio se pide una sola vez (con los reintentos de la política): los que fallan
+    # se devuelven con su motivo para la cola de fallidos en lugar de reintentarse aquí.
+    cliente = AemetAPIClient(api_keys, gestor_claves=gestor_claves, politica=politica)
 
     predicciones_municipios = []
     municipios_fallidos = []
+    progreso = ProgresoMuestreado(len(fragmento_municipios), "Extracción de predicciones")
 
-    for idx, municipio in enumerate(fragmento_municipios, start=1):
+    for municipio in fragmento_municipios:
         codigo = municipio["codigo_municipio"]
         nombre = municipio.get("NOMBRE", "Desconocido")
-        print(f"Procesando {idx}/{len(fragmento_municipios)}: {codigo} ({nombre})")
 
-        for intento in range(3):
-            try:
-                prediccion = cliente.obtener_prediccion_municipio(codigo)
-                if prediccion:
-                    for dia in prediccion:
-                        dia.pop("origen", None)
-                    predicciones_municipios.append({
-                        "codigo_municipio": codigo,
-                        "nombre": nombre,
-                        "prediccion": prediccion
-                    })
-                    break
-                elif intento == 2:
-                    municipios_fallidos.append({"codigo_municipio": codigo, "nombre": nombre})
-            except Exception as e:
-                if intento == 2:
-                    municipios_fallidos.append({"codigo_municipio": codigo, "nombre": nombre})
-                    logging.error(f"Error crítico procesando {codigo} ({nombre}): {e}")
+        try:
+            prediccion = cliente.obtener_prediccion_municipio(codigo)
+            motivo = cliente.motivo_fallo(codigo) if prediccion is None else "sin_datos"
+        except Exception as e:
+            prediccion, motivo = None, type(e).__name__
+            logging.error(f"Error crítico procesando {codigo} ({nombre}): {e}")
+        if prediccion:
+            # Se aplana al llegar y el árbol de diccionarios de AEMET se descarta
+            resultado = PrediccionCompacta.desde_aemet(codigo, nombre, prediccion)
+            if acumular:
+                predicciones_municipios.append(resultado)
+            if destino:
+                destino(resultado)
+            if diario:
+                diario.registrar_completado(resultado)
+        else:
+            municipios_fallidos.append({"codigo_municipio": codigo, "nombre": nombre, "motivo": motivo})
+            if diario:
+                diario.registrar_fallido(municipios_fallidos[-1])
+        progreso.avanzar()
 
+    resumen = cliente.estadisticas_conexion()
+    logging.info(f"📶 Estadísticas HTTP: {resumen}")
+    if estadisticas is not None:
+        estadisticas.update(resumen)
     return predicciones_municipios, municipios_fallidos
+
+
+def procesar_municipios_async(fragmento_municipios, api_keys, concurrencia=None, diario=None, destino=None, acumular=True, gestor_claves=None, estadisticas=None, politica=None, controlador=None):
+    """
+    Variante asíncrona de procesar_municipios_sin_hilos: mantiene como mucho 'concurrencia'
+    municipios en vuelo (o el límite adaptativo si no se indica) y devuelve el mismo par
+    (predicciones, fallidos).
+    """
+    # aiohttp solo se importa si se usa el motor asíncrono
+    import asyncio
+    from connection_async import _procesar_municipios_async
+
+    return asyncio.run(_procesar_municipios_async(
+        fragmento_municipios, api_keys, concurrencia, diario, destino, acumular, gestor_claves, estadisticas, politica,
+        controlador))
@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from adaptive_concurrency import ControladorConcurrencia
+from api_key_manager import APIKeyManager
+from cache import crear_cache_por_defecto
+from connection import BASE_URL, TAMANO_POOL, TIMEOUT_CONEXION, TIMEOUT_LECTURA, EstadisticasConexion, resolver_segundo_get
+from endpoints import DIARIA
+from flattener import PrediccionCompacta
+from metrics import METRICAS
+from retry_policy import PoliticaReintentos
+from serialization import decodificar_datos, decodificar_respuesta
+from structured_logging import ProgresoMuestreado
+from utils import api_keys_entorno, cargar_entorno
+
+
+class AemetAsyncAPIClient:
+    """
+    Cliente asíncrono equivalente a AemetAPIClient. Permite tener varios municipios
+    en vuelo a la vez encadenando el primer GET y la descarga de 'datos' en cada tarea.
+    El número de peticiones simultáneas lo decide el controlador de concurrencia según
+    los 429, los 5xx y la latencia que se van observando.
+    """
+    def __init__(self, api_keys=None, concurrencia=None, gestor_claves=None, politica=None, cache=None, controlador=None):
+        cargar_entorno()
+
+        self.api_keys = api_keys or api_keys_entorno()
+        self.base_url = BASE_URL
+        self.headers = {'cache-control': "no-cache"}
+        self.gestor_claves = gestor_claves or APIKeyManager(self.api_keys)
+        self.api_keys = self.gestor_claves.api_keys
+        self.politica = politica or PoliticaReintentos()
+        self.cache = cache if cache is not None else crear_cache_por_defecto()
+        # Una 'concurrencia' explícita es un tope: el límite se adapta por debajo de ella. Sin
+        # indicarla se empieza en AEMET_CONCURRENCIA y se puede crecer hasta AEMET_CONCURRENCIA_MAX.
+        # Se lanzan tantas tareas como el máximo del controlador
+        self.controlador = controlador or ControladorConcurrencia(concurrencia, maximo=concurrencia)
+        self.concurrencia = self.controlador.maximo
+        self.session = None
+        self.estadisticas = EstadisticasConexion()
+        # Motivo del último fallo de cada petición (por etiqueta) para la cola de fallidos
+        self.motivos_fallo = {}
+
+    async def __aenter__(self):
+        # Un único pool keep-alive para toda la ejecución; aiohttp descomprime gzip solo
+        conector = aiohttp.TCPConnector(
+            limit=max(TAMANO_POOL, self.concurrencia * 2),
+            keepalive_timeout=30,
+            ttl_dns_cache=300,
+        )
+        timeout = aiohttp.ClientTimeout(sock_connect=TIMEOUT_CONEXION, sock_read=TIMEOUT_LECTURA)
+        traza = aiohttp.TraceConfig()
+        traza.on_connection_create_end.append(self._al_crear_conexion)
+        traza.on_connection_reuseconn.append(self._al_reutilizar_conexion)
+        self.session = aiohttp.ClientSession(
+            connector=conector,
+            headers={**self.headers, "Accept-Encoding": "gzip, deflate"},
+            timeout=timeout,
+            trace_configs=[traza],
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _al_crear_conexion(self, session, contexto, params):
+        self.estadisticas.registrar_conexion(reutilizada=False)
+
+    async def _al_reutilizar_conexion(self, session, contexto, params):
+        self.estadisticas.registrar_conexion(reutilizada=True)
+
+    def _get(self, fase, url, etiqueta=None, **kwargs):
+        return _PeticionMedida(self, fase, self.session.get(url, **kwargs), etiqueta)
+
+    def estadisticas_conexion(self):
+        resumen = self.estadisticas.resumen()
+        resumen["segundos_espera_reintentos"] = round(self.politica.segundos_esperados, 3)
+        resumen["segundos_espera_claves"] = round(self.gestor_claves.segundos_esperados, 3)
+        if self.cache:
+            resumen["cache"] = self.cache.resumen()
+        resumen["concurrencia"] = self.controlador.resumen()
+        return resumen
+
+    def _anotar_fallo(self, etiqueta, motivo):
+        self.motivos_fallo[etiqueta] = motivo
+        METRICAS.incrementar("peticiones_fallidas_total", motivo=motivo)
+
+    def motivo_fallo(self, etiqueta):
+        # Devuelve (y olvida) por qué falló la última petición con esta etiqueta
+        return self.motivos_fallo.pop(etiqueta, "desconocido")
+
+    async def obtener_prediccion_municipio(self, codigo_municipio, intentos=None):
+        return await self.obtener(DIARIA, codigo_municipio, intentos)
+
+    async def obtener(self, endpoint, clave=None, intentos=None):
+        """
+        Pide a AEMET el payload de un endpoint (ver endpoints.py) para una clave (código de
+        municipio, indicativo de estación...) pasando por la caché si el endpoint la usa.
+        """
+        clave_cache = endpoint.clave_cache(clave) if self.cache else None
+        if clave_cache:
+            datos = self.cache.obtener(clave_cache, endpoint.ttl_cache)
+            if datos is not None:
+                return datos
+        etiqueta = clave or endpoint.nombre
+        return await self.obtener_datos(endpoint.url(self.base_url, clave), etiqueta, intentos,
+                                        clave_cache=clave_cache, decodificar=endpoint.decodificar)
+
+    async def obtener_datos(self, url, etiqueta, intentos=None, clave_cache=None, decodificar=decodificar_datos):
+        """
+        Petición en dos pasos de AEMET OpenData para cualquier endpoint: el primer GET devuelve
+        la URL de 'datos' y el segundo el contenido. Devuelve [] si AEMET responde que no hay
+        datos para la consulta y None si no se han podido obtener.
+        """
+        intentos = intentos or self.politica.intentos
+        motivo = "desconocido"
+        for intento in range(1, intentos + 1):
+            api_key = await self.gestor_claves.obtener_api_key_async()
+            json_url, espera_500 = None, None
+            campos = {"municipio": etiqueta, "clave": self.gestor_claves.indice(api_key), "intento": intento, "fase": "primer_get"}
+            try:
+                params = {"api_key": api_key}
+                async with self._get("primer_get", url, etiqueta=etiqueta, params=params) as response:
+                    motivo = f"http_{response.status}"
+                    if response.status == 200:
+                        cuerpo = decodificar_respuesta(await response.read(), response.headers.get("Content-Type"))
+                        json_url = cuerpo.get("datos", None)
+                        if not json_url and cuerpo.get("estado") == 404:
+                            logging.warning(f"[{etiqueta}] Sin datos: {cuerpo.get('descripcion')}")
+                            return []
+                        if not json_url:
+                            motivo = "sin_url_datos"
+                            logging.error(f"La API no devolvió la clave 'datos'. Respuesta: {cuerpo}")
+                    elif response.status == 404:
+                        # AEMET responde 404 cuando la consulta es válida pero no hay datos
+                        logging.warning(f"[{etiqueta}] Sin datos (404).")
+                        return []
+                    elif response.status == 429:
+                        espera = self.politica.reservar_espera(intento, response.headers)
+                        if espera is None:
+                            break
+                        logging.error(f"[{etiqueta}] Demasiadas solicitudes (429) con la API key {campos['clave']}. Clave en pausa {espera:.1f}s...",
+                                      extra={**campos, "estado": 429})
+                        self.gestor_claves.penalizar_api_key(api_key, espera)
+                    elif response.status == 500:
+                        logging.error(f"[{etiqueta}] Error del servidor (500). Reintentando ({intento}/{intentos})...",
+                                      extra={**campos, "estado": 500})
+                        espera_500 = response.headers
+                    else:
+                        logging.error(f"[{etiqueta}] Error inesperado ({response.status}): {await response.text()}",
+                                      extra={**campos, "estado": response.status})
+                # El segundo GET y las esperas se hacen con la petición ya cerrada, sin ocupar
+                # una plaza del controlador de concurrencia ni una conexión del pool
+                if json_url:
+                    return await self._descargar_datos_json(json_url, clave_cache, etiqueta, decodificar)
+                if espera_500 is not None and not await self.politica.esperar_async(intento, espera_500):
+                    break
+            except aiohttp.ClientConnectionError:
+                motivo = "conexion"
+                logging.error(f"[{etiqueta}] Error de conexión. Reintentando ({intento}/{intentos})...", extra=campos)
+                if not await self.politica.esperar_async(intento):
+                    break
+            except asyncio.TimeoutError:
+                motivo = "timeout"
+                logging.error(f"[{etiqueta}] La solicitud tardó demasiado. Reintentando ({intento}/{intentos})...", extra=campos)
+                if not await self.politica.esperar_async(intento):
+                    break
+            except (aiohttp.ClientError, ValueError) as e:
+                logging.error(f"[{etiqueta}] Error inesperado en el primer GET: {e}", extra=campos)
+                self._anotar_fallo(etiqueta, type(e).__name__)
+                return None
+        logging.error(f"[{etiqueta}] No se pudieron obtener los datos tras {intentos} intentos.",
+                      extra={"municipio": etiqueta, "intento": intentos, "motivo": motivo})
+        self._anotar_fallo(etiqueta, motivo)
+        return None
+
+    async def _descargar_datos_json(self, json_url, clave_cache=None, etiqueta=None, decodificar=decodificar_datos):
+        """
+        Descarga y devuelve los datos JSON desde la URL proporcionada, manejando errores.
+        Los 429 y 5xx se reintentan esperando lo que indiquen las cabeceras de la respuesta.
+        Solo se usa la caché si se indica su clave ('clave_cache').
+        """
+        cache = self.cache if clave_cache else None
+        etiqueta = etiqueta or clave_cache
+        motivo = "desconocido"
+        for intento in range(1, self.politica.intentos + 1):
+            campos = {"municipio": etiqueta, "intento": intento, "fase": "segundo_get"}
+            try:
+                validadores = cache.validadores(clave_cache) if cache else {}
+                async with self._get("segundo_get", json_url, etiqueta=etiqueta, headers=validadores) as response_data:
+                    motivo = f"datos_http_{response_data.status}"
+                    datos, reintentar = resolver_segundo_get(response_data.status, response_data.headers, await response_data.read(),
+                                                             etiqueta, campos, cache, clave_cache, decodificar)
+                    headers = response_data.headers
+                if datos is not None:
+                    return datos
+                if not reintentar:
+                    break
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                motivo = f"datos_{type(e).__name__}"
+                logging.error(f"❌ [{etiqueta}] Segundo GET → Excepción durante la solicitud: {e}", extra=campos)
+                headers = None
+            # La espera se hace con la conexión ya devuelta al pool
+            if not await self.politica.esperar_async(intento, headers):
+                break
+
+        self._anotar_fallo(etiqueta, motivo)
+        return None
+
+
+class _PeticionMedida:
+    # Envuelve el context manager de aiohttp para medir la latencia hasta recibir las cabeceras.
+    # La petición ocupa una plaza del controlador de concurrencia hasta que se lee su cuerpo.
+    def __init__(self, cliente, fase, peticion, etiqueta=None):
+        self.cliente = cliente
+        self.fase = fase
+        self.peticion = peticion
+        self.etiqueta = etiqueta
+
+    async def __aenter__(self):
+        controlador = self.cliente.controlador
+        await controlador.adquirir()
+        inicio = time.perf_counter()
+        estado = None
+        try:
+            respuesta = await self.peticion.__aenter__()
+            estado = respuesta.status
+            latencia = time.perf_counter() - inicio
+            # Sin leer el cuerpo aquí los bytes se toman de Content-Length
+            self.cliente.estadisticas.registrar_respuesta(self.fase, respuesta.status, respuesta.content_length)
+            controlador.registrar(self.fase, respuesta.status, latencia, respuesta.headers.get("X-RateLimit-Remaining"))
+            return respuesta
+        except BaseException as e:
+            if isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+                METRICAS.incrementar("http_errores_total", fase=self.fase, tipo=type(e).__name__)
+                controlador.registrar(self.fase, None, time.perf_counter() - inicio)
+            await controlador.liberar()
+            raise
+        finally:
+            latencia = time.perf_counter() - inicio
+            self.cliente.estadisticas.registrar_latencia(self.fase, latencia)
+            # Una línea por petición solo con AEMET_LOG_NIVEL=DEBUG; si no, ni se construye
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(f"[{self.etiqueta}] {self.fase} → {estado}",
+                              extra={"municipio": self.etiqueta, "fase": self.fase, "estado": estado, "latencia_s": round(latencia, 4)})
+
+    async def __aexit__(self, *exc):
+        try:
+            return await self.peticion.__aexit__(*exc)
+        finally:
+            await self.cliente.controlador.liberar()
+
+
+async def _procesar_municipios_async(fragmento_municipios, api_keys, concurrencia, diario=None, destino=None, acumular=True, gestor_claves=None, estadisticas=None, politica=None, controlador=None):
+    resultados = [None] * len(fragmento_municipios) if acumular else []
+    municipios_fallidos = []
+    cola = asyncio.Queue()
+    for idx, municipio in enumerate(fragmento_municipios):
+        cola.put_nowait((idx, municipio))
+    progreso = ProgresoMuestreado(len(fragmento_municipios), "Extracción de predicciones")
+
+    async with AemetAsyncAPIClient(api_keys, concurrencia, gestor_claves=gestor_claves, politica=politica,
+                                   controlador=controlador) as cliente:
+
+        async def trabajador():
+            while True:
+                try:
+                    idx, municipio = cola.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                codigo = municipio["codigo_municipio"]
+                nombre = municipio.get("NOMBRE", "Desconocido")
+                try:
+                    prediccion = await cliente.obtener_prediccion_municipio(codigo)
+                    motivo = cliente.motivo_fallo(codigo) if prediccion is None else "sin_datos"
+                except Exception as e:
+                    prediccion, motivo = None, type(e).__name__
+                    logging.error(f"Error crítico procesando {codigo} ({nombre}): {e}")
+                if prediccion:
+                    # Se aplana al llegar y el árbol de diccionarios de AEMET se descarta
+                    resultado = PrediccionCompacta.desde_aemet(codigo, nombre, prediccion)
+                    if acumular:
+                        resultados[idx] = resultado
+                    if destino:
+                        destino(resultado)
+                    if diario:
+                        diario.registrar_completado(resultado)
+                else:
+                    municipios_fallidos.append({"codigo_municipio": codigo, "nombre": nombre, "motivo": motivo})
+                    if diario:
+                        diario.registrar_fallido(municipios_fallidos[-1])
+                progreso.avanzar()
+
+        await asyncio.gather(*(trabajador() for _ in range(cliente.concurrencia)))
+        resumen = cliente.estadisticas_conexion()
+        logging.info(f"📶 Estadísticas HTTP: {resumen}")
+        if estadisticas is not None:
+            estadisticas.update(resumen)
+
+    # Se conserva el orden de entrada aunque las tareas terminen desordenadas
+    predicciones_municipios = [r for r in resultados if r is not None]
+    return predicciones_municipios, municipios_fallidos
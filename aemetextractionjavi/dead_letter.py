@@ -0,0 +1,125 @@
+import datetime
+import logging
+import os
+import threading
+
+from adaptive_concurrency import ControladorConcurrencia
+from connection import procesar_municipios_async
+from metrics import METRICAS
+from retry_policy import PoliticaReintentos
+from serialization import a_texto, desde_texto
+
+
+class ColaFallidos:
+    """
+    Cola persistente (dead-letter queue) de los municipios que han fallado.
+
+    La pasada principal no reintenta los municipios que fallan: los deja aquí con el
+    motivo y el número de intentos y sigue. Una pasada diferida (reprocesar_cola) los
+    vuelve a pedir al final de la ejecución o en la siguiente con '--resume'. Los que
+    alcanzan 'max_intentos' se quedan en la cola como agotados y ya no se reintentan.
+    """
+    def __init__(self, ruta, max_intentos=None):
+        self.ruta = ruta
+        self.max_intentos = max_intentos or int(os.getenv("AEMET_MAX_INTENTOS_COLA", "3"))
+        self.lock = threading.Lock()
+        self.entradas = {}
+
+    def cargar(self):
+        if os.path.exists(self.ruta):
+            try:
+                with open(self.ruta, "rb") as f:
+                    self.entradas = {e["codigo_municipio"]: e for e in desde_texto(f.read())}
+            except ValueError:
+                logging.error(f"❌ Cola de fallidos '{self.ruta}' ilegible, se empieza vacía.")
+                self.entradas = {}
+        logging.info(f"📮 Cola de fallidos '{self.ruta}': {len(self.entradas)} municipios.")
+        return self
+
+    def reiniciar(self):
+        with self.lock:
+            self.entradas = {}
+        self.guardar()
+
+    def guardar(self):
+        # Escritura atómica para no dejar la cola a medias si el proceso muere
+        with self.lock:
+            texto = a_texto(list(self.entradas.values()))
+        tmp = f"{self.ruta}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(texto)
+        os.replace(tmp, self.ruta)
+
+    def anadir(self, municipio):
+        """
+        Registra un fallo ({'codigo_municipio', 'nombre', 'motivo'}) y suma un intento.
+        """
+        ahora = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.lock:
+            entrada = self.entradas.setdefault(municipio["codigo_municipio"], {
+                "codigo_municipio": municipio["codigo_municipio"],
+                "nombre": municipio.get("nombre", "Desconocido"),
+                "intentos": 0,
+                "primer_fallo": ahora,
+            })
+            entrada["intentos"] += 1
+            entrada["motivo"] = municipio.get("motivo", "desconocido")
+            entrada["ultimo_fallo"] = ahora
+        METRICAS.incrementar("cola_fallidos_total", motivo=entrada["motivo"])
+
+    def resolver(self, codigo_municipio):
+        with self.lock:
+            return self.entradas.pop(codigo_municipio, None) is not None
+
+    def pendientes(self):
+        # En el formato del catálogo de municipios, para pasarlos tal cual a los procesadores
+        with self.lock:
+            return [{"codigo_municipio": e["codigo_municipio"], "NOMBRE": e["nombre"]}
+                    for e in self.entradas.values() if e["intentos"] < self.max_intentos]
+
+    def fallidos(self):
+        with self.lock:
+            return list(self.entradas.values())
+
+    def __contains__(self, codigo_municipio):
+        return codigo_municipio in self.entradas
+
+    def __len__(self):
+        return len(self.entradas)
+
+
+def reprocesar_cola(cola, api_keys, diario=None, destino=None, concurrencia=None, presupuesto=None, pasadas=None, gestor_claves=None):
+    """
+    Pasada diferida sobre la cola de fallidos, con su propia concurrencia (baja, para no
+    insistir sobre un servidor que está fallando) y su propio presupuesto de reintentos,
+    de modo que no consume el de la pasada principal. Con 'gestor_claves' comparte el
+    planificador de claves de la pasada principal y respeta la cuota que esta ya ha gastado.
+    Devuelve los que siguen fallando.
+    """
+    concurrencia = concurrencia or int(os.getenv("AEMET_CONCURRENCIA_COLA", "2"))
+    politica = PoliticaReintentos(presupuesto=presupuesto if presupuesto is not None else int(os.getenv("AEMET_PRESUPUESTO_COLA", "50")))
+    pasadas = pasadas or int(os.getenv("AEMET_PASADAS_COLA", "1"))
+
+    def al_recuperar(resultado):
+        cola.resolver(resultado.codigo_municipio)
+        METRICAS.incrementar("cola_recuperados_total")
+        if destino:
+            destino(resultado)
+
+    for pasada in range(1, pasadas + 1):
+        pendientes = cola.pendientes()
+        if not pendientes:
+            break
+        print(f"📮 Reintento diferido {pasada}/{pasadas}: {len(pendientes)} municipios de la cola de fallidos.")
+        with METRICAS.tramo("cola_fallidos", pasada=pasada, municipios=len(pendientes)) as tramo:
+            # Concurrencia fija: la pasada diferida no debe crecer sobre un servidor que ya ha fallado
+            _, fallidos = procesar_municipios_async(
+                pendientes, api_keys, concurrencia, diario=diario, destino=al_recuperar, acumular=False,
+                gestor_claves=gestor_claves, politica=politica,
+                controlador=ControladorConcurrencia(concurrencia, adaptativo=False))
+            for municipio in fallidos:
+                cola.anadir(municipio)
+            cola.guardar()
+            tramo["recuperados"] = len(pendientes) - len(fallidos)
+
+    return cola.fallidos()
@@ -0,0 +1,158 @@
+from flattener import ESQUEMA, aplanar_municipio, convertir_valor, fecha_hoy
+from serialization import decodificar_datos
+
+
+class Endpoint:
+    """
+    Descripción declarativa de un conjunto de datos de AEMET OpenData.
+
+    - nombre:      identificador del endpoint ('diaria', 'horaria', ...) y prefijo de su salida
+    - ruta:        plantilla de la URL relativa a BASE_URL; '{clave}' se sustituye por cada clave
+    - fuente:      de dónde salen las claves: 'municipios', 'estaciones' o None (una sola petición)
+    - columnas:    esquema de la salida, pares (columna, tipo)
+    - aplanar:     función (registro de la fuente, payload) -> filas en el orden de 'columnas'
+    - decodificar: decodificador del fichero de 'datos'
+    - ttl_cache:   segundos que una respuesta se sirve desde la caché (None = el TTL por defecto,
+                   0 = no se cachea)
+
+    Todos los endpoints comparten el cliente (pool HTTP, planificador de claves, reintentos
+    y caché): solo cambia qué se pide y cómo se aplana.
+    """
+    def __init__(self, nombre, ruta, fuente, columnas, aplanar, decodificar=decodificar_datos, ttl_cache=None,
+                 prefijo_cache=None):
+        self.nombre = nombre
+        self.ruta = ruta
+        self.fuente = fuente
+        self.columnas = columnas
+        self.aplanar = aplanar
+        self.decodificar = decodificar
+        self.ttl_cache = ttl_cache
+        self.prefijo_cache = f"{nombre}_" if prefijo_cache is None else prefijo_cache
+
+    def url(self, base_url, clave=None):
+        return base_url + self.ruta.format(clave=clave)
+
+    def clave_cache(self, clave=None):
+        if self.ttl_cache == 0:
+            return None
+        return f"{self.prefijo_cache}{clave or 'todas'}"
+
+    def cabecera(self):
+        return [columna for columna, _ in self.columnas]
+
+    def __repr__(self):
+        return f"Endpoint({self.nombre!r})"
+
+
+# Predicción diaria por municipio: la salida de siempre (una fila por municipio para hoy)
+def _aplanar_diaria(municipio, datos):
+    return aplanar_municipio({
+        "codigo_municipio": municipio["codigo_municipio"],
+        "nombre": municipio.get("NOMBRE"),
+        "prediccion": datos,
+    }, fecha_hoy())
+
+
+# Predicción horaria por municipio: una fila por municipio, día y hora
+COLUMNAS_HORARIA = [
+    ('codigo_municipio', 'STRING'),
+    ('nombre', 'STRING'),
+    ('provincia', 'STRING'),
+    ('fecha', 'STRING'),
+    ('hora', 'INT64'),
+    ('estadoCielo', 'STRING'),
+    ('precipitacion', 'STRING'),
+    ('nieve', 'STRING'),
+    ('temperatura', 'INT64'),
+    ('sensTermica', 'INT64'),
+    ('humedadRelativa', 'INT64'),
+    ('viento_direccion', 'STRING'),
+    ('viento_velocidad', 'INT64'),
+    ('rachaMax', 'INT64'),
+]
+
+# Secciones horarias con un valor por hora: (sección en AEMET, atributo, columna)
+_SECCIONES_HORARIA = [
+    ('estadoCielo', 'descripcion', 'estadoCielo'),
+    ('precipitacion', 'value', 'precipitacion'),
+    ('nieve', 'value', 'nieve'),
+    ('temperatura', 'value', 'temperatura'),
+    ('sensTermica', 'value', 'sensTermica'),
+    ('humedadRelativa', 'value', 'humedadRelativa'),
+]
+
+
+def _aplanar_horaria(municipio, datos):
+    filas = []
+    for prediccion in datos:
+        for dia in prediccion['prediccion']['dia']:
+            horas = {}
+            for seccion, atributo, columna in _SECCIONES_HORARIA:
+                for entrada in dia.get(seccion) or []:
+                    horas.setdefault(entrada.get('periodo'), {})[columna] = entrada.get(atributo)
+            # 'vientoAndRachaMax' mezcla entradas de viento (listas) y de racha ('value') por hora
+            for entrada in dia.get('vientoAndRachaMax') or []:
+                hora = horas.setdefault(entrada.get('periodo'), {})
+                if 'direccion' in entrada:
+                    hora['viento_direccion'] = (entrada.get('direccion') or [None])[0]
+                    hora['viento_velocidad'] = (entrada.get('velocidad') or [None])[0]
+                else:
+                    hora['rachaMax'] = entrada.get('value')
+            for periodo in sorted(p for p in horas if p is not None):
+                valores = {
+                    'codigo_municipio': municipio["codigo_municipio"],
+                    'nombre': municipio.get("NOMBRE"),
+                    'provincia': prediccion.get('provincia'),
+                    'fecha': (dia.get('fecha') or '')[:10],
+                    'hora': periodo,
+                    **horas[periodo],
+                }
+                filas.append([convertir_valor(valores.get(columna), tipo) for columna, tipo in COLUMNAS_HORARIA])
+    return filas
+
+
+# Última observación de las estaciones convencionales: una fila por estación y hora
+COLUMNAS_OBSERVACION = [
+    ('idema', 'STRING'),
+    ('ubi', 'STRING'),
+    ('fint', 'STRING'),
+    ('lat', 'FLOAT64'),
+    ('lon', 'FLOAT64'),
+    ('alt', 'FLOAT64'),
+    ('ta', 'FLOAT64'),
+    ('tamax', 'FLOAT64'),
+    ('tamin', 'FLOAT64'),
+    ('hr', 'FLOAT64'),
+    ('prec', 'FLOAT64'),
+    ('vv', 'FLOAT64'),
+    ('dv', 'FLOAT64'),
+    ('vmax', 'FLOAT64'),
+    ('pres', 'FLOAT64'),
+]
+
+
+def _aplanar_observacion(_, datos):
+    return [[convertir_valor(registro.get(columna), tipo) for columna, tipo in COLUMNAS_OBSERVACION] for registro in datos]
+
+
+DIARIA = Endpoint(
+    "diaria", "/prediccion/especifica/municipio/diaria/{clave}", "municipios",
+    [(campo.columna, campo.tipo) for campo in ESQUEMA], _aplanar_diaria,
+    decodificar=decodificar_datos,
+    # Mismas entradas de caché que la extracción diaria de siempre (clave = código de municipio)
+    prefijo_cache="",
+)
+
+HORARIA = Endpoint(
+    "horaria", "/prediccion/especifica/municipio/horaria/{clave}", "municipios",
+    COLUMNAS_HORARIA, _aplanar_horaria,
+)
+
+OBSERVACION = Endpoint(
+    "observacion", "/observacion/convencional/todas", None,
+    COLUMNAS_OBSERVACION, _aplanar_observacion,
+    # Las observaciones se renuevan cada hora: no tiene sentido servirlas desde la caché
+    ttl_cache=0,
+)
+
+ENDPOINTS = {endpoint.nombre: endpoint for endpoint in (DIARIA, HORARIA, OBSERVACION)}
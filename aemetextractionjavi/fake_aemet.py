@@ -0,0 +1,271 @@
+import argparse
+import copy
+import datetime
+import json
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+# Respuesta grabada de /prediccion/especifica/municipio/diaria que sirve de plantilla
+FIXTURE_PREDICCION = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "prediccion_diaria_municipio.json")
+# Estaciones del inventario falso para climatología y observaciones (indicativo, nombre, provincia)
+ESTACIONES_FAKE = [("3195", "MADRID, RETIRO", "MADRID"), ("0076", "BARCELONA AEROPUERTO", "BARCELONA"),
+                   ("1387", "A CORUÑA", "A CORUÑA")]
+
+
+class ConfiguracionFake:
+    """
+    Comportamiento del servidor falso de AEMET.
+
+    - latencia / jitter: segundos añadidos a cada respuesta
+    - cuota_por_minuto: peticiones por clave y minuto antes de devolver 429 (0 = sin límite)
+    - prob_500: probabilidad de responder 500 en cualquiera de los dos GET
+    - prob_timeout: probabilidad de quedarse colgado 'duracion_timeout' segundos sin responder
+    - capacidad: peticiones que el servidor atiende a la vez; el resto hace cola y su
+      latencia crece como en un servidor saturado (0 = sin límite)
+    """
+    def __init__(self, latencia=0.05, jitter=0.02, cuota_por_minuto=0, prob_500=0.0, prob_timeout=0.0,
+                 duracion_timeout=60.0, fixture=FIXTURE_PREDICCION, capacidad=0):
+        self.latencia = latencia
+        self.jitter = jitter
+        self.cuota_por_minuto = cuota_por_minuto
+        self.prob_500 = prob_500
+        self.prob_timeout = prob_timeout
+        self.duracion_timeout = duracion_timeout
+        self.capacidad = capacidad
+        with open(fixture, "r", encoding="utf-8") as f:
+            self.plantilla = json.load(f)
+
+
+class ServidorAemetFake(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion, configuracion):
+        super().__init__(direccion, _ManejadorAemet)
+        self.configuracion = configuracion
+        self.lock = threading.Lock()
+        self.peticiones_por_clave = defaultdict(deque)
+        self.contadores = defaultdict(int)
+        self.plazas = threading.BoundedSemaphore(configuracion.capacidad) if configuracion.capacidad else None
+
+    @property
+    def base_url(self):
+        host, puerto = self.server_address[:2]
+        return f"http://{host}:{puerto}/opendata/api"
+
+    def consumir_cuota(self, api_key):
+        """
+        Devuelve None si la clave puede hacer la petición, o las cabeceras del 429 si no.
+        """
+        limite = self.configuracion.cuota_por_minuto
+        if not limite:
+            return None
+        with self.lock:
+            ahora = time.time()
+            ventana = self.peticiones_por_clave[api_key]
+            while ventana and ventana[0] <= ahora - 60:
+                ventana.popleft()
+            if len(ventana) >= limite:
+                reset = ventana[0] + 60
+                return {
+                    "Retry-After": str(max(1, int(reset - ahora + 0.999))),
+                    "X-RateLimit-Limit": str(limite),
+                    "X-RateLimit-Remaining": "0",
+                    "X-RateLimit-Reset": str(int(reset + 0.999)),
+                }
+            ventana.append(ahora)
+            return None
+
+    def contar(self, evento):
+        with self.lock:
+            self.contadores[evento] += 1
+
+    def prediccion(self, codigo):
+        # La plantilla se adapta al municipio pedido y a las fechas de hoy en adelante
+        datos = copy.deepcopy(self.configuracion.plantilla)
+        hoy = datetime.date.today()
+        for prediccion in datos:
+            prediccion["id"] = codigo
+            prediccion["elaborado"] = hoy.strftime("%Y-%m-%dT08:00:00")
+            for i, dia in enumerate(prediccion["prediccion"]["dia"]):
+                dia["fecha"] = (hoy + datetime.timedelta(days=i)).strftime("%Y-%m-%dT00:00:00")
+        return datos
+
+
+class _ManejadorAemet(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Cabeceras y cuerpo van en escrituras separadas: sin esto Nagle añade ~40 ms por respuesta
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _responder(self, estado, cuerpo, headers=None, charset="utf-8"):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode(charset)
+        self.send_response(estado)
+        self.send_header("Content-Type", f"application/json;charset={charset}")
+        self.send_header("Content-Length", str(len(datos)))
+        for clave, valor in (headers or {}).items():
+            self.send_header(clave, valor)
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _simular_red(self):
+        """
+        Aplica latencia y fallos inyectados. Devuelve False si ya se ha respondido.
+        """
+        configuracion = self.server.configuracion
+        latencia = max(0.0, configuracion.latencia + random.uniform(-configuracion.jitter, configuracion.jitter))
+        if self.server.plazas:
+            with self.server.plazas:
+                time.sleep(latencia)
+        else:
+            time.sleep(latencia)
+        if configuracion.prob_timeout and random.random() < configuracion.prob_timeout:
+            self.server.contar("timeout")
+            time.sleep(configuracion.duracion_timeout)
+            self.close_connection = True
+            return False
+        if configuracion.prob_500 and random.random() < configuracion.prob_500:
+            self.server.contar("500")
+            self._responder(500, {"descripcion": "Error interno simulado", "estado": 500})
+            return False
+        return True
+
+    def _valores_climatologicos(self, ruta):
+        """
+        Datos sintéticos de climatología: el inventario de estaciones o un registro diario por
+        estación y fecha del rango pedido (fechaini/.../fechafin/.../estacion|todasestaciones).
+        """
+        partes = ruta.strip("/").split("/")
+        if partes[-2:] == ["inventarioestaciones", "todasestaciones"]:
+            return [{"indicativo": indicativo, "nombre": nombre, "provincia": provincia}
+                    for indicativo, nombre, provincia in ESTACIONES_FAKE]
+        inicio = datetime.date.fromisoformat(partes[partes.index("fechaini") + 1][:10])
+        fin = datetime.date.fromisoformat(partes[partes.index("fechafin") + 1][:10])
+        estaciones = ESTACIONES_FAKE if partes[-1] == "todasestaciones" else \
+            [e for e in ESTACIONES_FAKE if e[0] == partes[-1]]
+        registros = []
+        for dias in range((fin - inicio).days + 1):
+            fecha = inicio + datetime.timedelta(days=dias)
+            for indicativo, nombre, provincia in estaciones:
+                registros.append({"fecha": fecha.isoformat(), "indicativo": indicativo, "nombre": nombre,
+                                  "provincia": provincia, "tmed": f"{10 + fecha.month:.1f}".replace(".", ","),
+                                  "prec": "0,0"})
+        return registros
+
+    def _datos_sinteticos(self, ruta):
+        # Payload de los endpoints sin fixture grabado, según la ruta del primer GET
+        partes = ruta.strip("/").split("/")
+        if "climatologicos" in partes:
+            return self._valores_climatologicos(ruta)
+        if partes[-2] == "horaria":
+            return self._prediccion_horaria(partes[-1])
+        if partes[-2:] == ["convencional", "todas"]:
+            ahora = datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+            return [{"idema": indicativo, "ubi": nombre, "fint": ahora.strftime("%Y-%m-%dT%H:%M:%S"),
+                     "lat": 40.0, "lon": -3.0, "alt": 600.0, "ta": 15.2, "tamax": 16.0, "tamin": 14.1,
+                     "hr": 60.0, "prec": 0.0, "vv": 2.5, "dv": 180.0, "vmax": 5.1, "pres": 940.3}
+                    for indicativo, nombre, _ in ESTACIONES_FAKE]
+        return None
+
+    def _prediccion_horaria(self, codigo):
+        hoy = datetime.date.today()
+        dias = []
+        for i in range(2):
+            horas = [f"{h:02d}" for h in range(24)]
+            dias.append({
+                "fecha": (hoy + datetime.timedelta(days=i)).strftime("%Y-%m-%dT00:00:00"),
+                "estadoCielo": [{"value": "11", "periodo": h, "descripcion": "Despejado"} for h in horas],
+                "precipitacion": [{"value": "0", "periodo": h} for h in horas],
+                "nieve": [{"value": "0", "periodo": h} for h in horas],
+                "temperatura": [{"value": str(10 + int(h) // 3), "periodo": h} for h in horas],
+                "sensTermica": [{"value": str(9 + int(h) // 3), "periodo": h} for h in horas],
+                "humedadRelativa": [{"value": "55", "periodo": h} for h in horas],
+                "vientoAndRachaMax": [e for h in horas for e in (
+                    {"direccion": ["SO"], "velocidad": ["9"], "periodo": h}, {"value": "19", "periodo": h})],
+            })
+        return [{"elaborado": hoy.strftime("%Y-%m-%dT08:00:00"), "nombre": f"Municipio {codigo}",
+                 "provincia": "Madrid", "id": codigo, "prediccion": {"dia": dias}}]
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        partes = url.path.strip("/").split("/")
+
+        if url.path == "/__estadisticas":
+            with self.server.lock:
+                self._responder(200, dict(self.server.contadores))
+            return
+
+        # Primer GET: metadatos con la URL de 'datos'
+        prediccion = partes[:6] == ["opendata", "api", "prediccion", "especifica", "municipio", "diaria"] and len(partes) == 7
+        sintetico = partes[:2] == ["opendata", "api"] and not prediccion and self._datos_sinteticos(url.path) is not None
+        if prediccion or sintetico:
+            self.server.contar("primer_get")
+            api_key = parse_qs(url.query).get("api_key", [""])[0]
+            if not api_key:
+                self._responder(401, {"descripcion": "API key no válida", "estado": 401})
+                return
+            cabeceras_429 = self.server.consumir_cuota(api_key)
+            if cabeceras_429:
+                self.server.contar("429")
+                self._responder(429, {"descripcion": "Límite de peticiones", "estado": 429}, cabeceras_429)
+                return
+            if not self._simular_red():
+                return
+            host, puerto = self.server.server_address[:2]
+            datos = f"/opendata/sh/{partes[6]}" if prediccion else f"/opendata/sh/sintetico?ruta={quote(url.path)}"
+            self._responder(200, {
+                "descripcion": "exito",
+                "estado": 200,
+                "datos": f"http://{host}:{puerto}{datos}",
+                "metadatos": f"http://{host}:{puerto}/opendata/sh/metadatos",
+            })
+            return
+
+        # Segundo GET: el payload, en ISO-8859-15 como lo sirve AEMET
+        if partes[:2] == ["opendata", "sh"] and len(partes) == 3:
+            self.server.contar("segundo_get")
+            if not self._simular_red():
+                return
+            if partes[2] == "sintetico":
+                cuerpo = self._datos_sinteticos(parse_qs(url.query)["ruta"][0])
+            else:
+                cuerpo = self.server.prediccion(partes[2])
+            self._responder(200, cuerpo, charset="ISO-8859-15")
+            return
+
+        self._responder(404, {"descripcion": "No encontrado", "estado": 404})
+
+
+def arrancar_servidor(configuracion=None, host="127.0.0.1", puerto=0):
+    """
+    Arranca el servidor en un hilo de fondo y lo devuelve (usar servidor.base_url como AEMET_BASE_URL).
+    """
+    servidor = ServidorAemetFake((host, puerto), configuracion or ConfiguracionFake())
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor local que imita la API de AEMET OpenData")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8099)
+    parser.add_argument("--latencia", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--cuota", type=int, default=0, help="Peticiones por clave y minuto (0 = sin límite)")
+    parser.add_argument("--prob-500", type=float, default=0.0)
+    parser.add_argument("--prob-timeout", type=float, default=0.0)
+    parser.add_argument("--duracion-timeout", type=float, default=60.0)
+    parser.add_argument("--capacidad", type=int, default=0, help="Peticiones atendidas a la vez (0 = sin límite)")
+    args = parser.parse_args()
+
+    configuracion = ConfiguracionFake(args.latencia, args.jitter, args.cuota, args.prob_500,
+                                      args.prob_timeout, args.duracion_timeout, capacidad=args.capacidad)
+    servidor = ServidorAemetFake((args.host, args.puerto), configuracion)
+    print(f"🧪 AEMET falso escuchando en {servidor.base_url}")
+    servidor.serve_forever()
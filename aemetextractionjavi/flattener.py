@@ -0,0 +1,357 @@
+import array
+import csv
+import datetime
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from metrics import METRICAS
+from serialization import a_texto
+
+# Definición declarativa de cada columna de salida:
+#  - columna:  nombre de la columna en el CSV / tabla
+#  - seccion:  'municipio', 'prediccion' o 'dia' para atributos directos; si no, la clave del día
+#              en AEMET ('probPrecipitacion', 'temperatura', ...)
+#  - atributo: clave a leer dentro de la sección
+#  - periodo:  para las secciones que son listas por periodo, la etiqueta 'periodo' a buscar
+#  - tipo:     tipo de la columna ('STRING' o 'INT64')
+Campo = namedtuple("Campo", ["columna", "seccion", "atributo", "periodo", "tipo"])
+
+PERIODOS = ['00-24', '00-12', '12-24', '00-06', '06-12', '12-18', '18-24']
+
+# Los días 5-7 de la predicción traen una sola entrada sin 'periodo' que vale para todo el día
+PERIODO_POR_DEFECTO = '00-24'
+
+
+def _por_periodo(seccion, atributo, prefijo, tipo):
+    return [Campo(f"{prefijo}_{p}", seccion, atributo, p, tipo) for p in PERIODOS]
+
+
+ESQUEMA = (
+    [
+        Campo('codigo_municipio', 'municipio', 'codigo_municipio', None, 'STRING'),
+        Campo('nombre', 'municipio', 'nombre', None, 'STRING'),
+        Campo('provincia', 'prediccion', 'provincia', None, 'STRING'),
+        Campo('fecha', 'dia', 'fecha', None, 'STRING'),
+    ]
+    + _por_periodo('probPrecipitacion', 'value', 'probPrecipitacion', 'INT64')
+    + _por_periodo('cotaNieveProv', 'value', 'cotaNieveProv', 'INT64')
+    + _por_periodo('estadoCielo', 'descripcion', 'estadoCielo', 'STRING')
+    + [campo for p in PERIODOS for campo in (
+        Campo(f'viento_direccion_{p}', 'viento', 'direccion', p, 'STRING'),
+        Campo(f'viento_velocidad_{p}', 'viento', 'velocidad', p, 'INT64'),
+    )]
+    + _por_periodo('rachaMax', 'value', 'rachaMax', 'INT64')
+    + [
+        Campo('temperatura_maxima', 'temperatura', 'maxima', None, 'INT64'),
+        Campo('temperatura_minima', 'temperatura', 'minima', None, 'INT64'),
+        Campo('sensTermica_maxima', 'sensTermica', 'maxima', None, 'INT64'),
+        Campo('sensTermica_minima', 'sensTermica', 'minima', None, 'INT64'),
+        Campo('humedadRelativa_maxima', 'humedadRelativa', 'maxima', None, 'INT64'),
+        Campo('humedadRelativa_minima', 'humedadRelativa', 'minima', None, 'INT64'),
+        Campo('uvMax', 'dia', 'uvMax', None, 'INT64'),
+    ]
+)
+
+# Columnas del CSV de predicciones por municipio (una fila por municipio y día)
+CABECERA = [campo.columna for campo in ESQUEMA]
+
+# Valor con el que se escriben los huecos en el CSV
+NULO_CSV = 'null'
+
+
+def nombre_columna_bigquery(columna):
+    # BigQuery no admite guiones en los nombres de columna
+    return columna.replace('-', '_')
+
+
+def columnas_tipadas():
+    """
+    Esquema tipado de la salida columnar (Parquet / BigQuery): pares (columna, tipo).
+    'fecha' se guarda como DATE y se añade 'fecha_carga' con el día de la ejecución.
+    """
+    columnas = [(nombre_columna_bigquery(campo.columna), 'DATE' if campo.columna == 'fecha' else campo.tipo)
+                for campo in ESQUEMA]
+    return columnas + [('fecha_carga', 'DATE')]
+
+
+def fecha_hoy():
+    # Formato en el que AEMET devuelve la fecha de cada día de la predicción
+    return datetime.datetime.now().strftime("%Y-%m-%dT00:00:00")
+
+
+def convertir_valor(valor, tipo):
+    # Valor de AEMET al tipo de su columna; los huecos y los números ilegibles quedan como None
+    if valor is None or valor == '':
+        return None
+    if tipo == 'INT64':
+        try:
+            return int(valor)
+        except (TypeError, ValueError):
+            return None
+    return valor
+
+
+def _indexar_por_periodo(entradas):
+    # Las entradas se localizan por su etiqueta real de periodo, no por su posición en la lista
+    return {entrada.get('periodo', PERIODO_POR_DEFECTO): entrada for entrada in entradas or []}
+
+
+def aplanar_lote(municipios, fecha=None):
+    """
+    Aplana un lote de predicciones en columnas (una lista por campo de ESQUEMA) con una
+    posición por municipio y día. Si se indica 'fecha' solo se conservan los días con esa fecha.
+    """
+    columnas = {campo.columna: [] for campo in ESQUEMA}
+    salidas = [(campo, columnas[campo.columna]) for campo in ESQUEMA]
+
+    for municipio in municipios:
+        for prediccion in municipio['prediccion']:
+            for dia in prediccion['prediccion']['dia']:
+                if fecha and dia.get('fecha') != fecha:
+                    continue
+                indices = {}
+                for campo, salida in salidas:
+                    if campo.seccion == 'municipio':
+                        valor = municipio.get(campo.atributo)
+                    elif campo.seccion == 'prediccion':
+                        valor = prediccion.get(campo.atributo)
+                    elif campo.seccion == 'dia':
+                        valor = dia.get(campo.atributo)
+                    elif campo.periodo is None:
+                        valor = (dia.get(campo.seccion) or {}).get(campo.atributo)
+                    else:
+                        indice = indices.get(campo.seccion)
+                        if indice is None:
+                            indice = indices[campo.seccion] = _indexar_por_periodo(dia.get(campo.seccion))
+                        valor = indice.get(campo.periodo, {}).get(campo.atributo)
+                    salida.append(convertir_valor(valor, campo.tipo))
+    return columnas
+
+
+def filas_csv(columnas):
+    # Traspone las columnas a filas en el orden de CABECERA, con los huecos como 'null'
+    for fila in zip(*(columnas[columna] for columna in CABECERA)):
+        yield [NULO_CSV if valor is None else valor for valor in fila]
+
+
+def aplanar_municipio(municipio, fecha=None):
+    """
+    Convierte la predicción de un municipio en las filas del CSV para la fecha indicada.
+    """
+    return list(filas_csv(aplanar_lote([municipio], fecha or fecha_hoy())))
+
+
+# Campos con un valor por día, separados por tipo para la representación compacta
+CAMPOS_DIA = [campo for campo in ESQUEMA if campo.seccion not in ('municipio', 'prediccion')]
+CAMPOS_ENTEROS = [campo.columna for campo in CAMPOS_DIA if campo.tipo == 'INT64']
+CAMPOS_TEXTO = [campo.columna for campo in CAMPOS_DIA if campo.tipo != 'INT64']
+POSICION_FECHA = CAMPOS_TEXTO.index('fecha')
+
+# Hueco en los arrays de enteros (AEMET no devuelve valores tan negativos)
+NULO_ENTERO = -2 ** 31
+
+
+class TablaTextos:
+    """
+    Tabla de textos repetidos (fechas, descripciones del cielo, direcciones del viento)
+    que se guardan como códigos de 16 bits. El código 0 es el hueco.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.textos = [None]
+        self.codigos = {None: 0}
+
+    def codigo(self, texto):
+        codigo = self.codigos.get(texto)
+        if codigo is None:
+            with self.lock:
+                codigo = self.codigos.get(texto)
+                if codigo is None:
+                    codigo = len(self.textos)
+                    self.textos.append(sys.intern(texto) if isinstance(texto, str) else texto)
+                    self.codigos[texto] = codigo
+        return codigo
+
+
+TEXTOS = TablaTextos()
+
+
+class PrediccionCompacta:
+    """
+    Predicción de un municipio ya aplanada en cuanto llega: un array de enteros y otro de
+    códigos de texto, ambos por filas (día x campo). Sustituye al árbol de diccionarios de
+    AEMET, que por municipio son miles de objetos pequeños con claves repetidas.
+    """
+    __slots__ = ("codigo_municipio", "nombre", "provincia", "dias", "enteros", "textos")
+
+    def __init__(self, codigo_municipio, nombre, provincia, dias, enteros, textos):
+        self.codigo_municipio = codigo_municipio
+        self.nombre = nombre
+        self.provincia = provincia
+        self.dias = dias
+        self.enteros = enteros
+        self.textos = textos
+
+    @classmethod
+    def _desde_columnas(cls, codigo_municipio, nombre, provincia, columnas):
+        dias = len(columnas['fecha'])
+        enteros = array.array('i', [
+            NULO_ENTERO if valor is None else valor
+            for fila in zip(*(columnas[columna] for columna in CAMPOS_ENTEROS)) for valor in fila
+        ])
+        textos = array.array('H', [
+            TEXTOS.codigo(valor) for fila in zip(*(columnas[columna] for columna in CAMPOS_TEXTO)) for valor in fila
+        ])
+        return cls(codigo_municipio, sys.intern(nombre) if nombre else nombre,
+                   sys.intern(provincia) if provincia else provincia, dias, enteros, textos)
+
+    @classmethod
+    def desde_aemet(cls, codigo_municipio, nombre, prediccion):
+        """
+        Convierte la respuesta de AEMET (lista de predicciones) de un municipio.
+        """
+        columnas = aplanar_lote([{"codigo_municipio": codigo_municipio, "nombre": nombre, "prediccion": prediccion}])
+        provincia = columnas['provincia'][0] if columnas['provincia'] else None
+        return cls._desde_columnas(codigo_municipio, nombre, provincia, columnas)
+
+    @classmethod
+    def desde_dict(cls, registro):
+        """
+        Reconstruye la predicción desde su forma JSON (a_dict) o desde un registro antiguo
+        con la respuesta completa de AEMET en 'prediccion'.
+        """
+        if "prediccion" in registro:
+            return cls.desde_aemet(registro["codigo_municipio"], registro.get("nombre"), registro["prediccion"])
+        return cls._desde_columnas(registro["codigo_municipio"], registro.get("nombre"),
+                                   registro.get("provincia"), registro["columnas"])
+
+    def _valores_dia(self, dia):
+        nt, ne = len(CAMPOS_TEXTO), len(CAMPOS_ENTEROS)
+        textos = [TEXTOS.textos[codigo] for codigo in self.textos[dia * nt:(dia + 1) * nt]]
+        enteros = [None if valor == NULO_ENTERO else valor for valor in self.enteros[dia * ne:(dia + 1) * ne]]
+        return textos, enteros
+
+    def columnas(self, fecha=None):
+        """
+        Columnas de ESQUEMA para los días de la predicción (solo los de 'fecha' si se indica).
+        """
+        columnas = {campo.columna: [] for campo in ESQUEMA}
+        nt = len(CAMPOS_TEXTO)
+        for dia in range(self.dias):
+            if fecha and TEXTOS.textos[self.textos[dia * nt + POSICION_FECHA]] != fecha:
+                continue
+            textos, enteros = self._valores_dia(dia)
+            columnas['codigo_municipio'].append(self.codigo_municipio)
+            columnas['nombre'].append(self.nombre)
+            columnas['provincia'].append(self.provincia)
+            for columna, valor in zip(CAMPOS_TEXTO, textos):
+                columnas[columna].append(valor)
+            for columna, valor in zip(CAMPOS_ENTEROS, enteros):
+                columnas[columna].append(valor)
+        return columnas
+
+    def a_dict(self):
+        # Forma JSON para el diario, el NDJSON y los shards
+        columnas = self.columnas()
+        return {
+            "codigo_municipio": self.codigo_municipio,
+            "nombre": self.nombre,
+            "provincia": self.provincia,
+            "columnas": {campo.columna: columnas[campo.columna] for campo in CAMPOS_DIA},
+        }
+
+
+def aplanar_compactas(predicciones, fecha=None):
+    """
+    Equivalente a aplanar_lote para un lote de PrediccionCompacta.
+    """
+    columnas = {campo.columna: [] for campo in ESQUEMA}
+    for prediccion in predicciones:
+        for columna, valores in prediccion.columnas(fecha).items():
+            columnas[columna].extend(valores)
+    return columnas
+
+
+class EscritorPredicciones:
+    """
+    Destino en streaming de las predicciones (PrediccionCompacta, o diccionarios que se
+    convierten al llegar): se agrupan en lotes pequeños, se pasan a columnas y se escriben en el CSV (y opcionalmente como líneas NDJSON),
+    de modo que la memoria no crece con el número de municipios.
+
+    Por defecto el CSV solo contiene el día actual; con todos_los_dias=True se escriben
+    los siete días de la predicción. Con 'ruta_parquet' cada lote se escribe además como
+    un row group de un fichero Parquet tipado, y 'ruta_csv' puede omitirse. Con un
+    'detector' de cambios solo se escriben las filas nuevas o modificadas.
+    """
+    def __init__(self, ruta_csv, ruta_ndjson=None, fecha=None, todos_los_dias=False, tamano_lote=100,
+                 ruta_parquet=None, detector=None):
+        self.ruta_csv = ruta_csv
+        self.ruta_ndjson = ruta_ndjson
+        self.ruta_parquet = ruta_parquet
+        self.detector = detector
+        self.fecha = None if todos_los_dias else (fecha or fecha_hoy())
+        self.tamano_lote = tamano_lote
+        self.lock = threading.Lock()
+        self.lote = []
+        self.municipios = 0
+        self.filas = 0
+        self._csv = None
+        if ruta_csv:
+            self._csv = open(ruta_csv, 'w', newline='', encoding='utf-8')
+            self._writer = csv.writer(self._csv)
+            self._writer.writerow(CABECERA)
+        self._ndjson = open(ruta_ndjson, 'w', encoding='utf-8') if ruta_ndjson else None
+        self._parquet = None
+        if ruta_parquet:
+            # pyarrow solo se importa si se pide salida Parquet
+            from parquet_writer import EscritorParquet
+            self._parquet = EscritorParquet(ruta_parquet)
+
+    def escribir(self, municipio):
+        if not isinstance(municipio, PrediccionCompacta):
+            municipio = PrediccionCompacta.desde_dict(municipio)
+        with self.lock:
+            self.lote.append(municipio)
+            if self._ndjson:
+                self._ndjson.write(a_texto(municipio.a_dict()) + "\n")
+            self.municipios += 1
+            if len(self.lote) >= self.tamano_lote:
+                self._volcar()
+
+    def _volcar(self):
+        if not self.lote:
+            return
+        if not self._csv and not self._parquet:
+            # Solo salida NDJSON: no hace falta aplanar
+            self.lote = []
+            return
+        inicio = time.perf_counter()
+        columnas = aplanar_compactas(self.lote, self.fecha)
+        if self.detector:
+            columnas = self.detector.filtrar(columnas)
+        if self._csv:
+            self._writer.writerows(filas_csv(columnas))
+        if self._parquet:
+            self._parquet.escribir(columnas)
+        self.filas += len(columnas['fecha'])
+        METRICAS.observar("escritura_lote_s", time.perf_counter() - inicio)
+        METRICAS.incrementar("filas_escritas_total", len(columnas['fecha']))
+        self.lote = []
+
+    def cerrar(self):
+        with self.lock:
+            self._volcar()
+            if self._csv:
+                self._csv.close()
+            if self._parquet:
+                self._parquet.cerrar()
+            if self._ndjson:
+                self._ndjson.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
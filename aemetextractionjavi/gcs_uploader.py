@@ -0,0 +1,130 @@
+import concurrent.futures
+import datetime
+import gzip
+import io
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from metrics import METRICAS
+
+# Por encima de este tamaño la subida es reanudable y por trozos (múltiplo de 256 KiB)
+TAMANO_TROZO = int(os.getenv("GCS_TAMANO_TROZO", str(8 * 1024 * 1024)))
+# Un objeto comprimido se prepara en memoria hasta este tamaño y a partir de ahí en disco
+MEMORIA_MAXIMA = 64 * 1024 * 1024
+# Formatos que ya van comprimidos y no ganan nada con gzip
+SIN_COMPRIMIR = (".parquet", ".gz", ".zip")
+TIPOS_CONTENIDO = {
+    ".csv": "text/csv",
+    ".json": "application/json",
+    ".ndjson": "application/x-ndjson",
+    ".parquet": "application/vnd.apache.parquet",
+}
+
+_cliente = None
+_lock_cliente = threading.Lock()
+
+
+def obtener_cliente_storage():
+    """
+    Cliente de Cloud Storage compartido por todo el proceso. Con STORAGE_EMULATOR_HOST
+    se conecta sin credenciales a un GCS local (p. ej. fake-gcs-server).
+    """
+    global _cliente
+    with _lock_cliente:
+        if _cliente is None:
+            from google.cloud import storage
+
+            if os.getenv("STORAGE_EMULATOR_HOST"):
+                from google.auth.credentials import AnonymousCredentials
+
+                _cliente = storage.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT", "local"),
+                                          credentials=AnonymousCredentials())
+            else:
+                _cliente = storage.Client()
+        return _cliente
+
+
+def ruta_destino(nombre, fecha=None):
+    # Misma organización que hasta ahora: output/<fecha>/<nombre del fichero>
+    fecha = fecha or datetime.datetime.now().strftime("%Y-%m-%d")
+    return f"output/{fecha}/{os.path.basename(nombre)}"
+
+
+def _tipo_contenido(destino):
+    return TIPOS_CONTENIDO.get(os.path.splitext(destino)[1], "application/octet-stream")
+
+
+class SubidorGCS:
+    """
+    Sube artefactos de la ejecución a un bucket reutilizando un único cliente.
+
+    Los formatos de texto se comprimen con gzip y se guardan con 'Content-Encoding: gzip'
+    (GCS los sirve descomprimidos a quien no acepte gzip). Los objetos grandes se suben
+    por trozos con subida reanudable y varios artefactos se suben en paralelo. 'cliente'
+    puede ser cualquier objeto con la interfaz bucket().blob() para pruebas sin GCS.
+    """
+    def __init__(self, bucket_name, cliente=None, comprimir=None, hilos=None, tamano_trozo=TAMANO_TROZO):
+        self.bucket_name = bucket_name
+        self.cliente = cliente or obtener_cliente_storage()
+        self.bucket = self.cliente.bucket(bucket_name)
+        self.comprimir = comprimir if comprimir is not None else os.getenv("GCS_GZIP", "1") == "1"
+        self.hilos = hilos or int(os.getenv("GCS_HILOS_SUBIDA", "4"))
+        self.tamano_trozo = tamano_trozo
+
+    def _debe_comprimir(self, destino):
+        return self.comprimir and not destino.endswith(SIN_COMPRIMIR)
+
+    def _subir(self, destino, fichero, tamano, comprimido):
+        blob = self.bucket.blob(destino)
+        if comprimido:
+            blob.content_encoding = "gzip"
+        if tamano is None or tamano > self.tamano_trozo:
+            blob.chunk_size = self.tamano_trozo
+        inicio = time.perf_counter()
+        blob.upload_from_file(fichero, size=tamano, content_type=_tipo_contenido(destino))
+        METRICAS.observar("gcs_subida_s", time.perf_counter() - inicio)
+        METRICAS.incrementar("gcs_bytes_subidos_total", tamano or 0, gzip=comprimido)
+        uri = f"gs://{self.bucket_name}/{destino}"
+        logging.info(f"🔄 Subido {uri} ({tamano or 0} bytes{', gzip' if comprimido else ''})")
+        return uri
+
+    def subir_desde_memoria(self, datos, destino):
+        """
+        Sube bytes, texto o un objeto fichero abierto en binario sin escribir nada en disco local.
+        """
+        if isinstance(datos, str):
+            datos = datos.encode("utf-8")
+        if isinstance(datos, (bytes, bytearray)):
+            datos = io.BytesIO(datos)
+
+        if not self._debe_comprimir(destino):
+            tamano = datos.getbuffer().nbytes if isinstance(datos, io.BytesIO) else None
+            return self._subir(destino, datos, tamano, comprimido=False)
+
+        with tempfile.SpooledTemporaryFile(MEMORIA_MAXIMA) as cuerpo:
+            # mtime=0 para que el mismo contenido dé siempre los mismos bytes
+            with gzip.GzipFile(fileobj=cuerpo, mode="wb", compresslevel=6, mtime=0) as gz:
+                shutil.copyfileobj(datos, gz, 1 << 20)
+            tamano = cuerpo.tell()
+            cuerpo.seek(0)
+            return self._subir(destino, cuerpo, tamano, comprimido=True)
+
+    def subir_fichero(self, ruta, destino=None):
+        destino = destino or ruta_destino(ruta)
+        with open(ruta, "rb") as f:
+            if self._debe_comprimir(destino):
+                return self.subir_desde_memoria(f, destino)
+            return self._subir(destino, f, os.path.getsize(ruta), comprimido=False)
+
+    def subir_varios(self, rutas):
+        """
+        Sube varios ficheros en paralelo y devuelve un diccionario ruta -> URI gs://.
+        """
+        rutas = [ruta for ruta in rutas if ruta]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.hilos, len(rutas)))) as pool:
+            futuros = {ruta: pool.submit(self.subir_fichero, ruta) for ruta in rutas}
+            return {ruta: futuro.result() for ruta, futuro in futuros.items()}
@@ -0,0 +1,150 @@
+import concurrent.futures
+import datetime
+import logging
+import os
+from collections import namedtuple
+
+from connection import AemetAPIClient
+from metrics import METRICAS
+from serialization import a_texto, decodificar_datos, leer_ndjson
+from structured_logging import ProgresoMuestreado
+
+# Ventana máxima (en días) que acepta AEMET por petición de valores climatológicos diarios:
+# con todas las estaciones a la vez el rango es corto; para una estación concreta, mucho mayor
+VENTANA_TODAS_ESTACIONES = int(os.getenv("AEMET_VENTANA_HISTORICO_TODAS", "15"))
+VENTANA_ESTACION = int(os.getenv("AEMET_VENTANA_HISTORICO_ESTACION", "180"))
+
+# Directorio persistente con un NDJSON por trozo descargado (permite reanudar el backfill)
+DIRECTORIO_HISTORICO = os.getenv("AEMET_DIR_HISTORICO", "historico")
+PATRON_TROZO = "historico_{inicio}_{fin}_{estacion}.ndjson"
+PATRON_ANIO = "historico_{anio}.ndjson"
+
+# Un trozo del backfill: rango de fechas (ambas incluidas) y estación (None = todas)
+Trozo = namedtuple("Trozo", ["inicio", "fin", "estacion"])
+
+
+def _fecha(valor):
+    return valor if isinstance(valor, datetime.date) else datetime.date.fromisoformat(valor)
+
+
+def dividir_rango(inicio, fin, ventana):
+    """
+    Divide [inicio, fin] en ventanas consecutivas de como mucho 'ventana' días. Ninguna
+    ventana cruza de un año a otro, para poder cerrar y consolidar cada año por separado.
+    """
+    inicio, fin = _fecha(inicio), _fecha(fin)
+    rangos = []
+    while inicio <= fin:
+        fin_ventana = min(fin, inicio + datetime.timedelta(days=ventana - 1), datetime.date(inicio.year, 12, 31))
+        rangos.append((inicio, fin_ventana))
+        inicio = fin_ventana + datetime.timedelta(days=1)
+    return rangos
+
+
+def planificar_trozos(inicio, fin, estaciones=None):
+    # Sin lista de estaciones se usa el endpoint de todas las estaciones, que es el que menos peticiones necesita
+    if not estaciones:
+        return [Trozo(i, f, None) for i, f in dividir_rango(inicio, fin, VENTANA_TODAS_ESTACIONES)]
+    return [Trozo(i, f, estacion) for estacion in estaciones for i, f in dividir_rango(inicio, fin, VENTANA_ESTACION)]
+
+
+def ruta_trozo(trozo, directorio=DIRECTORIO_HISTORICO):
+    return os.path.join(directorio, PATRON_TROZO.format(
+        inicio=trozo.inicio.isoformat(), fin=trozo.fin.isoformat(), estacion=trozo.estacion or "todas"))
+
+
+def url_trozo(base_url, trozo):
+    fechas = f"fechaini/{trozo.inicio.isoformat()}T00:00:00UTC/fechafin/{trozo.fin.isoformat()}T23:59:59UTC"
+    if trozo.estacion:
+        return f"{base_url}/valores/climatologicos/diarios/datos/{fechas}/estacion/{trozo.estacion}"
+    return f"{base_url}/valores/climatologicos/diarios/datos/{fechas}/todasestaciones"
+
+
+def _guardar_trozo(ruta, registros):
+    # Escritura atómica: un trozo existe en disco solo si está completo
+    tmp = f"{ruta}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for registro in registros:
+            f.write(a_texto(registro) + "\n")
+    os.replace(tmp, ruta)
+
+
+def descargar_trozo(cliente, trozo, directorio=DIRECTORIO_HISTORICO):
+    """
+    Descarga un trozo y lo guarda en disco. Devuelve el número de registros o None si ha fallado.
+    """
+    etiqueta = f"{trozo.estacion or 'todas'} {trozo.inicio}..{trozo.fin}"
+    with METRICAS.tramo("historico_trozo", estacion=trozo.estacion or "todas", inicio=trozo.inicio.isoformat()):
+        registros = cliente.obtener_datos(url_trozo(cliente.base_url, trozo), etiqueta, decodificar=decodificar_datos)
+    if registros is None:
+        METRICAS.incrementar("historico_trozos_fallidos_total")
+        return None
+    _guardar_trozo(ruta_trozo(trozo, directorio), registros)
+    METRICAS.incrementar("historico_registros_total", len(registros))
+    return len(registros)
+
+
+def consolidar_anio(anio, trozos, directorio=DIRECTORIO_HISTORICO):
+    """
+    Junta en un único NDJSON los trozos de un año ya completo.
+    """
+    ruta = os.path.join(directorio, PATRON_ANIO.format(anio=anio))
+    tmp = f"{ruta}.tmp"
+    registros = 0
+    with open(tmp, "w", encoding="utf-8") as f:
+        for trozo in sorted(trozos):
+            for registro in leer_ndjson(ruta_trozo(trozo, directorio)):
+                f.write(a_texto(registro) + "\n")
+                registros += 1
+    os.replace(tmp, ruta)
+    logging.info(f"📦 Año {anio} consolidado en '{ruta}' ({registros} registros)")
+    return ruta
+
+
+def backfill_historico(inicio, fin, estaciones=None, api_keys=None, hilos=None, directorio=DIRECTORIO_HISTORICO):
+    """
+    Descarga los valores climatológicos diarios entre 'inicio' y 'fin' (fechas ISO o date).
+
+    El rango se divide en la mayor ventana que admite AEMET y los trozos se reparten entre
+    varios hilos que comparten el cliente, así que el planificador de claves reparte las
+    peticiones por todo el conjunto de API keys. Cada trozo se guarda en disco en cuanto
+    llega: al volver a lanzar el mismo backfill solo se piden los trozos que faltan.
+    Devuelve la lista de trozos que han fallado.
+    """
+    os.makedirs(directorio, exist_ok=True)
+    cliente = AemetAPIClient(api_keys)
+    hilos = hilos or int(os.getenv("AEMET_HILOS_HISTORICO", str(min(16, 2 * max(1, len(cliente.api_keys))))))
+
+    trozos = planificar_trozos(inicio, fin, estaciones)
+    pendientes = [trozo for trozo in trozos if not os.path.exists(ruta_trozo(trozo, directorio))]
+    print(f"🗓️ Backfill histórico {inicio} → {fin}: {len(trozos)} trozos, {len(trozos) - len(pendientes)} ya descargados, "
+          f"{len(pendientes)} pendientes con {hilos} hilos.")
+
+    fallidos = []
+    progreso = ProgresoMuestreado(len(pendientes), "Backfill histórico")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="historico_hilo") as pool:
+        futuros = {pool.submit(descargar_trozo, cliente, trozo, directorio): trozo for trozo in pendientes}
+        for futuro in concurrent.futures.as_completed(futuros):
+            trozo = futuros[futuro]
+            try:
+                registros = futuro.result()
+            except Exception as e:
+                logging.error(f"❌ Trozo {trozo} con error: {e}")
+                registros = None
+            if registros is None:
+                fallidos.append(trozo)
+            progreso.avanzar()
+
+    # Los años sin trozos pendientes se consolidan en un único fichero
+    por_anio = {}
+    for trozo in trozos:
+        por_anio.setdefault(trozo.inicio.year, []).append(trozo)
+    for anio, trozos_anio in sorted(por_anio.items()):
+        if not any(trozo in fallidos for trozo in trozos_anio):
+            consolidar_anio(anio, trozos_anio, directorio)
+
+    logging.info(f"📶 Estadísticas HTTP: {cliente.estadisticas_conexion()}")
+    print(f"✅ Backfill terminado: {len(trozos) - len(fallidos)} trozos completos, {len(fallidos)} fallidos"
+          + (" (vuelve a lanzarlo para reintentarlos)" if fallidos else ""))
+    return fallidos
+
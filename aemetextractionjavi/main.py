@@ -1,21 +1,35 @@
 from main_menu import cargar_municipios, cargar_predicciones, formato_hms, limpiar_archivos_generados, subir_a_bucket
+from metrics import METRICAS
+from gcs_uploader import SubidorGCS, ruta_destino
+from serialization import a_texto
+from structured_logging import configurar_logging
 import time
 import logging
+import argparse
 
 
-# Configurar logging si aún no está configurado
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Logging estructurado (JSON por línea) a través de una cola, fuera del bucle de extracción
+configurar_logging()
 
-def main():
-    limpiar_archivos_generados()
+# Función para guardar el informe de métricas en el bucket junto a la salida del día,
+# directamente desde memoria
+def archivar_informe(informe, bucket_name="aemetextractionjavi"):
+    if not informe:
+        return
+    try:
+        SubidorGCS(bucket_name).subir_desde_memoria(a_texto(informe), ruta_destino("informe_ejecucion.json"))
+    except Exception as e:
+        logging.error(f"❌ No se pudo archivar el informe de métricas: {e}")
+
+def main(reanudar=False):
+    # Al reanudar se conservan los archivos de la ejecución interrumpida
+    if not reanudar:
+        limpiar_archivos_generados()
     hora_inicio = time.time()
     print("🔄 Iniciando proceso completo...")
-    cargar_municipios()
+    municipios = cargar_municipios()
     carga_municipios=time.time()
-    cargar_predicciones()
+    cargar_predicciones(reanudar=reanudar, municipios=municipios)
     carga_predicciones=time.time()
     hora_fin = time.time()
     print("🔄 Proceso completo")
@@ -25,7 +39,61 @@ def main():
     print(f"⏱️ Carga de predicciones: {formato_hms(duracion_predicciones)}")
     duracion = hora_fin - hora_inicio
     print(f"⏱️ Duración total del proceso: {formato_hms(duracion)}")
+    # Informe JSON con el desglose por etapa (HTTP, esperas, conversión, GCS, BigQuery)
+    archivar_informe(METRICAS.exportar())
 
     
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Extracción de predicciones de AEMET por municipio")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reanuda la ejecución del día a partir de su diario y solo pide los municipios pendientes")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="Reparte la extracción en N procesos locales, cada uno con su subconjunto de API keys")
+    parser.add_argument("--cloud-run-task", action="store_true",
+                        help="Ejecuta solo el shard de esta tarea (CLOUD_RUN_TASK_INDEX/CLOUD_RUN_TASK_COUNT) y lo sube al bucket")
+    parser.add_argument("--merge", action="store_true",
+                        help="Fusiona las salidas de los shards del bucket y las carga en BigQuery")
+    parser.add_argument("--historico", nargs=2, metavar=("INICIO", "FIN"),
+                        help="Backfill de valores climatológicos diarios entre dos fechas (AAAA-MM-DD); se puede relanzar para reanudarlo")
+    parser.add_argument("--estaciones", nargs="+", metavar="IDEMA",
+                        help="Con --historico, limita el backfill a estas estaciones (por defecto, todas)")
+    parser.add_argument("--endpoints", metavar="NOMBRES",
+                        help="Extrae en una sola ejecución varios endpoints separados por comas (diaria,horaria,observacion) y sube sus CSV al bucket")
+    args = parser.parse_args()
+
+    if args.endpoints:
+        from batch_extraction import extraer_endpoints
+
+        hora_inicio = time.time()
+        municipios = cargar_municipios()
+        resultado = extraer_endpoints(args.endpoints.split(","), municipios=municipios)
+        rutas = [r["ruta"] for r in resultado.values()]
+        subir_a_bucket(rutas[0], "aemetextractionjavi", *rutas[1:])
+        print(f"⏱️ Duración total del proceso: {formato_hms(time.time() - hora_inicio)}")
+        archivar_informe(METRICAS.exportar())
+    elif args.historico:
+        from historico import backfill_historico
+
+        hora_inicio = time.time()
+        backfill_historico(*args.historico, estaciones=args.estaciones)
+        print(f"⏱️ Duración total del proceso: {formato_hms(time.time() - hora_inicio)}")
+        METRICAS.exportar()
+    elif args.shards or args.cloud_run_task or args.merge:
+        from sharding import ejecutar_shards_locales, ejecutar_tarea_cloud_run, fusionar_shards
+
+        hora_inicio = time.time()
+        if args.merge:
+            fusionar_shards(bucket_name="aemetextractionjavi")
+        else:
+            if not args.resume:
+                limpiar_archivos_generados()
+            municipios = cargar_municipios()
+            if args.cloud_run_task:
+                ejecutar_tarea_cloud_run(municipios)
+            else:
+                ejecutar_shards_locales(args.shards, municipios)
+                fusionar_shards()
+        print(f"⏱️ Duración total del proceso: {formato_hms(time.time() - hora_inicio)}")
+        METRICAS.exportar()
+    else:
+        main(reanudar=args.resume)
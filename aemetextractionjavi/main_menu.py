@@ -1,85 +1,175 @@
 
-from connection import AemetAPIClient, procesar_municipios_sin_hilos
-import pandas as pd
+from connection import procesar_municipios_sin_hilos, procesar_municipios_async
+from api_key_manager import APIKeyManager
+from checkpoint import DiarioEjecucion
+from dead_letter import ColaFallidos, reprocesar_cola
+from flattener import EscritorPredicciones
+from catalog import cargar_catalogo
+from change_detection import DetectorCambios
+from metrics import METRICAS
+from serialization import desde_texto, leer_ndjson
+from gcs_uploader import SubidorGCS
+from utils import api_keys_entorno
 import datetime
 import logging
 import time
 import json
-import csv
 import os
-from google.cloud import storage
-from google.cloud import bigquery
 
-# Esta función carga un archivo Excel que contiene información sobre municipios,
-# extrae los códigos de los municipios y sus nombres, y guarda esta información en un archivo JSON.
+# Esta función carga el catálogo de municipios (códigos y nombres) a partir del Excel del INE
+# y guarda esta información en un archivo JSON. El Excel solo se vuelve a procesar si cambia su
+# contenido; el resto de veces se abre la versión binaria precompilada del catálogo.
+@METRICAS.medir("cargar_municipios")
 def cargar_municipios():
 
-    # Cargar el archivo Excel, saltando la primera fila para obtener los encabezados correctos
-    df = pd.read_excel('diccionario24.xlsx', engine='openpyxl', skiprows=1)
+    catalogo = cargar_catalogo('diccionario24.xlsx')
+    municipio_list = catalogo.como_lista()
 
-    # Combinar cpro y cmun para crear el código del municipio, manteniendo los ceros a la izquierda
-    df['codigo_municipio'] = df['CPRO'].astype(str).str.zfill(2) + df['CMUN'].astype(str).str.zfill(3)
-
-    # Extraer las columnas requeridas: 'codigo_municipio' y 'NOMBRE'
-    municipio_df = df[['codigo_municipio', 'NOMBRE']]
-
-    # Crear una lista de diccionarios con el codigo_municipio y nombre
-    municipio_list = municipio_df.to_dict(orient='records')
-
-    # Guardar la lista en un archivo JSON
+    # Guardar la lista en un archivo JSON compacto para otros procesos (combine, shards...)
     with open('municipios.json', 'w', encoding='utf-8') as f:
-        json.dump(municipio_list, f, indent=4, ensure_ascii=False)
+        json.dump(municipio_list, f, ensure_ascii=False)
 
-    print("Archivo JSON 'municipios.json' creado exitosamente.")
+    print(f"Archivo JSON 'municipios.json' creado exitosamente ({len(municipio_list)} municipios).")
+    return municipio_list
 
-# Función para cargar predicciones con manejo de errores, reintentos, logging y limitación de tasa
-def cargar_predicciones():
+# Función para cargar predicciones con manejo de errores, reintentos, logging y limitación de tasa.
+# Con reanudar=True se recarga el diario de la ejecución del día y solo se piden los municipios que faltan.
+def cargar_predicciones(reanudar=False, municipios=None):
 
-    # Configurar el cliente de la API de AEMET
-    client = AemetAPIClient()
+    # Un único planificador de claves para toda la ejecución: la pasada diferida hereda las
+    # ventanas de uso y las penalizaciones de la principal en lugar de empezar de cero
+    gestor_claves = APIKeyManager(api_keys_entorno())
 
-    # Cargar los municipios desde el archivo JSON
-    with open("municipios.json", "r", encoding="utf-8") as f:
-        municipios = json.load(f)
+    # Municipios del catálogo precompilado (sin releer municipios.json)
+    if municipios is None:
+        municipios = cargar_catalogo('diccionario24.xlsx').como_lista()
 
-    # Solo los primeros 10
-    municipios = municipios[:10]  
+    # Límite opcional para pruebas (por defecto se procesan todos los municipios)
+    limite = os.getenv("AEMET_LIMITE_MUNICIPIOS")
+    if limite:
+        municipios = municipios[:int(limite)]
 
-    # Procesar los municipios sin hilos
-    # Esto significa que se procesarán de forma secuencial, lo que puede ser más fácil de depurar
-    # y manejar errores, pero puede ser más lento que el procesamiento en paralelo.
-    predicciones, fallidos = procesar_municipios_sin_hilos(municipios, client.api_keys)
-
-    # Guardar las predicciones en un archivo JSON
-    #y en un CSV añadiendo la fecha actual al nombre del archivo
+    # Diario de la ejecución para poder reanudarla si el proceso muere a mitad
     fecha = datetime.datetime.now().strftime("%Y-%m-%d")
-    output_file = f"predicciones_municipios_{fecha}.json"
-    final_file = f"predicciones_municipios_{fecha}.csv"
-
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(predicciones, f, indent=4, ensure_ascii=False)
-
-    print(f"\n✅ Municipios procesados correctamente: {len(predicciones)}")
+    # (AEMET_DIARIO_DIR puede apuntar a un volumen persistente montado en el job de Cloud Run)
+    diario = DiarioEjecucion(os.path.join(os.getenv("AEMET_DIARIO_DIR", "."), f"diario_ejecucion_{fecha}.ndjson"))
+    # Cola de fallidos del día: los municipios que fallan esperan a la pasada diferida
+    cola = ColaFallidos(os.path.join(os.getenv("AEMET_DIARIO_DIR", "."), f"cola_fallidos_{fecha}.json"))
+
+    escritor, final_file, ndjson_file = crear_escritor_salida(fecha)
+    with escritor:
+        if reanudar:
+            completados, _ = diario.cargar()
+            pendientes = [m for m in municipios if m["codigo_municipio"] not in completados]
+            print(f"⏯️ Reanudando ejecución: {len(municipios) - len(pendientes)} municipios ya completados, {len(pendientes)} pendientes.")
+            codigos = {m["codigo_municipio"] for m in municipios}
+            for codigo, prediccion in completados.items():
+                if codigo in codigos:
+                    escritor.escribir(prediccion)
+            # Los que ya están en la cola de fallidos no vuelven a la pasada principal. Los que
+            # se recuperaron antes del corte (ya en el diario) salen de la cola para no duplicarlos
+            cola.cargar()
+            for codigo in completados:
+                cola.resolver(codigo)
+            cola.guardar()
+            municipios = [m for m in pendientes if m["codigo_municipio"] not in cola]
+            del completados
+        else:
+            diario.reiniciar()
+            cola.reiniciar()
+
+        # Modo de extracción: 'async' mantiene varios municipios en vuelo a la vez,
+        # 'secuencial' procesa uno detrás de otro, lo que es más fácil de depurar
+        modo = os.getenv("AEMET_MODO_EXTRACCION", "async")
+        try:
+            with METRICAS.tramo("extraccion", modo=modo, municipios=len(municipios)) as tramo:
+                if modo == "secuencial":
+                    _, fallidos = procesar_municipios_sin_hilos(
+                        municipios, gestor_claves.api_keys, diario=diario, destino=escritor.escribir, acumular=False,
+                        gestor_claves=gestor_claves)
+                else:
+                    # Sin tope explícito: empieza en AEMET_CONCURRENCIA y se adapta hasta AEMET_CONCURRENCIA_MAX
+                    _, fallidos = procesar_municipios_async(
+                        municipios, gestor_claves.api_keys, diario=diario, destino=escritor.escribir,
+                        acumular=False, gestor_claves=gestor_claves)
+                tramo["fallidos"] = len(fallidos)
+            for municipio in fallidos:
+                cola.anadir(municipio)
+            cola.guardar()
+
+            # Pasada diferida con su propia concurrencia y presupuesto (AEMET_REINTENTO_DIFERIDO=0 la desactiva)
+            if os.getenv("AEMET_REINTENTO_DIFERIDO", "1") == "1":
+                reprocesar_cola(cola, gestor_claves.api_keys, diario=diario, destino=escritor.escribir,
+                                gestor_claves=gestor_claves)
+            fallidos = cola.fallidos()
+        finally:
+            # Volcar el último lote también si la extracción se corta con una excepción
+            diario.cerrar()
+
+    print(f"\n✅ Municipios procesados correctamente: {escritor.municipios}")
     print(f"❌ Municipios con error después de reintentos: {len(fallidos)}")
 
-    #Si hay municipios fallidos, imprimir sus códigos y nombres
+    #Si hay municipios fallidos, imprimir sus códigos, nombres y el motivo
     if fallidos:
         for municipio in fallidos:
-            print(f" - {municipio['codigo_municipio']} ({municipio['nombre']})")
-    print(f"✅ Predicciones guardadas en '{output_file}'")
-
-    # Convertir el archivo JSON a CSV
-    convertir_json_a_csv(output_file, final_file)
-    print(f"✅ CSV de predicciones por municipio creado en '{final_file}'")
-    # Subir el archivo CSV a Google Cloud Storage
-    # y cargarlo en BigQuery
-    subir_a_bucket(final_file, "aemetextractionjavi")
-    automatizar_carga_bigquery(
+            print(f" - {municipio['codigo_municipio']} ({municipio['nombre']}): {municipio['motivo']}, {municipio['intentos']} intentos")
+        print(f"📮 Quedan en la cola de fallidos '{cola.ruta}' (se reintentan con --resume)")
+    if ndjson_file:
+        print(f"✅ Predicciones guardadas en '{ndjson_file}'")
+    print(f"✅ Predicciones por municipio guardadas en '{final_file}' ({escritor.filas} filas)")
+    publicar_salida(final_file, escritor, artefactos=[ndjson_file])
+
+
+# Función para crear el destino de las predicciones de una ejecución.
+# Cada predicción se aplana y se escribe en el CSV (y opcionalmente en NDJSON) según llega,
+# sin pasar por un JSON intermedio; el CSV queda en orden de llegada.
+def crear_escritor_salida(fecha):
+    # AEMET_FORMATO_SALIDA=parquet escribe un único Parquet tipado que se usa tanto para GCS
+    # como para la carga en BigQuery; por defecto se genera el CSV
+    formato = os.getenv("AEMET_FORMATO_SALIDA", "csv")
+    final_file = f"predicciones_municipios_{fecha}.{'parquet' if formato == 'parquet' else 'csv'}"
+    ndjson_file = f"predicciones_municipios_{fecha}.ndjson" if os.getenv("AEMET_SALIDA_NDJSON", "0") == "1" else None
+
+    # Con AEMET_TODOS_LOS_DIAS=1 el CSV incluye los siete días de la predicción y no solo hoy
+    todos_los_dias = os.getenv("AEMET_TODOS_LOS_DIAS", "0") == "1"
+
+    # Con AEMET_INCREMENTAL=1 solo se escriben (y cargan) las filas que han cambiado desde la última carga
+    detector = DetectorCambios() if carga_incremental() else None
+
+    escritor = EscritorPredicciones(
+        final_file if formato != "parquet" else None,
+        ndjson_file,
+        todos_los_dias=todos_los_dias,
+        ruta_parquet=final_file if formato == "parquet" else None,
+        detector=detector,
+    )
+    return escritor, final_file, ndjson_file
+
+
+def carga_incremental():
+    return os.getenv("AEMET_INCREMENTAL", "0") == "1"
+
+
+# Función para subir el archivo final a Google Cloud Storage
+# y cargarlo en BigQuery (el Parquet se carga directamente desde el objeto subido).
+# En modo incremental las huellas solo se guardan si la carga ha ido bien, para que un fallo
+# no deje filas cambiadas sin cargar en la siguiente ejecución.
+# Los 'artefactos' (p. ej. el NDJSON de la ejecución) se archivan en el bucket junto al fichero final.
+def publicar_salida(final_file, escritor=None, artefactos=()):
+    if escritor is not None and escritor.detector and escritor.filas == 0:
+        print("✅ Ninguna predicción ha cambiado desde la última carga; no hay nada que subir.")
+        escritor.detector.guardar()
+        return
+    uri_gcs = subir_a_bucket(final_file, "aemetextractionjavi", *artefactos)
+    cargado = automatizar_carga_bigquery(
     csv_path=f"{final_file}",
     project_id="r2d-interno-dev",
     dataset_id="raw_aemet",
-    table_id="aemetextractionjavi_raw"
+    table_id=os.getenv("BQ_TABLA", "aemetextractionjavi_raw"),
+    uri_gcs=uri_gcs
 )
+    if cargado and escritor is not None and escritor.detector:
+        escritor.detector.guardar()
 
 # Función para limpiar archivos generados de ejecuciones anteriores
 # y evitar conflictos en la ejecución
@@ -109,10 +199,10 @@ def limpiar_archivos_generados():
     ]
     # Limpiar archivos JSON generados por el script
     # que empiezan con los patrones definidos
-    # y terminan con .json
+    # y terminan con .json o .ndjson
     for nombre_archivo in os.listdir():
         for patron in patrones:
-            if nombre_archivo.startswith(patron) and nombre_archivo.endswith(".json"):
+            if nombre_archivo.startswith(patron) and nombre_archivo.endswith((".json", ".ndjson")):
                 if os.path.exists(nombre_archivo):
                     os.remove(nombre_archivo)
                     print(f"🗑️ Archivo eliminado: {nombre_archivo}")
@@ -129,105 +219,36 @@ def limpiar_archivos_generados():
 def formato_hms(segundos):
     return time.strftime("%H:%M:%S", time.gmtime(segundos))
 
-# Función para convertir un archivo JSON a CSV
+# Función para convertir un archivo JSON o NDJSON a CSV
+# (se mantiene para ficheros de ejecuciones anteriores; el flujo normal escribe el CSV en streaming)
+@METRICAS.medir("convertir_json_a_csv")
 def convertir_json_a_csv(json_file, csv_file):
-    # Cargar los datos JSON desde el archivo con la codificación correcta
-    with open(json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    # Obtener la fecha de hoy en el formato requerido
-    today_date = datetime.datetime.now().strftime("%Y-%m-%dT00:00:00")
-
-    # Preparar el archivo CSV
-    with open(csv_file, 'w', newline='', encoding='utf-8') as csvfile:
-        csv_writer = csv.writer(csvfile)
-
-        # Escribir la fila de encabezado
-        header = ['codigo_municipio', 'nombre', 'provincia', 'fecha', 
-                  'probPrecipitacion_00-24', 'probPrecipitacion_00-12', 'probPrecipitacion_12-24', 'probPrecipitacion_00-06', 'probPrecipitacion_06-12', 'probPrecipitacion_12-18', 'probPrecipitacion_18-24',
-                  'cotaNieveProv_00-24', 'cotaNieveProv_00-12', 'cotaNieveProv_12-24', 'cotaNieveProv_00-06', 'cotaNieveProv_06-12', 'cotaNieveProv_12-18', 'cotaNieveProv_18-24',
-                  'estadoCielo_00-24', 'estadoCielo_00-12', 'estadoCielo_12-24', 'estadoCielo_00-06', 'estadoCielo_06-12', 'estadoCielo_12-18', 'estadoCielo_18-24',
-                  'viento_direccion_00-24', 'viento_velocidad_00-24',
-                  'viento_direccion_00-12', 'viento_velocidad_00-12',
-                  'viento_direccion_12-24', 'viento_velocidad_12-24',
-                  'viento_direccion_00-06', 'viento_velocidad_00-06',
-                  'viento_direccion_06-12', 'viento_velocidad_06-12',
-                  'viento_direccion_12-18', 'viento_velocidad_12-18',
-                  'viento_direccion_18-24', 'viento_velocidad_18-24',
-                  'rachaMax_00-24', 'rachaMax_00-12', 'rachaMax_12-24',
-                  'rachaMax_00-06', 'rachaMax_06-12', 'rachaMax_12-18','rachaMax_18-24',
-                  'temperatura_maxima', 'temperatura_minima',
-                  'sensTermica_maxima', 'sensTermica_minima',
-                  'humedadRelativa_maxima','humedadRelativa_minima',
-                  'uvMax']
-        csv_writer.writerow(header)
-
-        # Iterar a través de cada municipio y filtrar los datos para hoy
+    # Un NDJSON se lee línea a línea sin cargarlo entero; un JSON antiguo se decodifica de una vez
+    if json_file.endswith(".ndjson"):
+        data = leer_ndjson(json_file)
+    else:
+        with open(json_file, 'rb') as f:
+            data = desde_texto(f.read())
+
+    # Escribir una fila por municipio filtrada para el día actual
+    with EscritorPredicciones(csv_file) as escritor:
         for municipio in data:
-            codigo_municipio = municipio['codigo_municipio']
-            nombre = municipio['nombre']
-            provincia = municipio['prediccion'][0]['provincia']
-            
-            for dia in municipio['prediccion'][0]['prediccion']['dia']:
-                if dia['fecha'] == today_date:
-                    probPrecipitacion = [periodo['value'] if periodo.get('value') else 'null' for periodo in dia['probPrecipitacion']]
-                    cotaNieveProv = [periodo['value'] if periodo.get('value') else 'null' for periodo in dia['cotaNieveProv']]
-                    estadoCielo = [periodo['descripcion'] if periodo.get('descripcion') else 'null' for periodo in dia['estadoCielo']]
-                    viento_direccion = [periodo['direccion'] if periodo.get('direccion') else 'null' for periodo in dia['viento']]
-                    viento_velocidad = [periodo['velocidad'] if periodo.get('velocidad') else 'null' for periodo in dia['viento']]
-                    rachaMax = [periodo['value'] if periodo.get('value') else 'null' for periodo in dia['rachaMax']]
-                    temperatura_maxima = dia['temperatura']['maxima'] if dia['temperatura'].get('maxima') else 'null'
-                    temperatura_minima = dia['temperatura']['minima'] if dia['temperatura'].get('minima') else 'null'
-                    sensTermica_maxima = dia['sensTermica']['maxima'] if dia['sensTermica'].get('maxima') else 'null'
-                    sensTermica_minima = dia['sensTermica']['minima'] if dia['sensTermica'].get('minima') else 'null'
-                    humedadRelativa_maxima = dia['humedadRelativa']['maxima'] if dia['humedadRelativa'].get('maxima') else 'null'
-                    humedadRelativa_minima = dia['humedadRelativa']['minima'] if dia['humedadRelativa'].get('minima') else 'null'
-                    uvMax = dia.get('uvMax', 'null')
-
-                    # Asegurarse de que todas las listas tengan la longitud correcta (7 elementos)
-                    probPrecipitacion += ['null'] * (7 - len(probPrecipitacion))
-                    cotaNieveProv += ['null'] * (7 - len(cotaNieveProv))
-                    estadoCielo += ['null'] * (7 - len(estadoCielo))
-                    viento_direccion += ['null'] * (7 - len(viento_direccion))
-                    viento_velocidad += ['null'] * (7 - len(viento_velocidad))
-                    rachaMax += ['null'] * (7 - len(rachaMax))
-
-                    # Escribir la fila en el archivo CSV
-                    csv_writer.writerow([codigo_municipio, nombre, provincia, today_date] + 
-                                        probPrecipitacion + cotaNieveProv + estadoCielo + 
-                                        viento_direccion + viento_velocidad + rachaMax + 
-                                        [temperatura_maxima, temperatura_minima, sensTermica_maxima, sensTermica_minima, humedadRelativa_maxima, humedadRelativa_minima, uvMax])
+            escritor.escribir(municipio)
 
     print("El archivo JSON se ha convertido a CSV y se ha filtrado para el día actual.")
 
-# Función para subir un archivo CSV a Google Cloud Storage
-def subir_a_bucket(csv_file_local, bucket_name):
-
-    today_date = datetime.datetime.now().strftime("%Y-%m-%d")
-    # Crear la ruta de destino en el bucket
-    # usando la fecha actual
-    # y el nombre del archivo local
-    # para evitar conflictos de nombres
-    # y mantener la organización
-    # de los archivos en el bucket
-    destination_blob_name = f"output/{today_date}/{csv_file_local.split('/')[-1]}"
-
-    # Crear el cliente de Google Cloud Storage
-    # y subir el archivo CSV
-    # al bucket especificado
-    # usando la ruta de destino creada
-    # y el nombre del archivo local
-    # para evitar conflictos de nombres
-    # y mantener la organización
-    # de los archivos en el bucket
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    blob = bucket.blob(destination_blob_name)
-    blob.upload_from_filename(csv_file_local)
-
-    print(f"🔄 Archivos subidos a gs://{bucket_name}/{destination_blob_name}")
-
-# Función para comprobar si el archivo CSV no está vacío
+# Función para subir el archivo final a Google Cloud Storage.
+# Si se indican más archivos se suben en paralelo con él; los de texto van comprimidos con gzip.
+@METRICAS.medir("subir_a_bucket")
+def subir_a_bucket(csv_file_local, bucket_name, *otros_archivos):
+    # La ruta de destino es output/<fecha>/<nombre del archivo> para mantener
+    # la organización de los archivos en el bucket
+    uris = SubidorGCS(bucket_name).subir_varios([csv_file_local, *otros_archivos])
+
+    print(f"🔄 Archivos subidos a {', '.join(uris.values())}")
+    return uris[csv_file_local]
+
+# Función para comprobar si el archivo de salida (CSV o Parquet) no está vacío
 def verificar_csv_no_vacio(csv_path):
     # Comprobar si el archivo CSV existe y no está vacío
     if os.path.isfile(csv_path) and os.path.getsize(csv_path) > 0:
@@ -263,10 +284,14 @@ def borrar_datos_tabla(client, project_id, dataset_id, table_id):
     logging.info(f"🗑️ Se han borrado los datos existentes en la tabla '{table_ref}'.")
 
 # Función para cargar el CSV en BigQuery
-def cargar_csv_a_bigquery(client, csv_path, project_id, dataset_id, table_id):
+# Con reemplazar=True un único job WRITE_TRUNCATE sustituye el contenido de la tabla de forma
+# atómica (los lectores ven los datos anteriores o los nuevos, nunca la tabla vacía)
+def cargar_csv_a_bigquery(client, csv_path, project_id, dataset_id, table_id, reemplazar=False):
     # Cargar el CSV en BigQuery
     # usando el cliente de BigQuery
     # y el ID del proyecto, dataset y tabla
+    from google.cloud import bigquery
+
     table_ref = f"{project_id}.{dataset_id}.{table_id}"
     
     # Configurar el trabajo de carga
@@ -277,7 +302,10 @@ def cargar_csv_a_bigquery(client, csv_path, project_id, dataset_id, table_id):
         source_format=bigquery.SourceFormat.CSV,
         skip_leading_rows=1,
         autodetect=False,
-        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        # Se mantiene el esquema de la tabla existente también al reemplazarla
+        schema=client.get_table(table_ref).schema,
+        write_disposition=(bigquery.WriteDisposition.WRITE_TRUNCATE if reemplazar
+                           else bigquery.WriteDisposition.WRITE_APPEND),
         schema_update_options=[],
         field_delimiter=",",
         quote_character='"',
@@ -312,25 +340,72 @@ def cargar_csv_a_bigquery(client, csv_path, project_id, dataset_id, table_id):
     logging.info(f"✅ Carga completada: {len(headers)} columnas + campo 'fecha_carga' en '{table_ref}'.")
 
 # Función principal para automatizar la carga de datos a BigQuery
-# y manejar errores, reintentos, logging y limitación de tasa
-def automatizar_carga_bigquery(csv_path, project_id, dataset_id, table_id):
+# y manejar errores, reintentos, logging y limitación de tasa.
+# Si el fichero es Parquet se carga con su esquema tipado, desde 'uri_gcs' si se indica.
+# La estrategia (BQ_ESTRATEGIA_CARGA) puede ser:
+#  - 'particion': reemplaza atómicamente la partición del día (por defecto con Parquet)
+#  - 'merge': carga en staging y hace MERGE por codigo_municipio + fecha
+#  - 'reemplazo': reemplaza atómicamente toda la tabla con un job WRITE_TRUNCATE (por defecto con CSV)
+#  - 'delete_append': borra toda la tabla y después añade los datos; entre los dos pasos la tabla
+#    queda vacía o a medias, así que solo se usa si se pide explícitamente
+@METRICAS.medir("automatizar_carga_bigquery")
+def automatizar_carga_bigquery(csv_path, project_id, dataset_id, table_id, uri_gcs=None, estrategia=None):
     logging.info("🚀 Iniciando proceso de carga de datos a BigQuery...")
 
-    # Comprobar si el archivo CSV no está vacío
+    # Comprobar si el archivo no está vacío
     if not verificar_csv_no_vacio(csv_path):
-        return
+        return False
+
+    es_parquet = csv_path.endswith(".parquet")
+    estrategia = estrategia or os.getenv("BQ_ESTRATEGIA_CARGA") or (
+        ("merge" if carga_incremental() else "particion") if es_parquet else "reemplazo")
+
+    # Una salida incremental solo trae filas cambiadas: reemplazar la tabla o la partición perdería el resto
+    if carga_incremental() and estrategia != "merge":
+        logging.error(f"❌ La carga incremental requiere la estrategia 'merge' (Parquet), no '{estrategia}'.")
+        return False
+
+    # Las librerías de BigQuery solo se cargan en esta etapa (importarlas cuesta casi un segundo)
+    from google.cloud import bigquery
+    from bigquery_loader import cargar_parquet_a_bigquery, cargar_con_estrategia
 
     # Configurar el cliente de BigQuery
     client = bigquery.Client()
+    table_ref = f"{project_id}.{dataset_id}.{table_id}"
+
+    if estrategia == "reemplazo":
+        if not tabla_existe(client, project_id, dataset_id, table_id):
+            return False
+        if es_parquet:
+            cargar_parquet_a_bigquery(client, uri_gcs or csv_path, table_ref,
+                                      write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE)
+        else:
+            cargar_csv_a_bigquery(client, csv_path, project_id, dataset_id, table_id, reemplazar=True)
+        logging.info("🎯 Proceso finalizado correctamente.")
+        return True
+
+    if estrategia != "delete_append":
+        # Las estrategias atómicas por partición o MERGE necesitan la salida tipada (fecha y fecha_carga como DATE)
+        if not es_parquet:
+            logging.error(f"❌ La estrategia '{estrategia}' requiere AEMET_FORMATO_SALIDA=parquet.")
+            return False
+        cargar_con_estrategia(client, estrategia, uri_gcs or csv_path, table_ref, datetime.date.today())
+        logging.info("🎯 Proceso finalizado correctamente.")
+        return True
 
     # Comprobar si la tabla existe en BigQuery
     if not tabla_existe(client, project_id, dataset_id, table_id):
-        return
+        return False
 
     # Borrar los datos existentes en la tabla de BigQuery
     borrar_datos_tabla(client, project_id, dataset_id, table_id)
 
-    # Cargar el CSV en BigQuery
-    cargar_csv_a_bigquery(client, csv_path, project_id, dataset_id, table_id)
+    if es_parquet:
+        # Cargar el Parquet en BigQuery sin pasar por CSV
+        cargar_parquet_a_bigquery(client, uri_gcs or csv_path, table_ref)
+    else:
+        # Cargar el CSV en BigQuery
+        cargar_csv_a_bigquery(client, csv_path, project_id, dataset_id, table_id)
 
     logging.info("🎯 Proceso finalizado correctamente.")
+    return True
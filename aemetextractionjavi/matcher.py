@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import re
+from collections import defaultdict
+from functools import lru_cache
+
+from utils import normalizar
+
+try:
+    from fuzzywuzzy import fuzz
+
+    def _similitud(a, b):
+        return fuzz.ratio(a, b)
+except ImportError:
+    import difflib
+
+    def _similitud(a, b):
+        return round(difflib.SequenceMatcher(None, a, b).ratio() * 100)
+
+# Separadores de los nombres cooficiales ("Agurain/Salvatierra", "Alegría-Dulantzi")
+SEPARADORES = re.compile(r"\s*[/\-]\s*")
+# Resultado de una búsqueda exacta cuyas partes apuntan a municipios distintos
+AMBIGUO = object()
+# Artículo pospuesto del INE: "Rozas de Madrid, Las" -> "Las Rozas de Madrid"
+ARTICULO_POSPUESTO = re.compile(r"^(.*),\s*(EL|LA|LOS|LAS|L'|ES|SA|SES|ELS|O|A|OS|AS)$")
+
+
+def _trigramas(texto):
+    texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _con_articulo(forma):
+    # La forma tal cual y, si lleva el artículo pospuesto, también con el artículo delante
+    formas = [forma]
+    m = ARTICULO_POSPUESTO.match(forma)
+    if m:
+        articulo = m.group(2)
+        formas.append(f"{articulo}{m.group(1)}" if articulo.endswith("'") else f"{articulo} {m.group(1)}")
+    return formas
+
+
+def nombres_completos(nombre):
+    """
+    Formas normalizadas del nombre completo: tal cual y con el artículo pospuesto delante.
+    """
+    return _con_articulo(normalizar(nombre).strip())
+
+
+def fragmentos(nombre):
+    """
+    Formas normalizadas de cada parte de un nombre cooficial o compuesto
+    ("Agurain/Salvatierra" -> AGURAIN, SALVATIERRA), en el orden en que aparecen y sin
+    las del nombre completo.
+    """
+    completos = nombres_completos(nombre)
+    formas = []
+    for parte in SEPARADORES.split(normalizar(nombre).strip()):
+        for forma in _con_articulo(parte) if parte else ():
+            if forma not in completos and forma not in formas:
+                formas.append(forma)
+    return formas
+
+
+def variantes(nombre):
+    """
+    Formas normalizadas bajo las que se puede encontrar un nombre, en orden: las del nombre
+    completo primero y después las de cada una de sus partes.
+    """
+    return nombres_completos(nombre) + fragmentos(nombre)
+
+
+class IndiceMunicipios:
+    """
+    Índice para emparejar nombres de municipio con su código: primero búsqueda exacta por
+    nombre normalizado (incluidas las variantes cooficiales) y, si no hay coincidencia,
+    búsqueda aproximada sobre los candidatos que comparten más trigramas.
+
+    Los nombres completos se indexan antes que los fragmentos, de modo que una parte de un
+    nombre compuesto ("Valdemoro" en "Valdemoro-Sierra") nunca tapa el nombre completo de
+    otro municipio. Los fragmentos que comparten varios municipios no se indexan.
+    """
+    def __init__(self, municipios, umbral=85, candidatos=10):
+        self.umbral = umbral
+        self.candidatos = candidatos
+        self.exactos = {}
+        self.claves = []
+        self.codigos = []
+        self.trigramas = defaultdict(list)
+        self._memo = {}
+
+        por_fragmento = defaultdict(set)
+        for municipio in municipios:
+            nombre = municipio.get("nombre") or municipio.get("NOMBRE")
+            codigo = municipio["codigo_municipio"]
+            for forma in nombres_completos(nombre):
+                # Dos municipios con el mismo nombre completo: se queda el primero, como siempre
+                self.exactos.setdefault(forma, codigo)
+                self._indexar(forma, codigo)
+            for forma in fragmentos(nombre):
+                por_fragmento[forma].add(codigo)
+
+        for forma, codigos in por_fragmento.items():
+            if len(codigos) == 1 and forma not in self.exactos:
+                codigo = next(iter(codigos))
+                self.exactos[forma] = codigo
+                self._indexar(forma, codigo)
+
+    def _indexar(self, forma, codigo):
+        posicion = len(self.claves)
+        self.claves.append(forma)
+        self.codigos.append(codigo)
+        for trigrama in _trigramas(forma):
+            self.trigramas[trigrama].append(posicion)
+
+    def _exacto(self, nombre):
+        # El nombre completo manda; si no está, sus partes solo cuentan si todas las que se
+        # encuentran apuntan al mismo municipio ("Madrid-Getafe" es ambiguo y queda sin emparejar)
+        for forma in nombres_completos(nombre):
+            if forma in self.exactos:
+                return self.exactos[forma]
+        codigos = {self.exactos[forma] for forma in fragmentos(nombre) if forma in self.exactos}
+        if len(codigos) > 1:
+            return AMBIGUO
+        return codigos.pop() if codigos else None
+
+    def _aproximado(self, consulta):
+        votos = defaultdict(int)
+        for trigrama in _trigramas(consulta):
+            for posicion in self.trigramas.get(trigrama, ()):
+                votos[posicion] += 1
+        # Empates por orden de indexado: el resultado no depende del orden de los sets (PYTHONHASHSEED)
+        mejores = sorted(votos, key=lambda posicion: (-votos[posicion], posicion))[:self.candidatos]
+
+        mejor_codigo, mejor_puntuacion = None, 0
+        for posicion in mejores:
+            puntuacion = _similitud(consulta, self.claves[posicion])
+            if puntuacion > mejor_puntuacion:
+                mejor_codigo, mejor_puntuacion = self.codigos[posicion], puntuacion
+        return mejor_codigo if mejor_puntuacion >= self.umbral else None
+
+    def emparejar(self, nombre):
+        if not nombre:
+            return None
+        consulta = normalizar(nombre).strip()
+        if consulta in self._memo:
+            return self._memo[consulta]
+
+        codigo = self._exacto(nombre)
+        if codigo is AMBIGUO:
+            logging.warning(f"⚠️ '{nombre}' coincide con varios municipios, se deja sin emparejar.")
+            codigo = None
+        elif codigo is None:
+            codigo = self._aproximado(consulta)
+        self._memo[consulta] = codigo
+        return codigo
+
+    def emparejar_lote(self, nombres):
+        return [self.emparejar(nombre) for nombre in nombres]
+
+
+@lru_cache(maxsize=4)
+def _indice_cacheado(ruta, _mtime):
+    with open(ruta, "r", encoding="utf-8") as f:
+        return IndiceMunicipios(json.load(f))
+
+
+def indice_desde_fichero(ruta):
+    """
+    Índice reutilizable entre llamadas; se reconstruye solo si cambia el fichero de municipios.
+    """
+    return _indice_cacheado(os.path.abspath(ruta), os.path.getmtime(ruta))
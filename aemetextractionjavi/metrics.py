@@ -0,0 +1,205 @@
+import array
+import contextlib
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+# Límites (en segundos) de los buckets de los histogramas para el exportador de Prometheus
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _clave(nombre, etiquetas):
+    return nombre, tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+def _percentil(ordenados, p):
+    return ordenados[min(len(ordenados) - 1, int(len(ordenados) * p))]
+
+
+class RegistroMetricas:
+    """
+    Métricas de una ejecución: contadores, histogramas y tramos (spans) por etapa.
+
+    Es deliberadamente ligero (un lock y listas en memoria) para poder llamarlo en cada
+    petición HTTP. Al terminar se vuelca como informe JSON y, si se pide, se exporta a
+    Prometheus u OpenTelemetry.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        with self.lock:
+            self.inicio = time.time()
+            self.contadores = {}
+            self.histogramas = {}
+            self.tramos = []
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        clave = _clave(nombre, etiquetas)
+        with self.lock:
+            self.contadores[clave] = self.contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, **etiquetas):
+        clave = _clave(nombre, etiquetas)
+        with self.lock:
+            valores = self.histogramas.get(clave)
+            if valores is None:
+                valores = self.histogramas[clave] = array.array("d")
+            valores.append(valor)
+
+    @contextlib.contextmanager
+    def tramo(self, nombre, **atributos):
+        """
+        Mide un bloque de código como tramo de la ejecución y como histograma '<nombre>_s'.
+        """
+        inicio = time.time()
+        inicio_mono = time.perf_counter()
+        error = None
+        try:
+            yield atributos
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duracion = time.perf_counter() - inicio_mono
+            self.observar(f"{nombre}_s", duracion)
+            with self.lock:
+                self.tramos.append({
+                    "nombre": nombre,
+                    "inicio": round(inicio, 3),
+                    "duracion_s": round(duracion, 4),
+                    "atributos": dict(atributos),
+                    "error": error,
+                })
+
+    def medir(self, nombre):
+        # Decorador equivalente a envolver toda la función en un tramo
+        def decorador(funcion):
+            @functools.wraps(funcion)
+            def envoltura(*args, **kwargs):
+                with self.tramo(nombre):
+                    return funcion(*args, **kwargs)
+            return envoltura
+        return decorador
+
+    def informe(self):
+        with self.lock:
+            contadores = [{"nombre": n, "etiquetas": dict(e), "valor": v} for (n, e), v in sorted(self.contadores.items())]
+            histogramas = []
+            for (nombre, etiquetas), valores in sorted(self.histogramas.items()):
+                ordenados = sorted(valores)
+                histogramas.append({
+                    "nombre": nombre,
+                    "etiquetas": dict(etiquetas),
+                    "n": len(ordenados),
+                    "suma": round(sum(ordenados), 4),
+                    "min": round(ordenados[0], 4),
+                    "p50": round(_percentil(ordenados, 0.5), 4),
+                    "p90": round(_percentil(ordenados, 0.9), 4),
+                    "p99": round(_percentil(ordenados, 0.99), 4),
+                    "max": round(ordenados[-1], 4),
+                })
+            return {
+                "inicio": round(self.inicio, 3),
+                "duracion_s": round(time.time() - self.inicio, 3),
+                "pid": os.getpid(),
+                "contadores": contadores,
+                "histogramas": histogramas,
+                "tramos": list(self.tramos),
+            }
+
+    def guardar_informe(self, ruta=None):
+        ruta = ruta or os.getenv("AEMET_INFORME_METRICAS", "informe_ejecucion.json")
+        informe = self.informe()
+        with open(ruta, "w", encoding="utf-8") as f:
+            json.dump(informe, f, ensure_ascii=False, indent=2)
+        logging.info(f"📈 Informe de métricas guardado en '{ruta}'")
+        return informe
+
+    def texto_prometheus(self):
+        """
+        Métricas en el formato de exposición de Prometheus (válido para el textfile collector
+        de node_exporter o para un Pushgateway).
+        """
+        def etiquetas_texto(etiquetas, extra=()):
+            pares = list(etiquetas) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}" if pares else ""
+
+        lineas = []
+        with self.lock:
+            for (nombre, etiquetas), valor in sorted(self.contadores.items()):
+                lineas.append(f"aemet_{nombre}{etiquetas_texto(etiquetas)} {valor}")
+            for (nombre, etiquetas), valores in sorted(self.histogramas.items()):
+                for limite in BUCKETS:
+                    cuenta = sum(1 for v in valores if v <= limite)
+                    lineas.append(f"aemet_{nombre}_bucket{etiquetas_texto(etiquetas, [('le', limite)])} {cuenta}")
+                lineas.append(f"aemet_{nombre}_bucket{etiquetas_texto(etiquetas, [('le', '+Inf')])} {len(valores)}")
+                lineas.append(f"aemet_{nombre}_sum{etiquetas_texto(etiquetas)} {sum(valores)}")
+                lineas.append(f"aemet_{nombre}_count{etiquetas_texto(etiquetas)} {len(valores)}")
+        return "\n".join(lineas) + "\n"
+
+    def exportar_prometheus(self):
+        # Con AEMET_PUSHGATEWAY se empuja al Pushgateway; si no, se escribe un fichero .prom
+        pushgateway = os.getenv("AEMET_PUSHGATEWAY")
+        texto = self.texto_prometheus()
+        if pushgateway:
+            import requests
+
+            url = f"{pushgateway.rstrip('/')}/metrics/job/aemetextractionjavi"
+            requests.put(url, data=texto.encode("utf-8"), timeout=10).raise_for_status()
+            logging.info(f"📈 Métricas enviadas al Pushgateway {pushgateway}")
+            return
+        ruta = os.getenv("AEMET_FICHERO_PROMETHEUS", "metricas_aemet.prom")
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(texto)
+        logging.info(f"📈 Métricas de Prometheus guardadas en '{ruta}'")
+
+    def exportar_opentelemetry(self):
+        # Requiere opentelemetry-sdk y un MeterProvider configurado (p. ej. con el exportador OTLP)
+        try:
+            from opentelemetry import metrics as otel_metrics
+        except ImportError:
+            logging.error("❌ AEMET_EXPORTADOR_METRICAS=otel requiere el paquete 'opentelemetry-api'.")
+            return
+        medidor = otel_metrics.get_meter("aemetextractionjavi")
+        with self.lock:
+            contadores = list(self.contadores.items())
+            histogramas = [(clave, list(valores)) for clave, valores in self.histogramas.items()]
+        instrumentos = {}
+        for (nombre, etiquetas), valor in contadores:
+            if nombre not in instrumentos:
+                instrumentos[nombre] = medidor.create_counter(f"aemet.{nombre}")
+            instrumentos[nombre].add(valor, dict(etiquetas))
+        for (nombre, etiquetas), valores in histogramas:
+            if nombre not in instrumentos:
+                instrumentos[nombre] = medidor.create_histogram(f"aemet.{nombre}", unit="s" if nombre.endswith("_s") else "1")
+            for valor in valores:
+                instrumentos[nombre].record(valor, dict(etiquetas))
+        logging.info("📈 Métricas enviadas a OpenTelemetry")
+
+    def exportar(self):
+        """
+        Guarda el informe JSON y lo exporta según AEMET_EXPORTADOR_METRICAS ('prometheus' u 'otel').
+        Un fallo al exportar nunca debe tumbar la ejecución.
+        """
+        try:
+            informe = self.guardar_informe()
+            # Una sola línea JSON en el log para poder consultarla desde Cloud Logging
+            logging.info("📈 " + json.dumps({k: v for k, v in informe.items() if k != "tramos"}, ensure_ascii=False))
+            exportador = os.getenv("AEMET_EXPORTADOR_METRICAS", "").lower()
+            if exportador == "prometheus":
+                self.exportar_prometheus()
+            elif exportador in ("otel", "opentelemetry"):
+                self.exportar_opentelemetry()
+            return informe
+        except Exception as e:
+            logging.error(f"❌ No se pudieron exportar las métricas: {e}")
+            return None
+
+
+# Registro único del proceso
+METRICAS = RegistroMetricas()
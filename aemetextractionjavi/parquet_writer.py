@@ -0,0 +1,52 @@
+import datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from flattener import ESQUEMA, columnas_tipadas
+
+TIPOS_ARROW = {
+    'STRING': pa.string(),
+    'INT64': pa.int64(),
+    'DATE': pa.date32(),
+}
+
+
+def esquema_arrow():
+    return pa.schema([pa.field(nombre, TIPOS_ARROW[tipo]) for nombre, tipo in columnas_tipadas()])
+
+
+def _a_fecha(valor):
+    # AEMET devuelve las fechas como 'YYYY-MM-DDT00:00:00'
+    if not valor:
+        return None
+    return datetime.date.fromisoformat(valor[:10])
+
+
+class EscritorParquet:
+    """
+    Escribe lotes de columnas (salida de flattener.aplanar_lote) en un único fichero Parquet
+    con esquema explícito, un row group por lote. El mismo fichero sirve para el objeto en
+    GCS y para el job de carga de BigQuery.
+    """
+    def __init__(self, ruta, fecha_carga=None, compresion="zstd"):
+        self.ruta = ruta
+        self.fecha_carga = fecha_carga or datetime.date.today()
+        self.esquema = esquema_arrow()
+        self.filas = 0
+        self._writer = pq.ParquetWriter(ruta, self.esquema, compression=compresion)
+
+    def escribir(self, columnas):
+        total = len(columnas['fecha'])
+        if not total:
+            return
+        datos = {}
+        for campo, (nombre, _) in zip(ESQUEMA, columnas_tipadas()):
+            valores = columnas[campo.columna]
+            datos[nombre] = [_a_fecha(v) for v in valores] if campo.columna == 'fecha' else valores
+        datos['fecha_carga'] = [self.fecha_carga] * total
+        self._writer.write_table(pa.Table.from_pydict(datos, schema=self.esquema))
+        self.filas += total
+
+    def cerrar(self):
+        self._writer.close()
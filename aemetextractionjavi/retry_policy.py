@@ -0,0 +1,107 @@
+import asyncio
+import datetime
+import email.utils
+import logging
+import os
+import random
+import threading
+import time
+
+from metrics import METRICAS
+
+
+class PoliticaReintentos:
+    """
+    Calcula cuánto esperar antes de reintentar una petición a AEMET.
+
+    Si la respuesta trae 'Retry-After' o 'X-RateLimit-Reset' se espera justo
+    hasta ese momento; si no, se usa backoff exponencial con jitter completo.
+    Todos los reintentos de una ejecución comparten un presupuesto común para
+    que unos pocos municipios problemáticos no alarguen la ejecución sin fin.
+    """
+    def __init__(self, intentos=3, base=1.0, maximo=60.0, presupuesto=None):
+        self.intentos = intentos
+        self.base = base
+        self.maximo = maximo
+        self.presupuesto = presupuesto if presupuesto is not None else int(os.getenv("AEMET_PRESUPUESTO_REINTENTOS", "1000"))
+        self.lock = threading.Lock()
+        self.reintentos = 0
+        self.segundos_esperados = 0.0
+
+    def espera_desde_cabeceras(self, headers):
+        """
+        Devuelve los segundos indicados por las cabeceras de la respuesta o None si no hay.
+        """
+        if not headers:
+            return None
+
+        retry_after = headers.get("Retry-After")
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    fecha = email.utils.parsedate_to_datetime(retry_after)
+                    return max(0.0, (fecha - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+                except (TypeError, ValueError):
+                    pass
+
+        restantes = headers.get("X-RateLimit-Remaining")
+        reset = headers.get("X-RateLimit-Reset")
+        if reset and (restantes is None or restantes.strip() == "0"):
+            try:
+                return max(0.0, float(reset) - time.time())
+            except ValueError:
+                pass
+        return None
+
+    def backoff(self, intento):
+        # Jitter completo: espera aleatoria entre 0 y el tope exponencial del intento
+        return random.uniform(0, min(self.maximo, self.base * 2 ** (intento - 1)))
+
+    def calcular_espera(self, intento, headers=None):
+        # Lo que indica el servidor manda; el tope solo se aplica al backoff
+        espera = self.espera_desde_cabeceras(headers)
+        if espera is None:
+            espera = self.backoff(intento)
+        return espera
+
+    def consumir_reintento(self):
+        with self.lock:
+            if self.reintentos >= self.presupuesto:
+                return False
+            self.reintentos += 1
+            return True
+
+    def _anotar_espera(self, segundos):
+        with self.lock:
+            self.segundos_esperados += segundos
+
+    def reservar_espera(self, intento, headers=None):
+        """
+        Consume un reintento del presupuesto y devuelve la espera a aplicar,
+        o None si el presupuesto de la ejecución está agotado.
+        """
+        if not self.consumir_reintento():
+            logging.error("❌ Presupuesto de reintentos agotado para esta ejecución.")
+            METRICAS.incrementar("reintentos_sin_presupuesto_total")
+            return None
+        espera = self.calcular_espera(intento, headers)
+        self._anotar_espera(espera)
+        METRICAS.incrementar("reintentos_total")
+        METRICAS.observar("espera_reintento_s", espera)
+        return espera
+
+    def esperar(self, intento, headers=None):
+        espera = self.reservar_espera(intento, headers)
+        if espera is None:
+            return False
+        time.sleep(espera)
+        return True
+
+    async def esperar_async(self, intento, headers=None):
+        espera = self.reservar_espera(intento, headers)
+        if espera is None:
+            return False
+        await asyncio.sleep(espera)
+        return True
@@ -0,0 +1,106 @@
+import json
+import logging
+import os
+
+# Juego de caracteres con el que AEMET sirve los ficheros de 'datos' cuando no lo declara
+CHARSET_DATOS_AEMET = "ISO-8859-15"
+
+
+def _backend_orjson():
+    import orjson
+
+    return "orjson", orjson.loads, lambda obj: orjson.dumps(obj).decode("utf-8")
+
+
+def _backend_msgspec():
+    import msgspec
+
+    def cargar(datos):
+        try:
+            return msgspec.json.decode(datos)
+        except msgspec.DecodeError as e:
+            raise ValueError(str(e)) from e
+
+    return "msgspec", cargar, lambda obj: msgspec.json.encode(obj).decode("utf-8")
+
+
+def _backend_json():
+    return "json", json.loads, lambda obj: json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+BACKENDS = {"orjson": _backend_orjson, "msgspec": _backend_msgspec, "json": _backend_json}
+
+
+def _elegir_backend(nombre):
+    # 'auto' usa la librería más rápida disponible; la librería estándar siempre está
+    candidatos = ["orjson", "msgspec", "json"] if nombre == "auto" else [nombre, "json"]
+    for candidato in candidatos:
+        try:
+            return BACKENDS[candidato]()
+        except (ImportError, KeyError):
+            logging.debug(f"Backend JSON '{candidato}' no disponible.")
+    return _backend_json()
+
+
+# AEMET_JSON_BACKEND: 'auto' (por defecto), 'orjson', 'msgspec' o 'json'
+BACKEND, _cargar, _volcar = _elegir_backend(os.getenv("AEMET_JSON_BACKEND", "auto"))
+
+
+def desde_texto(datos):
+    """
+    Decodifica JSON desde str o bytes UTF-8. Los errores de sintaxis son siempre ValueError.
+    """
+    return _cargar(datos)
+
+
+def a_texto(obj):
+    """
+    Codifica en JSON compacto (una sola línea, sin escapar los caracteres no ASCII).
+    """
+    return _volcar(obj)
+
+
+def charset_de(content_type):
+    # "application/json;charset=ISO-8859-15" -> "ISO-8859-15"
+    for parametro in (content_type or "").split(";")[1:]:
+        clave, _, valor = parametro.strip().partition("=")
+        if clave.lower() == "charset" and valor:
+            return valor.strip('"')
+    return None
+
+
+def _a_utf8(contenido, content_type, charset_por_defecto):
+    # Sin adivinar el charset: el declarado en la respuesta o el que se indique
+    charset = (charset_de(content_type) or charset_por_defecto).lower().replace("_", "-")
+    if charset in ("utf-8", "utf8", "ascii", "us-ascii"):
+        return contenido
+    return contenido.decode(charset)
+
+
+def decodificar_respuesta(contenido, content_type=None, charset_por_defecto="utf-8"):
+    """
+    Decodifica el cuerpo (bytes) de una respuesta HTTP con el charset de su Content-Type.
+    """
+    return desde_texto(_a_utf8(contenido, content_type, charset_por_defecto))
+
+
+def decodificar_datos(contenido, content_type=None):
+    """
+    Decodifica un fichero de 'datos' de AEMET de cualquier endpoint.
+    """
+    return decodificar_respuesta(contenido, content_type, CHARSET_DATOS_AEMET)
+
+
+def leer_ndjson(ruta):
+    """
+    Generador con los objetos de un fichero NDJSON; las líneas ilegibles se registran y se saltan.
+    """
+    with open(ruta, "rb") as f:
+        for numero, linea in enumerate(f, start=1):
+            linea = linea.strip()
+            if not linea:
+                continue
+            try:
+                yield desde_texto(linea)
+            except ValueError:
+                logging.error(f"❌ Línea {numero} de '{ruta}' ilegible, se ignora.")
@@ -0,0 +1,126 @@
+import concurrent.futures
+import datetime
+import glob
+import json
+import logging
+import os
+
+from api_key_manager import APIKeyManager
+from connection import procesar_municipios_async
+from flattener import EscritorPredicciones
+from main_menu import crear_escritor_salida, publicar_salida, subir_a_bucket
+from metrics import METRICAS
+from serialization import leer_ndjson
+from utils import api_keys_entorno
+
+# Salida de cada shard: predicciones en NDJSON y municipios fallidos
+PATRON_SHARD = "predicciones_municipios_hilo_{indice}.ndjson"
+PATRON_FALLIDOS = "predicciones_municipios_hilo_{indice}_fallidos.json"
+# Informe de métricas de cada shard (cada proceso lleva su propio registro)
+PATRON_INFORME = "informe_ejecucion_hilo_{indice}.json"
+
+
+def particionar(municipios, indice, total):
+    """
+    Reparto determinista por posición: el shard 'indice' se queda con los municipios
+    cuya posición en municipios.json es congruente con él módulo 'total'.
+    """
+    return municipios[indice::total]
+
+
+def claves_para_shard(api_keys, indice, total):
+    """
+    Devuelve las claves del shard y cuántos shards comparten cada una de ellas.
+    Con al menos tantas claves como shards cada shard tiene su propio subconjunto;
+    si hay menos, varios shards usan la misma clave y se reparten su cuota.
+    """
+    if len(api_keys) >= total:
+        return api_keys[indice::total], 1
+    posicion = indice % len(api_keys)
+    return [api_keys[posicion]], len(range(posicion, total, len(api_keys)))
+
+
+def ejecutar_shard(indice, total, municipios, api_keys=None, directorio="."):
+    api_keys = api_keys or api_keys_entorno()
+    fragmento = particionar(municipios, indice, total)
+    claves, comparten = claves_para_shard(api_keys, indice, total)
+    limite = int(os.getenv("AEMET_LIMITE_POR_MINUTO", "20"))
+    gestor = APIKeyManager(claves, limite_por_minuto=max(1, limite // comparten))
+    print(f"🧩 Shard {indice + 1}/{total}: {len(fragmento)} municipios con {len(claves)} API keys")
+
+    ruta = os.path.join(directorio, PATRON_SHARD.format(indice=indice))
+    with METRICAS.tramo("shard", indice=indice, total=total, municipios=len(fragmento)):
+        with EscritorPredicciones(None, ruta) as escritor:
+            _, fallidos = procesar_municipios_async(
+                fragmento, claves, destino=escritor.escribir, acumular=False, gestor_claves=gestor)
+    METRICAS.guardar_informe(os.path.join(directorio, PATRON_INFORME.format(indice=indice)))
+
+    with open(os.path.join(directorio, PATRON_FALLIDOS.format(indice=indice)), "w", encoding="utf-8") as f:
+        json.dump(fallidos, f, ensure_ascii=False)
+
+    print(f"✅ Shard {indice + 1}/{total}: {escritor.municipios} municipios, {len(fallidos)} fallidos → '{ruta}'")
+    return ruta
+
+
+def ejecutar_shards_locales(total, municipios, api_keys=None, directorio="."):
+    # Un proceso por shard, cada uno con su propio bucle de eventos y su subconjunto de claves
+    api_keys = api_keys or api_keys_entorno()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=total) as pool:
+        futuros = [pool.submit(ejecutar_shard, i, total, municipios, api_keys, directorio) for i in range(total)]
+        return [futuro.result() for futuro in futuros]
+
+
+def ejecutar_tarea_cloud_run(municipios, bucket_name="aemetextractionjavi"):
+    """
+    Ejecuta el shard que corresponde a esta tarea de un job de Cloud Run y sube su salida al bucket.
+    """
+    indice = int(os.getenv("CLOUD_RUN_TASK_INDEX", "0"))
+    total = int(os.getenv("CLOUD_RUN_TASK_COUNT", "1"))
+    ruta = ejecutar_shard(indice, total, municipios)
+    subir_a_bucket(ruta, bucket_name, PATRON_FALLIDOS.format(indice=indice))
+    return ruta
+
+
+def _descargar_shards(bucket_name, directorio):
+    from gcs_uploader import obtener_cliente_storage
+
+    fecha = datetime.datetime.now().strftime("%Y-%m-%d")
+    # Los objetos subidos con gzip se descargan ya descomprimidos
+    bucket = obtener_cliente_storage().bucket(bucket_name)
+    for blob in bucket.list_blobs(prefix=f"output/{fecha}/predicciones_municipios_hilo_"):
+        destino = os.path.join(directorio, blob.name.split("/")[-1])
+        blob.download_to_filename(destino)
+        logging.info(f"⬇️ Shard descargado: gs://{bucket_name}/{blob.name}")
+
+
+def fusionar_shards(directorio=".", bucket_name=None, publicar=True):
+    """
+    Junta las salidas de todos los shards en el CSV/Parquet final y lo publica en GCS y BigQuery.
+    Con 'bucket_name' primero descarga las salidas que las tareas de Cloud Run dejaron en el bucket.
+    """
+    if bucket_name:
+        _descargar_shards(bucket_name, directorio)
+
+    rutas = sorted(glob.glob(os.path.join(directorio, PATRON_SHARD.format(indice="*"))))
+    fallidos = []
+    for ruta_fallidos in sorted(glob.glob(os.path.join(directorio, PATRON_FALLIDOS.format(indice="*")))):
+        with open(ruta_fallidos, "r", encoding="utf-8") as f:
+            fallidos.extend(json.load(f))
+
+    fecha = datetime.datetime.now().strftime("%Y-%m-%d")
+    escritor, final_file, _ = crear_escritor_salida(fecha)
+    with escritor:
+        for ruta in rutas:
+            for registro in leer_ndjson(ruta):
+                escritor.escribir(registro)
+
+    print(f"\n🧩 Shards fusionados: {len(rutas)}")
+    print(f"✅ Municipios procesados correctamente: {escritor.municipios}")
+    print(f"❌ Municipios con error después de reintentos: {len(fallidos)}")
+    for municipio in fallidos:
+        print(f" - {municipio['codigo_municipio']} ({municipio['nombre']})")
+    print(f"✅ Predicciones por municipio guardadas en '{final_file}' ({escritor.filas} filas)")
+
+    if publicar:
+        publicar_salida(final_file, escritor)
+    return final_file
@@ -0,0 +1,65 @@
+import argparse
+import os
+import subprocess
+import sys
+
+# Módulos pesados que no deben cargarse al arrancar: cada etapa los importa cuando los necesita
+PROHIBIDOS_AL_ARRANCAR = [
+    "pandas",
+    "google.cloud.bigquery",
+    "google.cloud.storage",
+    "pyarrow",
+    "openpyxl",
+    "aiohttp",
+    "tqdm",
+    "dotenv",
+    "fuzzywuzzy",
+]
+
+
+def medir_arranque(modulo="main"):
+    """
+    Importa 'modulo' en un intérprete nuevo con -X importtime y devuelve el tiempo acumulado
+    de su importación (en milisegundos) y el conjunto de módulos importados.
+    """
+    salida = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    acumulado_us, importados = None, set()
+    for linea in salida.stderr.splitlines():
+        if not linea.startswith("import time:") or "|" not in linea:
+            continue
+        _, acumulado, nombre = (campo.strip() for campo in linea[len("import time:"):].split("|"))
+        if not acumulado.isdigit():
+            continue
+        importados.add(nombre)
+        if nombre == modulo:
+            acumulado_us = int(acumulado)
+    return (acumulado_us or 0) / 1000, importados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Comprueba el presupuesto de tiempo de arranque del job")
+    parser.add_argument("--modulo", default="main")
+    parser.add_argument("--presupuesto-ms", type=float, default=float(os.getenv("AEMET_PRESUPUESTO_ARRANQUE_MS", "400")))
+    parser.add_argument("--repeticiones", type=int, default=3,
+                        help="Se toma el mejor de N arranques para no depender del ruido de la máquina")
+    args = parser.parse_args()
+
+    mediciones = [medir_arranque(args.modulo) for _ in range(args.repeticiones)]
+    mejor_ms = min(ms for ms, _ in mediciones)
+    importados = mediciones[0][1]
+    cargados = [m for m in PROHIBIDOS_AL_ARRANCAR if m in importados]
+
+    print(f"⏱️ Importar '{args.modulo}': {mejor_ms:.1f} ms (presupuesto {args.presupuesto_ms:.0f} ms)")
+    errores = []
+    if mejor_ms > args.presupuesto_ms:
+        errores.append(f"el arranque supera el presupuesto en {mejor_ms - args.presupuesto_ms:.1f} ms")
+    if cargados:
+        errores.append(f"módulos pesados importados al arrancar: {', '.join(cargados)}")
+    for error in errores:
+        print(f"❌ {error}")
+    if not errores:
+        print("✅ Arranque dentro del presupuesto")
+    sys.exit(1 if errores else 0)
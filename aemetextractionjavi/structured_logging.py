@@ -0,0 +1,176 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+from metrics import METRICAS
+
+# Campos estructurados que se pueden pasar con extra={...} y que salen como claves del JSON
+CAMPOS = ("municipio", "clave", "intento", "latencia_s", "fase", "estado", "endpoint",
+          "motivo", "procesados", "total", "por_s", "omitidos")
+
+FORMATO_TEXTO = '%(asctime)s - %(levelname)s - %(message)s'
+
+
+class FormateadorJSON(logging.Formatter):
+    """
+    Una línea JSON por registro con los nombres de campo que Cloud Logging entiende
+    ('severity', 'message', 'time') más los campos estructurados del registro.
+    """
+    def format(self, record):
+        linea = {
+            "severity": record.levelname,
+            "message": record.getMessage(),
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "logger": record.name,
+            "hilo": record.threadName,
+        }
+        for campo in CAMPOS:
+            valor = getattr(record, campo, None)
+            if valor is not None:
+                linea[campo] = valor
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            linea["exception"] = record.exc_text
+        return json.dumps(linea, ensure_ascii=False, default=str)
+
+
+class ManejadorCola(logging.handlers.QueueHandler):
+    """
+    Encola los registros sin bloquear; el formateo y la escritura los hace el hilo del
+    QueueListener, fuera del bucle de extracción.
+
+    Para acotar el volumen a escala nacional, cada línea de código que registra puede
+    emitir como mucho 'max_por_linea' mensajes por ventana de 'ventana' segundos; los
+    que sobran se cuentan y se resumen en un solo mensaje al empezar la ventana siguiente.
+    Si la cola está llena el registro se descarta en lugar de esperar.
+    """
+    def __init__(self, cola, max_por_linea=None, ventana=60.0):
+        super().__init__(cola)
+        self.max_por_linea = max_por_linea if max_por_linea is not None else int(os.getenv("AEMET_LOG_MAX_POR_LINEA", "50"))
+        self.ventana = ventana
+        self.lock_muestreo = threading.Lock()
+        self.por_linea = {}
+
+    def _admitir(self, record):
+        # Devuelve (admitir, omitidos en la ventana anterior de esta línea)
+        if not self.max_por_linea or record.levelno >= logging.CRITICAL:
+            return True, 0
+        clave = (record.pathname, record.lineno)
+        ahora = time.monotonic()
+        with self.lock_muestreo:
+            inicio, emitidos, omitidos = self.por_linea.get(clave, (ahora, 0, 0))
+            anteriores = 0
+            if ahora - inicio >= self.ventana:
+                inicio, emitidos, anteriores, omitidos = ahora, 0, omitidos, 0
+            if emitidos < self.max_por_linea:
+                self.por_linea[clave] = (inicio, emitidos + 1, omitidos)
+                return True, anteriores
+            self.por_linea[clave] = (inicio, emitidos, omitidos + 1)
+        METRICAS.incrementar("logs_omitidos_total")
+        return False, 0
+
+    def prepare(self, record):
+        # Solo la traza de una excepción se resuelve aquí; el mensaje se formatea en el listener
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            METRICAS.incrementar("logs_descartados_total")
+
+    def emit(self, record):
+        admitir, omitidos = self._admitir(record)
+        if omitidos:
+            resumen = logging.LogRecord(record.name, logging.WARNING, record.pathname, record.lineno,
+                                        "Mensajes omitidos por muestreo en esta línea durante el último minuto",
+                                        None, None)
+            resumen.omitidos = omitidos
+            self.enqueue(resumen)
+        if admitir:
+            super().emit(record)
+
+
+_listener = None
+_lock_configuracion = threading.Lock()
+
+
+def _arrancar(nivel, formato):
+    global _listener
+    cola = queue.Queue(maxsize=int(os.getenv("AEMET_LOG_COLA", "10000")))
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(FormateadorJSON() if formato == "json" else logging.Formatter(FORMATO_TEXTO))
+    raiz = logging.getLogger()
+    for manejador in list(raiz.handlers):
+        if isinstance(manejador, ManejadorCola):
+            raiz.removeHandler(manejador)
+    raiz.addHandler(ManejadorCola(cola))
+    raiz.setLevel(nivel)
+    _listener = logging.handlers.QueueListener(cola, salida, respect_handler_level=False)
+    _listener.start()
+
+
+def detener_logging():
+    # Vacía la cola antes de salir para no perder los últimos mensajes
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def configurar_logging(nivel=None, formato=None):
+    """
+    Configura el logging del proceso: los registros pasan por una cola acotada y un hilo
+    los escribe en stdout, como JSON (AEMET_LOG_FORMATO=json, por defecto) o como texto.
+    """
+    nivel = nivel or os.getenv("AEMET_LOG_NIVEL", "INFO")
+    formato = formato or os.getenv("AEMET_LOG_FORMATO", "json")
+    with _lock_configuracion:
+        if _listener is not None:
+            return
+        _arrancar(nivel, formato)
+        atexit.register(detener_logging)
+        # El hilo del listener no sobrevive a un fork: cada proceso hijo (shards) arranca el suyo
+        os.register_at_fork(after_in_child=lambda: _arrancar(nivel, formato))
+
+
+class ProgresoMuestreado:
+    """
+    Progreso de un bucle largo sin una línea por elemento: como mucho un mensaje cada
+    'intervalo' segundos (AEMET_PROGRESO_SEGUNDOS) con los procesados, el total y el ritmo.
+    """
+    def __init__(self, total, mensaje="Progreso", intervalo=None):
+        self.total = total
+        self.mensaje = mensaje
+        self.intervalo = intervalo if intervalo is not None else float(os.getenv("AEMET_PROGRESO_SEGUNDOS", "15"))
+        self.lock = threading.Lock()
+        self.procesados = 0
+        self.inicio = time.monotonic()
+        self.ultimo = self.inicio
+
+    def _informar(self, procesados, ahora):
+        transcurrido = max(ahora - self.inicio, 1e-9)
+        por_s = round(procesados / transcurrido, 1)
+        logging.info(f"📊 {self.mensaje}: {procesados}/{self.total} ({100 * procesados / max(self.total, 1):.1f}%), {por_s}/s",
+                     extra={"procesados": procesados, "total": self.total, "por_s": por_s})
+
+    def avanzar(self, cantidad=1):
+        ahora = time.monotonic()
+        with self.lock:
+            self.procesados += cantidad
+            procesados = self.procesados
+            if procesados < self.total and ahora - self.ultimo < self.intervalo:
+                return
+            self.ultimo = ahora
+        self._informar(procesados, ahora)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos del job se importan por su nombre (from flattener import ...), como en main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
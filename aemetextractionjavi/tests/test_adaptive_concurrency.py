@@ -0,0 +1,77 @@
+import pytest
+
+import adaptive_concurrency
+from adaptive_concurrency import ControladorConcurrencia
+
+
+class Reloj:
+    # Reloj falso: cada respuesta registrada avanza 'paso' segundos
+    def __init__(self, paso=0.01):
+        self.ahora = 1000.0
+        self.paso = paso
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(adaptive_concurrency.time, "monotonic", reloj)
+    return reloj
+
+
+def _controlador(inicial=8, **kwargs):
+    return ControladorConcurrencia(inicial=inicial, minimo=1, maximo=16, adaptativo=True, **kwargs)
+
+
+def _repetir(controlador, reloj, latencia, veces):
+    limites = []
+    for _ in range(veces):
+        reloj.ahora += reloj.paso
+        controlador.registrar("primer_get", 200, latencia(controlador) if callable(latencia) else latencia)
+        limites.append(controlador.limite_actual)
+    return limites
+
+
+def test_escalon_de_latencia_recorta_y_el_limite_se_recupera(reloj):
+    controlador = _controlador()
+    assert _repetir(controlador, reloj, 0.05, 300)[-1] == 16
+
+    # La latencia se cuadruplica y ya no baja: primero se recorta...
+    limites = _repetir(controlador, reloj, 0.2, 2000)
+    assert min(limites) < 16
+    # ...y como recortar no la baja pasa a ser la normal y se vuelve a crecer hasta el máximo
+    assert limites[-1] == 16
+    assert controlador.latencia_base["primer_get"] > 0.1
+
+
+def test_en_el_minimo_la_latencia_actual_pasa_a_ser_la_referencia(reloj):
+    controlador = _controlador(recortes_sin_mejora=1000)
+    _repetir(controlador, reloj, 0.05, 50)
+    limites = _repetir(controlador, reloj, 1.0, 5000)
+    assert 1 in limites
+    assert limites[-1] > 1
+
+
+def test_saturacion_del_servidor_mantiene_el_limite_recortado(reloj):
+    # Servidor que atiende 4 peticiones a la vez: por encima la latencia crece con la cola
+    controlador = _controlador(inicial=2)
+    limites = _repetir(controlador, reloj, lambda c: 0.05 * max(1.0, c.limite_actual / 4), 5000)
+    assert max(limites[-2000:]) <= 10
+    assert controlador.latencia_base["primer_get"] < 0.1
+
+
+def test_picos_sueltos_de_latencia_no_mueven_la_referencia(reloj):
+    controlador = _controlador()
+    _repetir(controlador, reloj, 0.05, 300)
+    for _ in range(20):
+        _repetir(controlador, reloj, 0.05, 20)
+        controlador.registrar("primer_get", 200, 1.0)
+    assert controlador.latencia_base["primer_get"] < 0.06
+
+
+def test_429_recorta_a_la_mitad(reloj):
+    controlador = _controlador()
+    controlador.registrar("primer_get", 429, 0.05)
+    assert controlador.limite_actual == 4
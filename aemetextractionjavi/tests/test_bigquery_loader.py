@@ -0,0 +1,149 @@
+import datetime
+
+import pytest
+from google.cloud import bigquery
+
+import bigquery_loader
+import main_menu
+from bigquery_loader import cargar_con_estrategia, cargar_particion, cargar_staging_merge
+
+URI = "gs://aemetextractionjavi/2025/05/20/predicciones_municipios_2025-05-20.parquet"
+TABLA = "proyecto.dataset.predicciones"
+
+
+class _JobFalso:
+    def __init__(self, error=None):
+        self.error = error
+        self.output_rows = 10
+        self.num_dml_affected_rows = 10
+
+    def result(self):
+        if self.error:
+            raise self.error
+        return self
+
+
+class ClienteBigQueryFalso:
+    """
+    Cliente de BigQuery en memoria: registra los jobs de carga, las consultas y los borrados
+    en 'operaciones' en el orden en que se lanzan.
+    """
+    def __init__(self, error_query=None):
+        self.error_query = error_query
+        self.operaciones = []
+
+    def load_table_from_uri(self, origen, destino, job_config=None):
+        self.operaciones.append(("carga", origen, destino, job_config))
+        return _JobFalso()
+
+    def load_table_from_file(self, fichero, destino, job_config=None):
+        self.operaciones.append(("carga", fichero.read(), destino, job_config))
+        return _JobFalso()
+
+    def get_table(self, tabla):
+        return type("Tabla", (), {"schema": [bigquery.SchemaField("codigo_municipio", "STRING")]})()
+
+    def query(self, sql):
+        self.operaciones.append(("query", sql))
+        return _JobFalso(self.error_query)
+
+    def delete_table(self, tabla, not_found_ok=False):
+        self.operaciones.append(("borrado", tabla, not_found_ok))
+
+
+def test_particion_trunca_solo_la_particion_del_dia():
+    cliente = ClienteBigQueryFalso()
+    cargar_particion(cliente, URI, TABLA, datetime.date(2025, 5, 20))
+
+    [(tipo, origen, destino, config)] = cliente.operaciones
+    assert (tipo, origen, destino) == ("carga", URI, f"{TABLA}$20250520")
+    assert config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE
+    assert config.source_format == bigquery.SourceFormat.PARQUET
+    assert config.time_partitioning.field == "fecha_carga"
+
+
+def test_merge_carga_staging_fusiona_y_borra_staging():
+    cliente = ClienteBigQueryFalso()
+    cargar_staging_merge(cliente, URI, TABLA, datetime.date(2025, 5, 20))
+
+    carga, query, borrado = cliente.operaciones
+    assert carga[:3] == ("carga", URI, f"{TABLA}_staging")
+    assert carga[3].write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE
+    sql = query[1]
+    assert f"MERGE `{TABLA}` T" in sql
+    assert f"USING `{TABLA}_staging` S" in sql
+    assert "ON T.codigo_municipio = S.codigo_municipio AND T.fecha = S.fecha" in sql
+    assert borrado == ("borrado", f"{TABLA}_staging", True)
+
+
+def test_merge_fallido_tambien_borra_staging():
+    cliente = ClienteBigQueryFalso(error_query=RuntimeError("UPDATE/MERGE must match at most one source row"))
+    with pytest.raises(RuntimeError):
+        cargar_staging_merge(cliente, URI, TABLA, datetime.date(2025, 5, 20))
+
+    assert [operacion[0] for operacion in cliente.operaciones] == ["carga", "query", "borrado"]
+    assert cliente.operaciones[-1][1] == f"{TABLA}_staging"
+
+
+def test_estrategia_desconocida():
+    with pytest.raises(ValueError):
+        cargar_con_estrategia(ClienteBigQueryFalso(), "reemplazar", URI, TABLA, datetime.date(2025, 5, 20))
+    assert set(bigquery_loader.ESTRATEGIAS) == {"particion", "merge"}
+
+
+@pytest.mark.parametrize("estrategia", ["particion", "reemplazo", "delete_append"])
+def test_incremental_solo_admite_merge(estrategia, tmp_path, monkeypatch):
+    salida = tmp_path / "predicciones_municipios.parquet"
+    salida.write_bytes(b"PAR1")
+    monkeypatch.setenv("AEMET_INCREMENTAL", "1")
+    # Si la estrategia se aceptara se crearía un cliente real: el test fallaría aquí
+    monkeypatch.setattr(bigquery, "Client", lambda *a, **k: pytest.fail("no debe llegar a BigQuery"))
+
+    assert main_menu.automatizar_carga_bigquery(str(salida), "proyecto", "dataset", "predicciones",
+                                                uri_gcs=URI, estrategia=estrategia) is False
+
+
+def test_incremental_usa_merge_por_defecto(tmp_path, monkeypatch):
+    salida = tmp_path / "predicciones_municipios.parquet"
+    salida.write_bytes(b"PAR1")
+    cliente = ClienteBigQueryFalso()
+    monkeypatch.setenv("AEMET_INCREMENTAL", "1")
+    monkeypatch.delenv("BQ_ESTRATEGIA_CARGA", raising=False)
+    monkeypatch.setattr(bigquery, "Client", lambda *a, **k: cliente)
+
+    assert main_menu.automatizar_carga_bigquery(str(salida), "proyecto", "dataset", "predicciones", uri_gcs=URI) is True
+    assert [operacion[0] for operacion in cliente.operaciones] == ["carga", "query", "borrado"]
+
+
+def _csv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    salida = tmp_path / "predicciones_municipios.csv"
+    salida.write_text("codigo_municipio,probPrecipitacion_00-24\n01001,5\n", encoding="utf-8")
+    return str(salida)
+
+
+def test_csv_por_defecto_reemplaza_la_tabla_en_un_solo_job(tmp_path, monkeypatch):
+    cliente = ClienteBigQueryFalso()
+    monkeypatch.delenv("AEMET_INCREMENTAL", raising=False)
+    monkeypatch.delenv("BQ_ESTRATEGIA_CARGA", raising=False)
+    monkeypatch.setattr(bigquery, "Client", lambda *a, **k: cliente)
+
+    assert main_menu.automatizar_carga_bigquery(_csv(tmp_path, monkeypatch), "proyecto", "dataset", "predicciones") is True
+
+    # Sin DELETE previo: la tabla nunca queda vacía ni a medio cargar
+    [(tipo, contenido, destino, config)] = cliente.operaciones
+    assert (tipo, destino) == ("carga", TABLA)
+    assert config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE
+    assert contenido.startswith(b"codigo_municipio,probPrecipitacion_00_24\n")
+
+
+def test_delete_append_solo_si_se_pide(tmp_path, monkeypatch):
+    cliente = ClienteBigQueryFalso()
+    monkeypatch.delenv("AEMET_INCREMENTAL", raising=False)
+    monkeypatch.setenv("BQ_ESTRATEGIA_CARGA", "delete_append")
+    monkeypatch.setattr(bigquery, "Client", lambda *a, **k: cliente)
+
+    assert main_menu.automatizar_carga_bigquery(_csv(tmp_path, monkeypatch), "proyecto", "dataset", "predicciones") is True
+    query, carga = cliente.operaciones
+    assert query[1].startswith(f"DELETE FROM `{TABLA}`")
+    assert carga[3].write_disposition == bigquery.WriteDisposition.WRITE_APPEND
@@ -0,0 +1,52 @@
+from checkpoint import DiarioEjecucion
+
+
+def _diario(tmp_path):
+    diario = DiarioEjecucion(str(tmp_path / "diario.ndjson"), tamano_lote=1)
+    diario.reiniciar()
+    return diario
+
+
+def test_reanudar_desde_un_diario_con_la_ultima_linea_cortada(tmp_path):
+    diario = _diario(tmp_path)
+    diario.registrar_completado({"codigo_municipio": "01001", "nombre": "Alegría-Dulantzi"})
+    diario.registrar_fallido({"codigo_municipio": "01002", "nombre": "Amurrio", "motivo": "http_500"})
+    # El proceso muere a mitad del volcado: la línea queda cortada dentro de la 'í' (2 bytes en UTF-8)
+    linea = '{"estado":"ok","codigo_municipio":"01003","nombre":"Aramaio Aramaío"}\n'.encode("utf-8")
+    with open(diario.ruta, "ab") as f:
+        f.write(linea[:linea.index("í".encode("utf-8")) + 1])
+
+    reanudado = DiarioEjecucion(diario.ruta, tamano_lote=1)
+    completados, fallidos = reanudado.cargar()
+    assert list(completados) == ["01001"]
+    assert list(fallidos) == ["01002"]
+
+    # Lo que se registra al reanudar no se pega al resto de la línea cortada
+    reanudado.registrar_completado({"codigo_municipio": "01003", "nombre": "Aramaio"})
+    reanudado.cerrar()
+    completados, fallidos = DiarioEjecucion(diario.ruta).cargar()
+    assert sorted(completados) == ["01001", "01003"]
+    assert list(fallidos) == ["01002"]
+
+
+def test_ultima_linea_completa_sin_salto_se_conserva(tmp_path):
+    diario = _diario(tmp_path)
+    with open(diario.ruta, "ab") as f:
+        f.write(b'{"estado":"ok","codigo_municipio":"01001"}')
+
+    completados, _ = diario.cargar()
+    assert list(completados) == ["01001"]
+    diario.registrar_completado({"codigo_municipio": "01002"})
+    diario.cerrar()
+    completados, _ = DiarioEjecucion(diario.ruta).cargar()
+    assert sorted(completados) == ["01001", "01002"]
+
+
+def test_linea_ilegible_en_medio_se_salta(tmp_path):
+    diario = _diario(tmp_path)
+    with open(diario.ruta, "ab") as f:
+        f.write(b'{"estado":"ok","codigo_municipio":"01001"}\n{"estado":"ok","codi\n'
+                b'{"estado":"ok","codigo_municipio":"01002"}\n')
+
+    completados, _ = diario.cargar()
+    assert sorted(completados) == ["01001", "01002"]
@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+import pytest
+
+from api_key_manager import APIKeyManager
+from cache import CachePredicciones
+from connection import resolver_segundo_get
+from connection_async import AemetAsyncAPIClient
+from endpoints import DIARIA, HORARIA
+from fake_aemet import ConfiguracionFake, arrancar_servidor
+from retry_policy import PoliticaReintentos
+
+CAMPOS = {"municipio": "28079", "intento": 1, "fase": "segundo_get"}
+PAYLOAD = b'[{"nombre": "Madrid", "elaborado": "2099-01-01T08:00:00"}]'
+
+
+def test_segundo_get_200_decodifica_y_guarda(tmp_path):
+    cache = CachePredicciones(str(tmp_path))
+    datos, reintentar = resolver_segundo_get(200, {"ETag": '"v1"'}, PAYLOAD, "28079", CAMPOS, cache, "horaria_28079")
+    assert datos == [{"nombre": "Madrid", "elaborado": "2099-01-01T08:00:00"}]
+    assert not reintentar
+    assert cache.validadores("horaria_28079") == {"If-None-Match": '"v1"'}
+
+
+def test_segundo_get_304_sirve_la_cache(tmp_path):
+    cache = CachePredicciones(str(tmp_path))
+    resolver_segundo_get(200, {}, PAYLOAD, "28079", CAMPOS, cache, "28079")
+    datos, reintentar = resolver_segundo_get(304, {}, b"", "28079", CAMPOS, cache, "28079")
+    assert datos[0]["nombre"] == "Madrid" and not reintentar
+
+
+@pytest.mark.parametrize("estado, reintentar", [(429, True), (500, True), (503, True), (304, False), (403, False)])
+def test_segundo_get_errores(estado, reintentar):
+    # Sin caché un 304 no tiene de dónde servir los datos: es un error como otro cualquiera
+    assert resolver_segundo_get(estado, {}, b"error", "28079", CAMPOS) == (None, reintentar)
+
+
+def test_segundo_get_ilegible_es_value_error():
+    with pytest.raises(ValueError):
+        resolver_segundo_get(200, {}, b"[{", "28079", CAMPOS)
+
+
+def test_cliente_async_pide_cualquier_endpoint_con_su_clave_de_cache(tmp_path):
+    servidor = arrancar_servidor(ConfiguracionFake(latencia=0, jitter=0))
+    cache = CachePredicciones(str(tmp_path))
+
+    async def pedir():
+        async with AemetAsyncAPIClient(gestor_claves=APIKeyManager(["clave"], limite_por_minuto=1000),
+                                       politica=PoliticaReintentos(intentos=1), cache=cache) as cliente:
+            cliente.base_url = servidor.base_url
+            diaria = await cliente.obtener_prediccion_municipio("28079")
+            horaria = await cliente.obtener(HORARIA, "28079")
+            # La segunda vuelta se sirve desde la caché, cada endpoint desde su propia entrada
+            assert await cliente.obtener(DIARIA, "28079") == diaria
+            assert await cliente.obtener(HORARIA, "28079") == horaria
+            return diaria, horaria
+
+    try:
+        diaria, horaria = asyncio.run(pedir())
+    finally:
+        servidor.shutdown()
+
+    assert diaria[0]["prediccion"]["dia"][0]["temperatura"]
+    assert "vientoAndRachaMax" in horaria[0]["prediccion"]["dia"][0]
+    assert sorted(os.listdir(tmp_path)) == ["28079.json", "horaria_28079.json"]
+    assert servidor.contadores["segundo_get"] == 2
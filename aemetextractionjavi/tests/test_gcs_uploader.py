@@ -0,0 +1,100 @@
+import gzip
+import os
+import threading
+
+from gcs_uploader import SubidorGCS, ruta_destino
+
+
+class BlobFalso:
+    def __init__(self, bucket, nombre):
+        self.bucket = bucket
+        self.nombre = nombre
+        self.content_encoding = None
+        self.chunk_size = None
+
+    def upload_from_file(self, fichero, size=None, content_type=None):
+        self.contenido = fichero.read()
+        self.size = size
+        self.content_type = content_type
+        with self.bucket.lock:
+            self.bucket.subidos[self.nombre] = self
+
+
+class BucketFalso:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subidos = {}
+
+    def blob(self, nombre):
+        return BlobFalso(self, nombre)
+
+
+class ClienteFalso:
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, nombre):
+        return self.buckets.setdefault(nombre, BucketFalso())
+
+
+def _subidor(**kwargs):
+    cliente = ClienteFalso()
+    return SubidorGCS("bucket-pruebas", cliente=cliente, comprimir=True, **kwargs), cliente.bucket("bucket-pruebas")
+
+
+def test_texto_se_sube_comprimido_con_gzip():
+    subidor, bucket = _subidor()
+    csv = "codigo_municipio,nombre\n" + "".join(f"{i:05d},Alcalá de Henares\n" for i in range(2000))
+
+    uri = subidor.subir_desde_memoria(csv, "output/2026-01-01/predicciones.csv")
+
+    blob = bucket.subidos["output/2026-01-01/predicciones.csv"]
+    assert uri == "gs://bucket-pruebas/output/2026-01-01/predicciones.csv"
+    assert blob.content_encoding == "gzip"
+    assert blob.content_type == "text/csv"
+    assert blob.size == len(blob.contenido) < len(csv.encode("utf-8"))
+    assert gzip.decompress(blob.contenido).decode("utf-8") == csv
+    # Los objetos pequeños se suben de una vez
+    assert blob.chunk_size is None
+
+
+def test_objetos_grandes_se_suben_por_trozos():
+    subidor, bucket = _subidor(tamano_trozo=256 * 1024)
+    datos = os.urandom(1024 * 1024)
+
+    subidor.subir_desde_memoria(datos, "output/2026-01-01/grande.json")
+
+    blob = bucket.subidos["output/2026-01-01/grande.json"]
+    assert blob.chunk_size == 256 * 1024
+    assert gzip.decompress(blob.contenido) == datos
+
+
+def test_parquet_no_se_recomprime():
+    subidor, bucket = _subidor()
+    subidor.subir_desde_memoria(b"PAR1...PAR1", "output/2026-01-01/predicciones.parquet")
+
+    blob = bucket.subidos["output/2026-01-01/predicciones.parquet"]
+    assert blob.content_encoding is None
+    assert blob.contenido == b"PAR1...PAR1"
+    assert blob.content_type == "application/vnd.apache.parquet"
+
+
+def test_subir_varios_en_paralelo_sube_todos(tmp_path):
+    subidor, bucket = _subidor(hilos=4)
+    rutas = []
+    for i in range(12):
+        ruta = tmp_path / f"shard_{i}.ndjson"
+        ruta.write_text(f'{{"codigo_municipio": "{i:05d}"}}\n' * (i + 1), encoding="utf-8")
+        rutas.append(str(ruta))
+
+    uris = subidor.subir_varios(rutas + [None])
+
+    assert sorted(uris) == sorted(rutas)
+    assert len(bucket.subidos) == len(rutas)
+    for ruta in rutas:
+        destino = ruta_destino(ruta)
+        assert uris[ruta] == f"gs://bucket-pruebas/{destino}"
+        blob = bucket.subidos[destino]
+        assert blob.content_encoding == "gzip"
+        with open(ruta, "rb") as f:
+            assert gzip.decompress(blob.contenido) == f.read()
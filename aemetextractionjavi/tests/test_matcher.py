@@ -0,0 +1,92 @@
+import json
+import os
+import subprocess
+import sys
+from collections import Counter
+
+from matcher import IndiceMunicipios, indice_desde_fichero, variantes
+
+DIRECTORIO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MUNICIPIOS_JSON = os.path.join(DIRECTORIO, "municipios.json")
+
+# Los compuestos van antes que el municipio cuyo nombre contienen, como en el catálogo del INE
+MUNICIPIOS = [
+    {"codigo_municipio": "01051", "NOMBRE": "Agurain/Salvatierra"},
+    {"codigo_municipio": "08085", "NOMBRE": "Font-rubí"},
+    {"codigo_municipio": "08184", "NOMBRE": "Rubí"},
+    {"codigo_municipio": "16227", "NOMBRE": "Valdemoro-Sierra"},
+    {"codigo_municipio": "28161", "NOMBRE": "Valdemoro"},
+    {"codigo_municipio": "22901", "NOMBRE": "Azanuy-Alins"},
+    {"codigo_municipio": "22902", "NOMBRE": "Alins-Peralta"},
+    {"codigo_municipio": "28127", "NOMBRE": "Rozas de Madrid, Las"},
+]
+
+
+def test_un_fragmento_no_tapa_el_nombre_completo_de_otro_municipio():
+    indice = IndiceMunicipios(MUNICIPIOS)
+    assert indice.emparejar("Valdemoro") == "28161"
+    assert indice.emparejar("Rubí") == "08184"
+    assert indice.emparejar("Valdemoro-Sierra") == "16227"
+    assert indice.emparejar("Font-rubí") == "08085"
+
+
+def test_variantes_cooficiales_y_articulo():
+    indice = IndiceMunicipios(MUNICIPIOS)
+    assert indice.emparejar("Salvatierra") == "01051"
+    assert indice.emparejar("Agurain") == "01051"
+    assert indice.emparejar("Las Rozas de Madrid") == "28127"
+
+
+def test_fragmento_compartido_por_varios_municipios_no_se_indexa():
+    indice = IndiceMunicipios(MUNICIPIOS)
+    assert "ALINS" not in indice.exactos
+
+
+def test_catalogo_real_cada_nombre_unico_se_resuelve_a_si_mismo():
+    indice = indice_desde_fichero(MUNICIPIOS_JSON)
+    with open(MUNICIPIOS_JSON, encoding="utf-8") as f:
+        municipios = [(m.get("nombre") or m.get("NOMBRE"), m["codigo_municipio"]) for m in json.load(f)]
+    # Los nombres que se repiten en varias provincias no pueden resolverse por nombre
+    repeticiones = Counter(nombre for nombre, _ in municipios)
+    assert indice.emparejar("Valdemoro") == "28161"
+    assert indice.emparejar("Rubí") == "08184"
+    assert [(nombre, codigo) for nombre, codigo in municipios
+            if repeticiones[nombre] == 1 and indice.emparejar(nombre) != codigo] == []
+
+
+
+def test_variantes_en_orden_nombre_completo_primero():
+    assert variantes("Rozas de Madrid, Las") == ["ROZAS DE MADRID, LAS", "LAS ROZAS DE MADRID"]
+    assert variantes("Agurain/Salvatierra") == ["AGURAIN/SALVATIERRA", "AGURAIN", "SALVATIERRA"]
+
+
+def test_partes_que_apuntan_a_municipios_distintos_quedan_sin_emparejar():
+    indice = indice_desde_fichero(MUNICIPIOS_JSON)
+    assert indice.emparejar("Valdemoro/Rubí") is None
+    assert indice.emparejar("Madrid-Getafe") is None
+
+
+# Consultas con varias partes: el resultado no puede depender del orden de los sets
+_SCRIPT_HASH = """
+import json, sys
+sys.path.insert(0, sys.argv[1])
+from matcher import indice_desde_fichero
+indice = indice_desde_fichero(sys.argv[2])
+consultas = ["Valdemoro/Rubí", "Madrid-Getafe", "Salvatierra", "Vitoria-Gasteiz", "Font-rubí", "Valdemoro"]
+with open(sys.argv[2], encoding="utf-8") as f:
+    consultas += [m.get("nombre") or m.get("NOMBRE") for m in json.load(f)]
+print(json.dumps([indice.emparejar(c) for c in consultas]))
+"""
+
+
+def _emparejar_con_semilla(semilla):
+    entorno = {**os.environ, "PYTHONHASHSEED": semilla}
+    salida = subprocess.run([sys.executable, "-c", _SCRIPT_HASH, DIRECTORIO, MUNICIPIOS_JSON],
+                            env=entorno, capture_output=True, text=True, check=True).stdout
+    return json.loads(salida)
+
+
+def test_resultado_independiente_de_pythonhashseed():
+    fijo = _emparejar_con_semilla("0")
+    assert fijo[:6] == [None, None, "01051", "01059", "08085", "28161"]
+    assert _emparejar_con_semilla("4242") == fijo
@@ -0,0 +1,59 @@
+import datetime
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from flattener import aplanar_lote
+from parquet_writer import EscritorParquet, esquema_arrow
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       "fixtures", "prediccion_diaria_municipio.json")
+
+
+def _municipio():
+    with open(FIXTURE, encoding="utf-8") as f:
+        return {"codigo_municipio": "01001", "nombre": "Alegría-Dulantzi", "prediccion": json.load(f)}
+
+
+def test_ida_y_vuelta_conserva_esquema_tipos_y_nulos(tmp_path):
+    columnas = aplanar_lote([_municipio()])
+    dias = len(columnas["fecha"])
+    # Un hueco en una columna entera y otro en una de texto, como llegan de AEMET
+    columnas["uvMax"][0] = None
+    columnas["estadoCielo_00-24"][0] = None
+
+    ruta = str(tmp_path / "predicciones.parquet")
+    escritor = EscritorParquet(ruta, fecha_carga=datetime.date(2025, 5, 20))
+    escritor.escribir(columnas)
+    escritor.cerrar()
+
+    tabla = pq.read_table(ruta)
+    assert tabla.schema.equals(esquema_arrow())
+    assert tabla.num_rows == escritor.filas == dias
+    assert tabla.schema.field("fecha").type == pa.date32()
+    assert tabla.schema.field("temperatura_maxima").type == pa.int64()
+    assert tabla.schema.field("estadoCielo_00_24").type == pa.string()
+
+    leidas = tabla.to_pydict()
+    assert leidas["codigo_municipio"] == ["01001"] * dias
+    assert leidas["fecha"][0] == datetime.date.fromisoformat(columnas["fecha"][0][:10])
+    assert leidas["fecha_carga"] == [datetime.date(2025, 5, 20)] * dias
+    assert leidas["temperatura_maxima"] == columnas["temperatura_maxima"]
+    assert leidas["uvMax"][0] is None
+    assert leidas["estadoCielo_00_24"][0] is None
+    # Los días 5-7 no traen los periodos de 6 horas: salen como nulos, no como 0 ni ''
+    assert leidas["probPrecipitacion_00_06"][-1] is None
+    assert leidas["viento_velocidad_00_06"][-1] is None
+
+
+def test_lote_vacio_no_escribe_filas(tmp_path):
+    ruta = str(tmp_path / "vacio.parquet")
+    escritor = EscritorParquet(ruta)
+    escritor.escribir(aplanar_lote([]))
+    escritor.cerrar()
+
+    tabla = pq.read_table(ruta)
+    assert tabla.num_rows == 0
+    assert tabla.schema.equals(esquema_arrow())
@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+import serialization
+from serialization import BACKENDS, decodificar_datos
+
+
+# Fichero de 'datos' con caracteres que cambian de bytes entre ISO-8859-15 y UTF-8
+PREDICCION = [{
+    "nombre": "Alcalá de Henares",
+    "provincia": "Madrid",
+    "prediccion": {"dia": [{"estadoCielo": [{"descripcion": "Nubes altas", "value": "17"}],
+                            "temperatura": {"maxima": 24, "minima": -3},
+                            "viento": [{"direccion": "NE", "velocidad": 15}]}]},
+    "origen": {"copyright": "© AEMET. Autorizado el uso de la información y su reproducción citando a AEMET como autora"},
+    "coste": "0 €",
+}]
+
+
+def _backend(nombre):
+    try:
+        return BACKENDS[nombre]()
+    except ImportError:
+        pytest.skip(f"Backend JSON '{nombre}' no instalado")
+
+
+@pytest.mark.parametrize("nombre", sorted(BACKENDS))
+@pytest.mark.parametrize("content_type", [None, "application/json;charset=ISO-8859-15"])
+def test_datos_iso_8859_15_ida_y_vuelta(monkeypatch, nombre, content_type):
+    _, cargar, volcar = _backend(nombre)
+    monkeypatch.setattr(serialization, "_cargar", cargar)
+    monkeypatch.setattr(serialization, "_volcar", volcar)
+
+    contenido = json.dumps(PREDICCION, ensure_ascii=False).encode("iso-8859-15")
+    datos = decodificar_datos(contenido, content_type)
+
+    assert datos == PREDICCION
+    # Lo que se guarda en la caché o el diario vuelve a leerse igual
+    assert serialization.desde_texto(serialization.a_texto(datos).encode("utf-8")) == PREDICCION
+
+
+@pytest.mark.parametrize("nombre", sorted(BACKENDS))
+def test_charset_declarado_manda_sobre_el_de_aemet(monkeypatch, nombre):
+    monkeypatch.setattr(serialization, "_cargar", _backend(nombre)[1])
+    contenido = json.dumps(PREDICCION, ensure_ascii=False).encode("utf-8")
+    assert decodificar_datos(contenido, "application/json; charset=UTF-8") == PREDICCION
+
+
+@pytest.mark.parametrize("nombre", sorted(BACKENDS))
+def test_json_invalido_es_value_error(monkeypatch, nombre):
+    monkeypatch.setattr(serialization, "_cargar", _backend(nombre)[1])
+    with pytest.raises(ValueError):
+        decodificar_datos(b'[{"nombre": "Alcal\xe1"')
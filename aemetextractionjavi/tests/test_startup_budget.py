@@ -0,0 +1,22 @@
+import json
+import os
+import subprocess
+import sys
+
+DIRECTORIO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Dependencias pesadas que solo deben cargarse en la etapa que las usa
+PESADOS = ("pandas", "openpyxl", "pyarrow", "google.cloud")
+
+
+def test_arranque_dentro_del_presupuesto():
+    salida = subprocess.run([sys.executable, "startup_budget.py"], cwd=DIRECTORIO, capture_output=True, text=True)
+    assert salida.returncode == 0, salida.stdout + salida.stderr
+    assert "✅ Arranque dentro del presupuesto" in salida.stdout
+
+
+def test_importar_main_no_carga_dependencias_pesadas():
+    script = "import json, sys, main; print(json.dumps(sorted(sys.modules)))"
+    salida = subprocess.run([sys.executable, "-c", script], cwd=DIRECTORIO, capture_output=True, text=True, check=True)
+    modulos = json.loads(salida.stdout.splitlines()[-1])
+    cargados = [m for m in modulos if any(m == p or m.startswith(p + ".") for p in PESADOS)]
+    assert cargados == []
@@ -1,8 +1,23 @@
-import time
-import threading
-from tqdm import tqdm
-
-def espera_con_barra(segundos: int, mensaje: str = "Esperando"):
-    hilo = threading.current_thread().name
-    for _ in tqdm(range(segundos), desc=f"⏳ {mensaje} - {hilo}", ncols=150):
-        time.sleep(1)
+import os
+import unicodedata
+from functools import lru_cache
+
+def normalizar(nombre: str) -> str:
+    nfkd = unicodedata.normalize('NFKD', nombre)
+    return ''.join([c for c in nfkd if not unicodedata.combining(c)]).upper()
+
+
+@lru_cache(maxsize=None)
+def cargar_entorno():
+    # Lee el .env una sola vez por proceso; python-dotenv no se importa hasta que hace falta.
+    # En Cloud Run el fichero de claves llega montado desde Secret Manager (AEMET_FICHERO_ENTORNO)
+    from dotenv import load_dotenv
+
+    load_dotenv(os.getenv("AEMET_FICHERO_ENTORNO"))
+
+
+def api_keys_entorno():
+    # Claves AEMET_API_KEY, AEMET_API_KEY_2... del entorno (o del .env), ordenadas por nombre de
+    # variable para que todos los procesos (shards, benchmark, clientes) las numeren igual
+    cargar_entorno()
+    return [value for key, value in sorted(os.environ.items()) if key.startswith("AEMET_API_KEY")]